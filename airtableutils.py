@@ -1,31 +1,476 @@
+import gzip
+import hashlib
+import itertools
+import json
+import numbers
 import os
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
 
 from airtable import airtable
 from dotenv import load_dotenv
 load_dotenv()
 
+# airtable allows 5 requests per second per base
+REQUESTS_PER_SECOND = 5
+
+
+class TokenBucket:
+    '''
+    limits callers of acquire, across threads, to rate calls per second on average,
+    allowing bursts of up to capacity calls
+    '''
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SyncJournal:
+    '''
+    a write-ahead journal of the records a BatchWriter sends, kept as json lines at path so it outlives the process.
+    Records are identified by a hash of their kind and contents. Each chunk is recorded as sent before it is sent,
+    and then as acknowledged, with its results, as failed, with the error, or as abandoned when airtable rejected it.
+    Writes are always planned from the current data; the journal only keeps them from sending records that were
+    acknowledged, whose recorded results are returned instead, or abandoned with the same contents.
+    Records sent but never acknowledged may or may not have been applied, and are sent again if planned again.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # the entries of the journal, one per chunk, in order
+        self.entries = []
+        # record key -> the last entry for the record: its kind, status, and result or error
+        self.records = {}
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            lines = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line is cut short if the process died while writing it
+                continue
+            self.add(entry)
+
+    def key(self, kind, record):
+        ''' the identifier of a record sent with kind '''
+        return hashlib.sha1(json.dumps([kind, record], sort_keys=True, default=str).encode()).hexdigest()
+
+    def add(self, entry):
+        self.entries.append(entry)
+        results = entry.get('results') or [None] * len(entry['keys'])
+        for key, result in zip(entry['keys'], results):
+            self.records[key] = {'kind': entry['kind'], 'status': entry['status'], 'result': result,
+                                 'error': entry.get('error')}
+
+    def acknowledged(self, key):
+        ''' the result of an acknowledged record, or None '''
+        record = self.records.get(key)
+        return record['result'] if record is not None and record['status'] == 'acknowledged' else None
+
+    def abandoned(self, key):
+        ''' the error airtable rejected an abandoned record with, or None '''
+        record = self.records.get(key)
+        return record['error'] if record is not None and record['status'] == 'abandoned' else None
+
+    def failed(self):
+        ''' the entries of the chunks whose last attempt failed '''
+        return [entry for entry in self.entries if entry['status'] == 'failed'
+                and all(self.records[key]['status'] == 'failed' for key in entry['keys'])]
+
+    def record(self, status, kind, keys, **details):
+        entry = dict(status=status, kind=kind, keys=keys, time=datetime.now(timezone.utc).isoformat(), **details)
+        line = json.dumps(entry, default=str) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+            self.add(entry)
+
+    def clear(self, keep=()):
+        '''
+        forget every record once a sync is complete, except the abandoned records in keep, which are not sent
+        again while they are planned with the same contents
+        '''
+        kept = [dict(status='abandoned', kind=self.records[key]['kind'], keys=[key], error=self.abandoned(key),
+                     time=datetime.now(timezone.utc).isoformat())
+                for key in dict.fromkeys(keep) if self.abandoned(key) is not None]
+        with self.lock:
+            if kept:
+                with open(self.path + '.tmp', 'w') as f:
+                    f.writelines(json.dumps(entry) + '\n' for entry in kept)
+                os.replace(self.path + '.tmp', self.path)
+            elif os.path.exists(self.path):
+                os.remove(self.path)
+            self.entries, self.records = [], {}
+            for entry in kept:
+                self.add(entry)
+
+
+class BatchWriter:
+    '''
+    sends deletes, inserts and updates to an airtable table in chunks of up to 10 records, one request each,
+    and reads its records a page at a time (read).
+    Chunks are sent from a pool of threads, so requests overlap, while a token bucket shared by all of them
+    keeps to the rate limit. Requests rejected with 429 (too many requests) are retried with exponential backoff.
+    Records airtable rejects with another 4xx error, e.g. 422 for values it can't typecast, are abandoned.
+    With a journal (SyncJournal), a write that failed part way, in this process or an earlier one, doesn't send the
+    records that were already acknowledged when it is planned and written again.
+    '''
+
+    MAX_RECORDS_PER_REQUEST = 10
+
+    def __init__(self, connection, rate=REQUESTS_PER_SECOND, workers=4, max_retries=5, backoff=1.0, journal=None):
+        self.connection = connection
+        self.journal = journal
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        # totals over all writes. resumed counts records acknowledged in the journal, and not sent again
+        # requests and records count writes, pages count reads
+        self.stats = {'requests': 0, 'records': 0, 'pages': 0, 'retries': 0, 'resumed': 0, 'abandoned': 0,
+                      'seconds': 0.0}
+        # (kind, record, error) of the records abandoned over all writes
+        self.abandoned = []
+
+    def call(self, request, *args, **kwargs):
+        ''' make a single request, within the rate limit, retrying it with exponential backoff when throttled '''
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                return request(*args, **kwargs)
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status != 429 or attempt == self.max_retries:
+                    raise
+                with self.lock:
+                    self.stats['retries'] += 1
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def send(self, kind, chunk):
+        ''' a single request: delete, insert or update a chunk of records '''
+        if kind == 'delete':
+            result = self.call(self.connection.batch_delete, chunk)
+        elif kind == 'insert':
+            result = self.call(self.connection.batch_insert, chunk, typecast=True)
+        else:
+            result = self.call(self.connection.batch_update, chunk, typecast=True)
+
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['records'] += len(chunk)
+        return result
+
+    def read(self, **options):
+        '''
+        every record of the table matching options (fields, formula, see airtable's get_iter), read a page of
+        100 records per request. Pages share the rate limit with the writes, and are retried when throttled.
+        '''
+        records, offset = [], None
+        while True:
+            page, offset = self.call(self.connection.get_page, offset=offset, **options)
+            records += page
+            with self.lock:
+                self.stats['pages'] += 1
+            if not offset:
+                return records
+
+    def rejected(self, error):
+        ''' whether airtable rejected a request for its records, so sending them again would fail the same way '''
+        status = error.response.status_code if error.response is not None else None
+        return status is not None and 400 <= status < 500 and status != 429
+
+    def journal_record(self, status, kind, keys, **details):
+        if self.journal is not None:
+            self.journal.record(status, kind, keys, **details)
+
+    def send_chunk(self, kind, chunk):
+        '''
+        send a chunk of (position, record, journal key), journaling it. Returns (position, result) of the records
+        airtable took. When airtable rejects a chunk, its records are sent again one by one, to abandon only those
+        it rejects.
+        '''
+        records, keys = [record for _, record, _ in chunk], [key for _, _, key in chunk]
+        self.journal_record('sent', kind, keys)
+        try:
+            result = self.send(kind, records)
+        except requests.exceptions.HTTPError as e:
+            if not self.rejected(e):
+                self.journal_record('failed', kind, keys, error=str(e))
+                raise
+            if len(chunk) > 1:
+                return [taken for entry in chunk for taken in self.send_chunk(kind, [entry])]
+            self.journal_record('abandoned', kind, keys, error=str(e))
+            with self.lock:
+                self.abandoned.append((kind, records[0], str(e)))
+                self.stats['abandoned'] += 1
+            return []
+        except Exception as e:
+            self.journal_record('failed', kind, keys, error=str(e))
+            raise
+        self.journal_record('acknowledged', kind, keys, results=result)
+        return [(position, taken) for (position, _, _), taken in zip(chunk, result)]
+
+    def write(self, batches):
+        '''
+        send batches, a list of (kind, records) with kind 'delete' (records are record ids), 'insert' or 'update',
+        all at once. Returns a list with the results of each batch, in order, leaving out abandoned records.
+        A chunk that fails does not stop the others; the first error is raised once they are all done.
+        With a journal, acknowledged records are not sent again and their recorded results are returned, and records
+        abandoned before are abandoned again without being sent.
+        '''
+        start = time.perf_counter()
+        size = self.MAX_RECORDS_PER_REQUEST
+        results = [[None] * len(records) for _, records in batches]
+        chunks = []
+        for i, (kind, records) in enumerate(batches):
+            pending = []
+            for position, record in enumerate(records):
+                key = self.journal.key(kind, record) if self.journal is not None else None
+                if key is not None and self.journal.acknowledged(key) is not None:
+                    results[i][position] = self.journal.acknowledged(key)
+                    with self.lock:
+                        self.stats['resumed'] += 1
+                elif key is not None and self.journal.abandoned(key) is not None:
+                    with self.lock:
+                        self.abandoned.append((kind, record, self.journal.abandoned(key)))
+                        self.stats['abandoned'] += 1
+                else:
+                    pending.append((position, record, key))
+            chunks += [(i, kind, pending[j:j + size]) for j in range(0, len(pending), size)]
+
+        error = None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.send_chunk, kind, chunk) for _, kind, chunk in chunks]
+            for (i, _, _), future in zip(chunks, futures):
+                try:
+                    for position, result in future.result():
+                        results[i][position] = result
+                except Exception as e:
+                    error = error or e
+
+        with self.lock:
+            self.stats['seconds'] += time.perf_counter() - start
+        if error is not None:
+            raise error
+        return [[result for result in batch_results if result is not None] for batch_results in results]
+
+    @property
+    def throughput(self):
+        ''' (requests per second, records per second) over all writes '''
+        seconds = self.stats['seconds']
+        if not seconds:
+            return 0.0, 0.0
+        return self.stats['requests'] / seconds, self.stats['records'] / seconds
+
+
+class AirtableBackup:
+    '''
+    backups of an airtable table, kept in directory. Each backup is a zstd-compressed parquet file holding only
+    the records that were added, changed or deleted since the previous backup, and the manifest lists them in order.
+    restore replays them to rebuild the table as it was at any backup.
+    Field values are stored as json, a column per field, since airtable fields can hold lists.
+    '''
+
+    FORMAT = 1
+
+    def __init__(self, table_name, directory='./airtable_backups'):
+        self.table_name = table_name
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, table_name + '.manifest.json')
+
+    def manifest(self):
+        ''' the manifest: the backups of the table, oldest first '''
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {'format': self.FORMAT, 'table': self.table_name, 'backups': []}
+        if manifest['format'] != self.FORMAT:
+            raise Exception('airtable backup format ' + str(manifest['format']) + ' is not supported, expected '
+                            + str(self.FORMAT) + ': ' + self.manifest_path)
+        return manifest
+
+    def save(self, records, at=None):
+        '''
+        back up records, airtable's {'id': ..., 'fields': {...}} dicts, as the table at time at (now by default).
+        Returns the path of the new backup file.
+        '''
+        at = self.aware(at or datetime.now(timezone.utc))
+        manifest = self.manifest()
+        columns = list(dict.fromkeys(itertools.chain.from_iterable(record['fields'] for record in records)))
+
+        # records are compared by a hash of their fields, so only the changed ones are encoded
+        previous = self.state(manifest['backups'], columns=[])['hash'].to_dict()
+        hashes = [self.record_hash(record['fields']) for record in records]
+        changed = [(record, record_hash) for record, record_hash in zip(records, hashes)
+                   if previous.get(record['id']) != record_hash]
+        deleted = sorted(previous.keys() - {record['id'] for record in records})
+
+        # deleted records are stored with their ids alone
+        table = pa.table({'id': pa.array([record['id'] for record, _ in changed] + deleted, type=pa.string()),
+                          'deleted': pa.array([False] * len(changed) + [True] * len(deleted)),
+                          'hash': pa.array([record_hash for _, record_hash in changed] + [None] * len(deleted),
+                                           type=pa.string()),
+                          **{column: pa.array([json.dumps(record['fields'].get(column)) for record, _ in changed]
+                                              + ['null'] * len(deleted), type=pa.string())
+                             for column in columns}})
+
+        name = '{} {:05d} {}.parquet'.format(self.table_name, len(manifest['backups']),
+                                             at.strftime('%Y.%m.%d %H.%M.%S'))
+        path = os.path.join(self.directory, name)
+        os.makedirs(self.directory, exist_ok=True)
+        pq.write_table(table, path, compression='zstd')
+
+        manifest['backups'].append({'file': name, 'time': at.isoformat(), 'columns': columns,
+                                    'records': len(records), 'changed': len(changed), 'deleted': len(deleted)})
+        # the manifest is written aside and moved into place, so a backup either lands whole or not at all
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+        return path
+
+    def restore(self, at=None):
+        '''
+        the table as of the last backup made at or before at (the latest by default), as a frame like
+        BankGreenAirtable.df: indexed by record id, in record id order, with NaN for empty fields.
+        '''
+        backups = self.manifest()['backups']
+        if at is not None:
+            at = self.aware(at)
+            backups = [backup for backup in backups if datetime.fromisoformat(backup['time']) <= at]
+        if not backups:
+            raise Exception('no backup of ' + self.table_name + ' at or before ' + str(at) + ' in ' + self.directory)
+
+        columns = backups[-1]['columns']
+        state = self.state(backups, columns)
+        # decoding a whole column at once is much faster than a json.loads per value
+        df = pd.DataFrame({column: json.loads('[' + ','.join(state[column]) + ']') for column in columns},
+                          index=list(state.index), columns=columns)
+        # like a frame made from the records, where empty fields are missing, rather than None
+        for column in columns:
+            if df[column].dtype == object:
+                df[column] = df[column].where(df[column].notna(), np.nan)
+        return df
+
+    def state(self, backups, columns):
+        '''
+        the record hashes, and the columns of json-encoded fields, of every record after replaying backups,
+        indexed by record id
+        '''
+        tables = [pq.read_table(os.path.join(self.directory, backup['file']),
+                                columns=['id', 'deleted', 'hash'] + [column for column in columns
+                                                                     if column in backup['columns']])
+                  for backup in backups]
+        # columns missing from a backup are filled with nulls
+        state = pa.concat_tables(tables, promote_options='default').to_pandas() if tables else \
+            pd.DataFrame(columns=['id', 'deleted', 'hash'])
+        # the last backup of a record has its fields, or deleted it
+        state = state.drop_duplicates('id', keep='last')
+        state = state[~state['deleted'].astype(bool)].set_index('id').sort_index()
+        return state.reindex(columns=['hash'] + columns).astype(object).fillna('null')
+
+    def record_hash(self, fields):
+        return hashlib.sha1(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+    def aware(self, at):
+        ''' at with a timezone, taking naive datetimes as local time '''
+        return at if at.tzinfo is not None else at.astimezone()
+
+
+class PagedAirtable(airtable.Airtable):
+    ''' an airtable table that can also be read a page at a time, so each request can be paced and retried '''
+
+    def get_page(self, offset=None, **options):
+        ''' a page of up to 100 records matching options (see get_iter), and the offset of the next page or None '''
+        data = self._get(self.url_table, offset=offset, **options)
+        return data.get('records', []), data.get('offset')
+
+
+def connect(table_name):
+    ''' the airtable table, with the credentials from the environment (.env) '''
+    connection = PagedAirtable(os.getenv("base_key"), table_name, api_key=os.getenv("api_key"))
+    # reads and writes go through a BatchWriter, which paces them with its rate limit instead
+    connection.API_LIMIT = 0
+    return connection
+
 
 class BankGreenAirtable:
 
-    def __init__(self, table_name, local_df, preservation_columns=[]):
-        self.connection = airtable.Airtable(os.getenv("base_key"), table_name, api_key=os.getenv("api_key"))
-        self.connection.API_LIMIT = 0.2
+    # records modified up to this long before the cache was made are fetched again, allowing for clock skew
+    CACHE_MARGIN = timedelta(minutes=5)
+    # bump when what the cache holds changes
+    CACHE_FORMAT = 2
+
+    def __init__(self, table_name, local_df, preservation_columns=[], connection=None, writer=None, cache_path=None):
+        # connection defaults to the airtable table. Anything with the same methods will do, e.g. for testing.
+        # With a cache_path, refresh keeps the records of the table there and only fetches what changed since.
+        if connection is None:
+            connection = connect(table_name)
+        self.connection = connection
+        self.writer = writer or BatchWriter(connection)
 
         self.table_name = table_name
+        self.cache_path = cache_path
 
         self.local_df = local_df
         self.local_tags = [x for x in self.local_df['tag']]
+
+        # tag -> local row, as a dict. The first row is used for duplicate tags.
+        self.local_rows = {}
+        for row in self.local_df.to_dict(orient='records'):
+            self.local_rows.setdefault(row['tag'], row)
+
         # columns where user data will not be overwritten
         self.preservation_columns = preservation_columns
         self.refresh()
 
     def refresh(self):
-        self.records = self.connection.get_all()
+        if self.cache_path is None:
+            self.records = self.writer.read()
+            self.refresh_report = {'mode': 'full', 'fetched': len(self.records), 'records': len(self.records)}
+        else:
+            self.records = self.fetch_records()
+        self.set_records(self.records)
+
+    def set_records(self, records):
+        ''' take records as the remote table, and work out the rows to delete, insert and update '''
+        self.records = records
         self.df = pd.DataFrame([record['fields'] for record in self.records],
                                index=[record['id'] for record in self.records])
 
+        # tag -> ids of the airtable rows with that tag
+        self.tag_ids = {}
+        for record_id, tag in zip(self.df.index, self.df.tag):
+            self.tag_ids.setdefault(tag, []).append(record_id)
+
         # deletion candidates marked preserve are not deletable.
         # Must be != True, not "is not True"
         deletion_candidates_tags = self.df[self.df.preserve != True].tag  # noqa
@@ -39,26 +484,101 @@ class BankGreenAirtable:
 
         self.insert_tags = set(self.local_tags) - set(self.df.tag)
 
-    def airtable_backup(self):
-        now = datetime.now()
-        dt_string = now.strftime("%Y.%d.%m %H.%M.%S")
-        filepath = './airtable_backups/' + dt_string + ' ' + self.table_name + '.pkl'
-        self.df.to_pickle(filepath)
-        return filepath
+    def fetch_records(self):
+        '''
+        the records of the cached table, merged with the records modified since it was cached, and cache them again.
+        Records are fetched and cached with all their fields, so they can be backed up without fetching them again.
+        The whole table is listed with just its tags, to drop deleted records and check the cache. Records are
+        fetched in full when the cache is missing or disagrees with the listing. How the records were fetched is kept
+        in refresh_report.
+        '''
+        started = datetime.now(timezone.utc)
+        cache = self.read_cache()
+        records = None
+
+        if cache is None:
+            mode = 'full, no cache'
+        else:
+            since = datetime.fromisoformat(cache['fetched_at']) - self.CACHE_MARGIN
+            modified = self.writer.read(formula=self.modified_since_formula(since))
+            listed = self.writer.read(fields=['tag'])
+            records = self.merge_records(cache['records'], modified, listed)
+            mode = 'incremental' if records is not None else 'full, cache inconsistent'
+            fetched = len(modified)
+
+        if records is None:
+            records = [{'id': record['id'], 'fields': record['fields']} for record in self.writer.read()]
+            fetched = len(records)
+
+        self.write_cache({'format': self.CACHE_FORMAT, 'table': self.table_name, 'fetched_at': started.isoformat(),
+                          'records': records})
+        self.refresh_report = {'mode': mode, 'fetched': fetched, 'records': len(records)}
+        return records
+
+    def modified_since_formula(self, since):
+        ''' an airtable formula selecting the records modified after since, a datetime in utc '''
+        return "IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{}'))".format(since.strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+    def merge_records(self, cached, modified, listed):
+        '''
+        the listed records, with their fields from the modified records or else the cached ones.
+        None if a listed record is in neither, or its tag differs from the cached one.
+        '''
+        fields_by_id = {record['id']: record['fields'] for record in cached}
+        fields_by_id.update((record['id'], record['fields']) for record in modified)
+
+        records = []
+        for record in listed:
+            fields = fields_by_id.get(record['id'])
+            if fields is None or fields.get('tag') != record['fields'].get('tag'):
+                return None
+            records.append({'id': record['id'], 'fields': fields})
+        return records
+
+    def read_cache(self):
+        ''' the cached table, or None if there is none for this table in the current format '''
+        try:
+            with gzip.open(self.cache_path, 'rt') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cache.get('format') != self.CACHE_FORMAT or cache.get('table') != self.table_name:
+            return None
+        return cache
+
+    def write_cache(self, cache):
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # written aside and moved into place, so an interrupted write leaves the previous cache.
+        # json.dumps encodes in one go, where json.dump writes piece by piece, and fast compression is enough
+        with gzip.open(self.cache_path + '.tmp', 'wt', compresslevel=1) as f:
+            f.write(json.dumps(cache))
+        os.replace(self.cache_path + '.tmp', self.cache_path)
+
+    def airtable_backup(self, directory='./airtable_backups'):
+        '''
+        back up every field of every record of the remote table, as of the last refresh, storing only the records
+        changed since the last backup (see AirtableBackup). Returns the path of the backup file.
+        '''
+        return AirtableBackup(self.table_name, directory).save(self.records)
 
     def list_airtable_ids_for_tags(self, tag_list):
-        ids = [index for index, row in self.df.iterrows()
-               if row['tag'] in tag_list]
+        ids = [record_id for tag in tag_list for record_id in self.tag_ids.get(tag, [])]
         return ids
 
     def airtable_flush(self):
         ''' batch delete unnecessary ids'''
         deleted_data = self.df.loc[self.delete_ids]
-        self.connection.batch_delete(self.delete_ids)
+        self.writer.write([('delete', self.delete_ids)])
         return deleted_data
 
     def airtable_insert(self):
         '''batch insert data into airtable'''
+        return self.writer.write([('insert', self.plan_insert())])[0]
+
+    def plan_insert(self):
+        ''' the records to send to batch_insert '''
 
         # filter out unnecessary to insert tags and convert to a dictionary
         insertion_dict = self.local_df.loc[
@@ -68,56 +588,19 @@ class BankGreenAirtable:
         insertion_dict = [{k: v for k, v in item.items() if not self.true_if_empty_ish(v)}
                           for item in insertion_dict]
 
-        # insert and return result
-        return self.connection.batch_insert(insertion_dict, typecast=True)
-
-    def airtable_update(self):
-
-        # filter to only records that need updating
-        update_records = [x for x in self.records if x['id'] in self.update_ids]
-        to_be_updated = []
-
-        # filter to only the columns tha tneed updating
-        for remote_row in update_records:
-            new_record = {}
-            new_record['id'] = remote_row['id']
-            new_record['fields'] = {}
-
-            tag = remote_row['fields']['tag']
-
-            local_row_dict = self.local_df[self.local_df.tag == tag].to_dict(orient='records')[0]
+        return insertion_dict
 
-            for column in local_row_dict.keys():
+    def airtable_update(self, dry_run=False):
+        '''
+        batch update the airtable rows whose synced fields differ from the local data.
+        With dry_run nothing is sent. Either way the report of plan_update is kept in update_report,
+        and returned on a dry run.
+        '''
+        to_be_updated, self.update_report = self.plan_update()
+        if dry_run:
+            return self.update_report
 
-                # get the remote and local values and determine if they are empty
-                remote_value = remote_row['fields'].get(column)
-
-                # check for value type, since airtable returns inconsistenty
-                if isinstance(remote_value, list) and len(remote_value) > 0:
-                    remote_value = remote_value[0]
-                if isinstance(remote_value, list) and len(remote_value) == 0:
-                    remote_value = None
-
-                empty_remote = self.true_if_empty_ish(remote_value)
-                local_value = local_row_dict.get(column)
-                empty_local = self.true_if_empty_ish(local_value)
-
-                # convert local nan to None, since airtable falls over with nans
-                # important! None Values will not be written, since they are flagged in empty_local
-                if pd.isna(local_value):
-                    local_value = None
-
-                # update the non-special columns with local results
-                if column not in self.preservation_columns and not empty_local:
-                    new_record['fields'][column] = local_value
-                # allow some columns to be overridden if they are not empty
-                elif empty_remote:
-                    new_record['fields'][column] = local_value
-
-            to_be_updated.append(new_record)
-        # return to_be_updated 
-
-        return self.connection.batch_update(to_be_updated, typecast=True)
+        return self.writer.write([('update', to_be_updated)])[0]
 
         # single row update loop is here for debugging purposes. Batch update's errors are unhelpful.
         # for record in to_be_updated:
@@ -128,6 +611,103 @@ class BankGreenAirtable:
         #         import pdb; pdb.set_trace()
         #         print(e)
 
+    def airtable_sync(self):
+        '''
+        delete, insert and update at once, sharing the writer's rate limit, as planned from the last refresh.
+        If the writer has a journal, records that a sync which failed part way already wrote, in this process or an
+        earlier one, are not sent again (see BatchWriter.write). Records airtable rejected are left out of the results
+        and listed in the writer's abandoned; they are not sent again until their contents change.
+        Returns the deleted rows, and the results of the inserts and updates.
+        '''
+        to_be_updated, self.update_report = self.plan_update()
+        deleted, inserted, updated = self.writer.write([('delete', self.delete_ids),
+                                                        ('insert', self.plan_insert()),
+                                                        ('update', to_be_updated)])
+        deleted_data = self.df.loc[[result['id'] for result in deleted]]
+        # a journal of a complete sync is only kept for the records that were abandoned
+        journal = self.writer.journal
+        if journal is not None:
+            journal.clear(keep=[journal.key(kind, record) for kind, record, _ in self.writer.abandoned])
+        return deleted_data, inserted, updated
+
+    def plan_update(self):
+        '''
+        the records to send to batch_update, and a report of how many rows are updated and how many are skipped,
+        since the fields that would be written already hold the same (normalized) values in airtable.
+        '''
+        # filter to only records that need updating
+        update_ids = set(self.update_ids)
+        update_records = [x for x in self.records if x['id'] in update_ids]
+        to_be_updated = []
+
+        for remote_row in update_records:
+            fields = self.update_fields(remote_row['fields'], self.local_rows[remote_row['fields']['tag']])
+
+            # compare what would be written with what airtable holds for the same columns
+            remote_fields = {column: remote_row['fields'].get(column) for column in fields}
+            if self.fields_hash(fields) != self.fields_hash(remote_fields):
+                to_be_updated.append({'id': remote_row['id'], 'fields': fields})
+
+        skipped = len(update_records) - len(to_be_updated)
+        report = {'records': len(update_records),
+                  'updated': len(to_be_updated),
+                  'skipped': skipped,
+                  'requests_saved': (len(update_records) + 9) // 10 - (len(to_be_updated) + 9) // 10}
+        return to_be_updated, report
+
+    def update_fields(self, remote_fields, local_row_dict):
+        ''' the fields written to an airtable row to update it with a local row '''
+        fields = {}
+
+        # filter to only the columns tha tneed updating
+        for column in local_row_dict.keys():
+
+            # get the remote and local values and determine if they are empty
+            remote_value = remote_fields.get(column)
+
+            # check for value type, since airtable returns inconsistenty
+            if isinstance(remote_value, list) and len(remote_value) > 0:
+                remote_value = remote_value[0]
+            if isinstance(remote_value, list) and len(remote_value) == 0:
+                remote_value = None
+
+            empty_remote = self.true_if_empty_ish(remote_value)
+            local_value = local_row_dict.get(column)
+            empty_local = self.true_if_empty_ish(local_value)
+
+            # convert local nan to None, since airtable falls over with nans
+            # important! None Values will not be written, since they are flagged in empty_local
+            if pd.isna(local_value):
+                local_value = None
+
+            # update the non-special columns with local results
+            if column not in self.preservation_columns and not empty_local:
+                fields[column] = local_value
+            # allow some columns to be overridden if they are not empty
+            elif empty_remote:
+                fields[column] = local_value
+
+        return fields
+
+    def normalized(self, value):
+        ''' a field value as compared between airtable and local rows '''
+        # airtable returns some fields as lists, which match a local value when they hold just that value
+        if isinstance(value, list):
+            if len(value) > 1:
+                return tuple(self.normalized(item) for item in value)
+            value = value[0] if len(value) > 0 else None
+        if self.true_if_empty_ish(value):
+            return None
+        # airtable returns whole numbers as ints
+        if isinstance(value, numbers.Number) and not isinstance(value, bool):
+            return float(value)
+        return value
+
+    def fields_hash(self, fields):
+        ''' a hash of the normalized values of a row's fields '''
+        normalized = sorted((column, self.normalized(value)) for column, value in fields.items())
+        return hashlib.sha1(repr(normalized).encode()).hexdigest()
+
     def true_if_empty_ish(self, str_or_other_obj):
         if str_or_other_obj is None:
             return True
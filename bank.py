@@ -14,7 +14,48 @@ from sources.usnic.usnic import USNIC
 from maps.preferred_names import preferred_names
 from maps.id_map import id_map
 
+# source classes by the Bank slot that holds them
+SOURCE_CLASSES = {
+    'banktrack': Banktrack,
+    'bocc': BOCC,
+    'gabv': Gabv,
+    'fairfinance': Fairfinance,
+    'switchit': Switchit,
+    'custombank': Custombank,
+    'marketforces': Marketforces,
+    'wikidata': Wikidata,
+    'usnic': USNIC,
+}
+
+
+def cached_property(compute):
+    '''
+    a Bank property computed once from the bank's sources and kept in bank.cache until the
+    bank's sources change. With Bank.verify_cache set, every cached read is checked against
+    a fresh computation. Cached values are shared, so callers must not mutate them.
+    '''
+    name = compute.__name__
+
+    def get(bank):
+        if name not in bank.cache:
+            bank.cache[name] = compute(bank)
+        elif Bank.verify_cache:
+            cached, fresh = bank.cache[name], compute(bank)
+            if not (cached is fresh or cached == fresh):
+                raise Exception('stale cached ' + name + ' of bank ' + str(bank.tag) + ': '
+                                + repr(cached) + ' != ' + repr(fresh))
+        return bank.cache[name]
+
+    return property(get, doc=compute.__doc__)
+
+
 class Bank:
+    # a slot per source. Most banks only have one or two sources.
+    __slots__ = ['tag', 'bankreg', 'banktrack', 'bocc', 'gabv', 'fairfinance', 'switchit', 'custombank',
+                 'marketforces', 'wikidata', 'usnic', 'cache']
+
+    # debug switch: check cached properties against a fresh computation on every read
+    verify_cache = False
 
     def __init__(self, bankreg, data, tag=None):
         self.tag = tag
@@ -28,9 +69,16 @@ class Bank:
         self.marketforces = None
         self.wikidata = None
         self.usnic = None
+        self.cache = {}
         self.set_data_by_source(data=data)
 
-    @property
+    def invalidate_cache(self):
+        ''' forget cached properties. Needed after changing one of the bank's sources in place.'''
+        self.cache = {}
+        if self.bankreg is not None:
+            self.bankreg.invalidate_ratings(self.tag)
+
+    @cached_property
     def name(self):
 
         # sometimes a preferred name is specified for a bank.
@@ -62,7 +110,7 @@ class Bank:
             return self.switchit.name
         return 'unk'
 
-    @property
+    @cached_property
     def names(self):
         '''returns a set of names that the bank was at some point assigned'''
         names = set()
@@ -91,7 +139,7 @@ class Bank:
         names = {x for x in names if x != ''}
         return sorted(names)
 
-    @property
+    @cached_property
     def countries(self):
         countries = set()
         if self.banktrack:
@@ -114,7 +162,7 @@ class Bank:
             countries.update(self.custombank.countries)
         return sorted(countries)
 
-    @property
+    @cached_property
     def website(self):
         if self.custombank and self.custombank.website:
             return self.custombank.website
@@ -129,50 +177,59 @@ class Bank:
 
     @property
     def rating_reason(self):
+        rating, reason, parent_tag = self.rating_basis
+        if parent_tag is None:
+            return rating, reason
+
+        # ratings taken from parents are memoized by the registry
+        rating, reason, _ = self.bankreg.rating_of(self.tag)
+        return rating, reason
+
+    @cached_property
+    def rating_basis(self):
+        '''
+        (rating, reason, None) when the bank is rated on its own data,
+        or (None, None, parent tag) when it takes the rating of its parent.
+        '''
 
         # custom overrides always come first
         if self.custombank and self.custombank.rating != '':
-            return self.custombank.rating.lower(), self.custombank.reason
+            return self.custombank.rating.lower(), self.custombank.reason, None
 
         # in case of subsidiary relationships, return the parent. Check for recursion
         if self.custombank and self.custombank.subsidiary_tag and self.custombank.subsidiary_tag != self.tag:
-            rating, reason = self.bankreg.reg[self.custombank.subsidiary_tag].rating_reason
-            reason = self.name + 'is owned and/or operated by ' + self.custombank.subsidiary_tag + '. ' + reason
-
-            return rating.lower(), reason
+            return None, None, self.custombank.subsidiary_tag
 
         if self.bocc:
-            return self.bocc.rating
+            return self.bocc.rating + (None,)
 
         if self.switchit:
-            return self.switchit.rating, 'This rating was determined by the switchit.money team.'
+            return self.switchit.rating, 'This rating was determined by the switchit.money team.', None
         if self.marketforces and self.marketforces.ff_financing == 0:
             reason = "This rating is based on the marketforces.org.au verification that " + self.name + " does not invest in fossl fuels." # noqa
-            return 'great', reason
+            return 'great', reason, None
 
         if self.gabv and self.gabv.gabv is not None and self.gabv.gabv != '':
             reason = "This rating was based on " + self.name + "'s membership in the Global Alliance of Banking Values. The bank.green team has not been able to verify that the bank does not invest in fossil fuels, but believes that the bank is generally making a positive impact on the world." # noqa
-            return 'ok', reason
+            return 'ok', reason, None
         if self.gabv and self.gabv.b_impact:
 
             reason = "This rating was based on " + self.name + "'s certification as a b-impact corporation or non-profit. The bank.green team has not been able to verify that the bank does not invest in fossil fuels, but believes that the bank is generally making a positive impact on the world." # noqa
-            return 'ok', reason
+            return 'ok', reason, None
 
         if self.fairfinance:
             if self.fairfinance.rating >= 80:
                 reason = self.name + " has a fairfinance guide rating of greater than 80 on the fair finance guide. It may be making a positive impact on the world." # noqa
-                return 'ok', reason
+                return 'ok', reason, None
             else:
-                return 'unk', 'We do not have enough information to rate this bank'
+                return 'unk', 'We do not have enough information to rate this bank', None
 
         if self.wikidata and self.subsidiary_tag and self.subsidiary_tag != self.tag:
-            rating, reason = self.bankreg.reg[self.subsidiary_tag].rating_reason
-            reason = self.name + 'is owned and/or operated by ' + self.subsidiary_tag + '. ' + reason
-            return rating.lower(), reason
+            return None, None, self.subsidiary_tag
 
-        return 'unk', 'We do not have enough information to rate this bank'
+        return 'unk', 'We do not have enough information to rate this bank', None
 
-    @property
+    @cached_property
     def data_sources(self):
         """returns a comma seperated string with data sources"""
         data_sources = []
@@ -198,7 +255,7 @@ class Bank:
             data_sources.append('custombank')
         return sorted(data_sources)
 
-    @property
+    @cached_property
     def subsidiary_tag(self):
         # import pdb; pdb.set_trace()
         if self.custombank and self.custombank.subsidiary_tag:
@@ -215,9 +272,7 @@ class Bank:
 
         if self.bocc:
             rank_total = self.bocc.rank
-            total_usd = float(
-                self.bocc.financing['fff']['FFF - 2016-2020'].replace(
-                    ',', '').replace('$', '')) / 1000000000
+            total_usd = self.bocc.reported_total_financing()
             total_eur = self.bocc.total_financing(currency='eur')
             total_gbp = self.bocc.total_financing(currency='gbp')
             total_aud = self.bocc.total_financing(currency='aud')
@@ -270,6 +325,7 @@ class Bank:
     def set_data_by_source(self, data, source=None):
         '''Set bank data from a single source (e.g., just BOCC data)'''
         datatype = type(data)
+        self.invalidate_cache()
 
         # note: Equality can have unexpected results when using autoreload.
         # if things that should be equal do not appear so, disable autoreload
@@ -1,4 +1,9 @@
 import unittest
+
+import pandas as pd
+
+from sources.bocc.bocc import BOCC
+from sources.switchit.switchit import Switchit
 from testutils import banktrack1, banktrack2, banktrack3, ran1, ran4, switchit1, gabv1, gabv2
 from bank import Bank
 from bankreg import BankReg
@@ -45,6 +50,40 @@ class TestBOCC(unittest.TestCase):
         self.assertEqual(['Argentina'], self.bank.countries)
 
 
+class TestBOCCFinancing(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        df = pd.DataFrame({'FFF - ' + str(year): ['$1,000,000,000.00'] for year in range(2016, 2021)})
+        for prefix in ['AOG', 'CM', 'CP', 'FFE', 'FOG', 'LNG', 'OOG', 'TS']:
+            df = df.assign(**{prefix + ' - ' + str(year): '$0.00' for year in range(2016, 2021)})
+            df[prefix + ' - Total'] = '$0.00'
+            df[prefix + ' - Rank'] = 40
+        df['FFF - 2016-2020'] = '$5,000,000,000.00'
+        df['FFF - total rank'] = 12
+        df['TS - Rank'] = 3
+
+        amounts, totals, ranks = BOCC.parse_financing(df)
+        cls.bocc = BOCC(bankreg=None, name='A Bank', country='ar',
+                        europe=True, asia=False, north_america=False, canada=False, uk=False, australia=False,
+                        percent_assets='20%', assets_2020=100, coal_score=20, og_score=40,
+                        financing_amounts=amounts[0], financing_totals=totals[0], financing_ranks=ranks[0])
+
+    def test_parsed_shapes(self):
+        self.assertEqual(self.bocc.financing_amounts.shape, (9, 5))
+        self.assertEqual(self.bocc.rank, 12)
+
+    def test_total_financing(self):
+        self.assertAlmostEqual(self.bocc.total_financing(currency='usd'), 5.0)
+        self.assertAlmostEqual(self.bocc.reported_total_financing(), 5.0)
+        self.assertAlmostEqual(self.bocc.total_financing(currency='eur', years=[2016]), 1 / 1.11)
+
+    def test_rating(self):
+        rating, reason = self.bocc.rating
+        self.assertEqual(rating, 'worst')
+        self.assertIn('# 3 funder of tar sands', reason)
+
+
 class TestSwitchIt(unittest.TestCase):
 
     @classmethod
@@ -80,5 +119,55 @@ class TestCountriesAreAlphabetised(unittest.TestCase):
     def test_alphabetised(self):
         self.assertEqual(self.bankreg.reg['santander'].countries, ['Argentina', 'Mexico'] )
 
+
+class TestCompactLayout(unittest.TestCase):
+
+    def test_no_instance_dicts(self):
+        for obj in [banktrack1, ran1, switchit1, gabv1, Bank(bankreg=None, data=switchit1, tag='switchit')]:
+            self.assertFalse(hasattr(obj, '__dict__'), type(obj).__name__)
+
+    def test_identifiers_stored_sparsely(self):
+        source = Switchit(bankreg=None, name='Sparse Bank', rating='Good')
+        self.assertIsNone(source.identifiers)
+        self.assertIsNone(source.lei)
+
+        source.lei = 'SPARSELEI'
+        self.assertEqual(source.identifiers, {'lei': 'SPARSELEI'})
+        self.assertEqual(source.lei, 'SPARSELEI')
+
+        source.lei = None
+        self.assertIsNone(source.identifiers)
+
+
+class TestCachedProperties(unittest.TestCase):
+
+    def setUp(self):
+        self.switchit = Switchit(bankreg=None, name='Cached Property Bank', rating='ok')
+        self.bank = Bank(bankreg=None, data=self.switchit, tag='cached_property_bank')
+
+    def tearDown(self):
+        Bank.verify_cache = False
+
+    def test_values_are_cached(self):
+        self.assertEqual(self.bank.names, ['cached property bank'])
+        self.assertIs(self.bank.names, self.bank.names)
+        self.assertEqual(self.bank.rating_reason, ('ok', 'This rating was determined by the switchit.money team.'))
+
+    def test_set_data_by_source_invalidates(self):
+        self.assertEqual(self.bank.data_sources, ['switchit'])
+        self.bank.set_data_by_source(ran1)
+        self.assertEqual(self.bank.data_sources, ['bocc', 'switchit'])
+        self.assertEqual(self.bank.rating_reason[0], ran1.rating[0])
+
+    def test_verify_detects_stale_values(self):
+        self.bank.names
+        self.switchit.name = 'Renamed Bank'
+        Bank.verify_cache = True
+        self.assertRaises(Exception, lambda: self.bank.names)
+
+        self.bank.invalidate_cache()
+        self.assertEqual(self.bank.names, ['renamed bank'])
+
+
 if __name__ == '__main__':
     unittest.main()
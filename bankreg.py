@@ -1,9 +1,85 @@
+import itertools
+import os
+import time
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import unidecode
+
 from bank import Bank
+import snapshot
+from sources import source_cache
 from maps.name_tag_map import name_tag_map
 from maps.id_map import id_map
 
 
+# rating of banks that can't be rated, e.g. because their parents own each other
+UNRATED = ('unk', 'We do not have enough information to rate this bank')
+
+# exported registry columns with few distinct values, stored as categoricals
+CATEGORICAL_COLUMNS = ['country', 'data_sources', 'rating']
+
+# currencies, besides USD, that BOCC financing totals are exported in
+EXPORT_CURRENCIES = ['eur', 'gbp', 'aud', 'cad']
+
+# string columns with many repeated values, dictionary-encoded in exported files
+DICTIONARY_COLUMNS = ['country', 'data_sources', 'rating', 'reason']
+
+# rows per parquet row group. Exported files are sorted by rating, so row group statistics let
+# readers filtering on a rating skip most of the file.
+EXPORT_ROW_GROUP_SIZE = 16384
+
+# identifiers exported for every bank, in column order
+EXPORT_IDENTIFIERS = ['permid', 'isin', 'viafid', 'lei', 'rssd', 'googleid', 'wikiid']
+
+# order in which unique identifiers are checked when looking up a bank's tag
+ID_LOOKUP_ORDER = ['permid', 'isin', 'viafid', 'rssd', 'lei', 'googleid', 'wikiid']
+
+
+class TagIndex(dict):
+    """
+    A dict mapping bank names or unique identifiers to bank tags, which records when each key last changed.
+    Sources cache the tag they resolve to, and use this to tell whether any entry they were resolved from
+    has changed since.
+    """
+    # shared by all indexes. Increases whenever an entry of any index changes value.
+    generation = 0
+
+    def __init__(self, *args, **kwargs):
+        super(TagIndex, self).__init__(*args, **kwargs)
+        self.key_generations = {}
+
+    def __setitem__(self, key, tag):
+        if key not in self or self[key] != tag:
+            self.touch(key)
+        super(TagIndex, self).__setitem__(key, tag)
+
+    def __delitem__(self, key):
+        self.touch(key)
+        super(TagIndex, self).__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        # changes applied together share one generation
+        updates = dict(*args, **kwargs)
+        changed = [key for key, tag in updates.items() if key not in self or self[key] != tag]
+        if changed:
+            TagIndex.generation += 1
+            for key in changed:
+                self.key_generations[key] = TagIndex.generation
+        super(TagIndex, self).update(updates)
+
+    def touch(self, key):
+        TagIndex.generation += 1
+        self.key_generations[key] = TagIndex.generation
+
+    def changed_since(self, key, generation):
+        return self.key_generations.get(key, 0) > generation
+
+
 class BankReg:
     __instance__ = None
 
@@ -15,13 +91,30 @@ class BankReg:
             self.reg = {}
 
             # maps bank names to their tags. Used for determining bank tags.
-            self.name_tag_dict = name_tag_map
+            self.name_tag_dict = TagIndex(name_tag_map)
 
             # maps bank unique identifiers (permid, LEI, etc) to bank tags.
             # Used by some data sources to denote subsidiary relationships.
-            self.id_tag_dict = {'permid': {}, 'isin': {}, 'viafid': {},
-                                'lei': {}, 'googleid': {}, 'wikiid': {},
-                                'rssd': {}}
+            self.id_tag_dict = {id_type: TagIndex() for id_type in ID_LOOKUP_ORDER}
+
+            # resolves historical rssds to the rssd of their surviving institution, see set_rssd_successors
+            self.rssd_successors = None
+
+            # tag -> (rating, reason, depth) of banks rated so far, where depth is the number of
+            # parents a bank's rating was taken through. See rate_banks.
+            self.ratings = {}
+            self.rating_stats = None
+
+            # the parent each rated bank took its rating from, and the reverse: parent tag -> set of child tags.
+            # Used to find the subsidiaries whose ratings depend on a bank.
+            self.rating_parents = {}
+            self.rating_children = {}
+
+            # ratings dropped since the last rating pass, as they were before, so update_ratings can report changes
+            self.previous_ratings = {}
+
+            # counts how often source tags were served from cache versus resolved from the indexes
+            self.tag_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
             for tag, v in id_map.items():
                 permid, isin, viafid = v.get('permid'), v.get('isin'), v.get('viafid')
                 lei, googleid, wikiid = v.get('lei'), v.get('googleid'), v.get('wikiid')
@@ -53,20 +146,46 @@ class BankReg:
 
         # cast to string
         tag = str(source.tag)
-        if source.permid:
-            self.id_tag_dict['permid'][source.permid] = tag
-        if source.isin:
-            self.id_tag_dict['isin'][source.isin] = tag
-        if source.viafid:
-            self.id_tag_dict['viafid'][source.viafid] = tag
-        if source.lei:
-            self.id_tag_dict['lei'][source.lei] = tag
-        if source.googleid:
-            self.id_tag_dict['googleid'][source.googleid] = tag
-        if source.wikiid:
-            self.id_tag_dict['wikiid'][source.wikiid] = tag
-        if source.rssd:
-            self.id_tag_dict['rssd'][source.rssd] = tag
+        for id_type, key in self.source_id_keys(source):
+            self.id_tag_dict[id_type][key] = tag
+
+    def source_id_keys(self, source):
+        ''' the (id type, key) pairs a source's unique identifiers are stored under in id_tag_dict'''
+        keys = []
+        identifiers = source.identifiers or {}
+        for id_type in ['permid', 'isin', 'viafid', 'lei', 'googleid', 'wikiid']:
+            value = identifiers.get(id_type)
+            if value:
+                keys.append((id_type, value))
+        if identifiers.get('rssd'):
+            keys.append(('rssd', self.id_key('rssd', identifiers['rssd'])))
+        return keys
+
+    def id_key(self, id_type, value):
+        ''' the key a unique identifier is stored under in id_tag_dict'''
+        key = str(value)
+        if id_type == 'rssd' and self.rssd_successors is not None:
+            return self.rssd_successors.resolve(key)
+        return key
+
+    def set_rssd_successors(self, successors):
+        '''
+        resolve rssds through a SuccessorIndex from now on, so that banks merged into another bank
+        are looked up under the rssd of the bank that survives them.
+        '''
+        self.rssd_successors = successors
+
+        index = self.id_tag_dict['rssd']
+        for rssd in list(index):
+            survivor = successors.resolve(rssd)
+            if survivor not in index:
+                index[survivor] = index[rssd]
+
+        # tags cached from a predecessor's rssd may now resolve differently,
+        # and are now checked against the survivor's entry
+        for rssd, survivor in successors.current.items():
+            index.touch(rssd)
+            index.touch(survivor)
 
     def return_tag_from_id_tag_dict(
             self, permid=None, isin=None, viafid=None,
@@ -77,43 +196,101 @@ class BankReg:
         or None if no tag can be found.
         '''
 
-        permid_tag = self.id_tag_dict['permid'].get(str(permid))
-        if permid_tag:
-            return permid_tag
+        ids = {'permid': permid, 'isin': isin, 'viafid': viafid, 'lei': lei,
+               'googleid': googleid, 'wikiid': wikiid, 'rssd': rssd}
+        for id_type in ID_LOOKUP_ORDER:
+            tag = self.index_get(id_type, self.id_key(id_type, ids[id_type]))
+            if tag:
+                return tag
 
-        isin_tag = self.id_tag_dict['isin'].get(str(isin))
-        if isin_tag:
-            return isin_tag
+        return None
 
-        viafid_tag = self.id_tag_dict['viafid'].get(str(viafid))
-        if viafid_tag:
-            return viafid_tag
+    def probe_keys(self, source):
+        '''
+        yields the (index name, key) pairs looked up to find a source's tag, in order:
+        the identifiers the source has in ID_LOOKUP_ORDER, then its name and unidecoded name.
+        '''
+        identifiers = source.identifiers or {}
+        for id_type in ID_LOOKUP_ORDER:
+            if id_type in identifiers:
+                yield id_type, self.id_key(id_type, identifiers[id_type])
 
-        rssd_tag = self.id_tag_dict['rssd'].get(str(rssd))
-        if rssd_tag:
-            return rssd_tag
-        lei_tag = self.id_tag_dict['lei'].get(str(lei))
-        if lei_tag:
-            return lei_tag
+        yield 'name', source.name
+        yield 'name', unidecode.unidecode(source.name)
 
-        googleid_tag = self.id_tag_dict['googleid'].get(str(googleid))
-        if googleid_tag:
-            return googleid_tag
+    def lookup_tag(self, source):
+        '''
+        query the id_tag_dict, then the name_tag_dict for a source's tag.
+        Returns the lowercased tag, or None if no tag can be found, along with
+        the number of probe_keys that were looked up to find it.
+        '''
+        n_probed = 0
+        for index_name, key in self.probe_keys(source):
+            n_probed += 1
+            tag = self.index_get(index_name, key)
+            if tag:
+                return tag.lower(), n_probed
 
-        wikiid_tag = self.id_tag_dict['wikiid'].get(str(wikiid))
-        if wikiid_tag:
-            return wikiid_tag
+        return None, n_probed
 
-        return None
+    def index(self, index_name):
+        ''' the name index ('name') or an id index'''
+        return self.name_tag_dict if index_name == 'name' else self.id_tag_dict[index_name]
+
+    def index_get(self, index_name, key):
+        ''' get a key from the name index ('name') or an id index'''
+        return self.index(index_name).get(key)
+
+    def resolve_tag(self, source):
+        '''
+        return a source's tag, looked up in the indexes or autogenerated from its name.
+        The tag is cached on the source and reused until one of the index entries probed
+        while looking it up changes. Only the number of entries probed is cached; the keys are
+        derived from the source again when the cache is checked.
+        '''
+        if source.tag_cache is not None:
+            tag, generation, n_probed = source.tag_cache
+            if generation == TagIndex.generation or not any(
+                    self.index(index_name).changed_since(key, generation)
+                    for index_name, key in itertools.islice(self.probe_keys(source), n_probed)):
+                self.tag_cache_stats['hits'] += 1
+                source.tag_cache = (tag, TagIndex.generation, n_probed)
+                return tag
+            self.tag_cache_stats['invalidations'] += 1
+
+        self.tag_cache_stats['misses'] += 1
+        tag, n_probed = self.lookup_tag(source)
+        if tag is None:
+            tag = source.autogenerate_tag().lower()
+
+        source.tag_cache = (tag, TagIndex.generation, n_probed)
+        return tag
+
+    @property
+    def tag_cache_hit_rate(self):
+        lookups = self.tag_cache_stats['hits'] + self.tag_cache_stats['misses']
+        return self.tag_cache_stats['hits'] / lookups if lookups else 0.0
 
     def create_or_update_bank(self, source):
         # If there is a preexisting Bank instance, update the instance with
         # the source's data. Otherwise register a new Bank instance.
-        preexisting_bank = self.reg.get(source.tag, None)
+
+        # tags are resolved against the registry the source is registered in
+        if source.bankreg is not self:
+            source.bankreg = self
+            source.invalidate_tag()
+
+        tag = source.tag
+        preexisting_bank = self.reg.get(tag, None)
 
         # update dictionaries
-        self.name_tag_dict[source.name] = source.tag
         self.update_id_tag_dict(source)
+        self.name_tag_dict[source.name] = tag
+
+        # the indexes now map the source's own ids and name to its own tag,
+        # which cannot change the tag it resolves to. Keep its cached tag valid.
+        if source.tag_cache is not None:
+            source.tag_cache = (tag, TagIndex.generation, source.tag_cache[2])
 
         if preexisting_bank:
             # update and return
@@ -121,42 +298,305 @@ class BankReg:
             return preexisting_bank
         else:
             # create, register, and return
-            new_bank = Bank(bankreg=self, tag=source.tag, data=source)
-            self.reg[source.tag] = new_bank
+            new_bank = Bank(bankreg=self, tag=tag, data=source)
+            self.reg[tag] = new_bank
             return new_bank
 
+    def create_or_update_banks(self, sources, source_class=None):
+        '''
+        Register many sources, with the same result as calling create_or_update_bank on each in order.
+        All tags are resolved in one pass, against the indexes and the updates staged by the sources
+        before them, then the index updates are applied in bulk and banks are created or updated.
+
+        sources is an iterable of sources, or a DataFrame with a row per source and a column per source
+        attribute (as stored by sources/source_cache.py), in which case source_class must be given.
+        Returns {'created': [tags], 'updated': [tags]}: the tags of new banks, and of preexisting banks that
+        received data, in the order they were first registered.
+        '''
+        if isinstance(sources, pd.DataFrame):
+            sources = source_cache.sources_from_df(source_class, sources)
+
+        indexes = {index_name: self.index(index_name) for index_name in ID_LOOKUP_ORDER + ['name']}
+        staged = {index_name: {} for index_name in indexes}
+
+        def get(index_name, key):
+            # what an index maps a key to once the updates staged so far are applied
+            staged_index = staged[index_name]
+            return staged_index[key] if key in staged_index else indexes[index_name].get(key)
+
+        # the (index name, key) pairs tags were looked up through so far, and for those of them whose tag a later
+        # source changed, the position in the batch of the last source that did. Cached tags looked up through
+        # a key before it changed go stale.
+        probed = set()
+        changed_at = {}
+        tagged = []
+        for position, source in enumerate(sources):
+            if source.bankreg is not self:
+                source.bankreg = self
+                source.invalidate_tag()
+
+            # the keys of probe_keys and of source_id_keys, from one pass over the source's identifiers
+            identifiers = source.identifiers or {}
+            probes, id_keys = [], []
+            for id_type in ID_LOOKUP_ORDER:
+                if id_type in identifiers:
+                    value = identifiers[id_type]
+                    key = self.id_key(id_type, value)
+                    probes.append((id_type, key))
+                    if value:
+                        id_keys.append((id_type, key if id_type == 'rssd' else value))
+            probes.append(('name', source.name))
+
+            # the lookup of resolve_tag and lookup_tag, against the staged updates
+            tag = source.preset_tag()
+            if tag is None:
+                self.tag_cache_stats['misses'] += 1
+                for n_probed, probe in enumerate(probes, 1):
+                    tag = get(*probe)
+                    if tag:
+                        del probes[n_probed:]
+                        break
+                else:
+                    probes.append(('name', unidecode.unidecode(source.name)))
+                    tag = get(*probes[-1])
+                tag = tag.lower() if tag else source.autogenerate_tag().lower()
+            else:
+                probes = None
+
+            updates = [(id_type, key, str(tag)) for id_type, key in id_keys]
+            updates.append(('name', source.name, tag))
+            for index_name, key, key_tag in updates:
+                if (index_name, key) in probed and get(index_name, key) != key_tag:
+                    changed_at[index_name, key] = position
+                staged[index_name][key] = key_tag
+
+            # added after the source's own updates, which leave its cached tag valid
+            if probes is not None:
+                probed.update(probes)
+            tagged.append((source, tag, probes))
+
+        for id_type in ID_LOOKUP_ORDER:
+            self.id_tag_dict[id_type].update(staged[id_type])
+        self.name_tag_dict.update(staged['name'])
+
+        created, updated = {}, {}
+        for position, (source, tag, probes) in enumerate(tagged):
+            # as when registering one at a time, a looked up tag stays cached through the source's own index updates,
+            # but not once a later source changed an entry it was resolved from
+            if probes is not None:
+                if not changed_at.keys().isdisjoint(probes) and any(
+                        changed_at.get(probe, -1) > position for probe in probes):
+                    source.tag_cache = None
+                else:
+                    source.tag_cache = (tag, TagIndex.generation, len(probes))
+
+            bank = self.reg.get(tag, None)
+            if bank:
+                bank.set_data_by_source(data=source)
+                if tag not in created:
+                    updated[tag] = True
+            else:
+                self.reg[tag] = Bank(bankreg=self, tag=tag, data=source)
+                created[tag] = True
+
+        return {'created': list(created), 'updated': list(updated)}
+
+    def rating_of(self, tag, stats=None):
+        '''
+        (rating, reason, depth) of a bank. Banks that take their parent's rating are rated after their
+        parent: the chain of parents is followed up to the first bank that is already rated or rated on
+        its own data, then rated back down, memoizing every bank on the way in self.ratings.
+        A chain that runs into a cycle is broken by leaving the banks in the cycle unrated.
+        '''
+        path, on_path = [], set()
+        while tag not in self.ratings:
+            if tag in on_path:
+                for cycle_tag in path[path.index(tag):]:
+                    self.ratings[cycle_tag] = UNRATED + (0,)
+                if stats is not None:
+                    stats['cycles_broken'] += 1
+                break
+
+            rating, reason, parent_tag = self.reg[tag].rating_basis
+            if parent_tag is None:
+                self.ratings[tag] = (rating, reason, 0)
+                break
+
+            path.append(tag)
+            on_path.add(tag)
+            self.rating_parents[tag] = parent_tag
+            self.rating_children.setdefault(parent_tag, set()).add(tag)
+            tag = parent_tag
+
+        for child_tag in reversed(path):
+            if child_tag in self.ratings:
+                continue
+            child = self.reg[child_tag]
+            parent_tag = child.rating_basis[2]
+            rating, reason, depth = self.ratings[parent_tag]
+            reason = child.name + 'is owned and/or operated by ' + parent_tag + '. ' + reason
+            self.ratings[child_tag] = (rating.lower(), reason, depth + 1)
+
+        return self.ratings[path[0] if path else tag]
+
+    def rate_banks(self):
+        '''
+        rate every bank in the registry, parents before subsidiaries, reusing ratings memoized since the last change.
+        Returns stats for the pass, also kept in rating_stats.
+        '''
+        start = time.perf_counter()
+        stats = {'banks': len(self.reg), 'evaluated': 0, 'max_depth': 0, 'cycles_broken': 0}
+        self.previous_ratings = {}
+
+        rated_before = len(self.ratings)
+        for tag in self.reg:
+            if tag not in self.ratings:
+                self.rating_of(tag, stats)
+
+        stats['evaluated'] = len(self.ratings) - rated_before
+        stats['max_depth'] = max((depth for _, _, depth in self.ratings.values()), default=0)
+        stats['seconds'] = time.perf_counter() - start
+        self.rating_stats = stats
+        return stats
+
+    def subsidiaries(self, tags):
+        ''' the given tags and the tags of all banks that (transitively) took their rating from them '''
+        found = set(tags)
+        pending = list(found)
+        while pending:
+            for child_tag in self.rating_children.get(pending.pop(), ()):
+                if child_tag not in found:
+                    found.add(child_tag)
+                    pending.append(child_tag)
+        return found
+
+    def invalidate_ratings(self, tag):
+        ''' forget the memoized ratings of a bank that changed and of its subsidiaries '''
+        # nothing to forget while registering, before the first rating pass
+        if self.ratings:
+            for affected_tag in self.subsidiaries([tag]):
+                if affected_tag in self.ratings:
+                    self.previous_ratings.setdefault(affected_tag, self.ratings.pop(affected_tag))
+
+        # the bank may have a different parent now
+        parent_tag = self.rating_parents.pop(tag, None)
+        if parent_tag is not None:
+            self.rating_children[parent_tag].discard(tag)
+
+    def update_ratings(self, tags):
+        '''
+        re-rate the banks with the given tags and their subsidiaries, e.g. after editing custom bank overrides,
+        instead of rebuilding the registry. Returns registry rows (see return_registry_as_df) of the banks whose
+        rating or reason differs from the last rating pass.
+        '''
+        for tag in tags:
+            # also drops the bank's own cached rating basis, in case its sources were edited in place
+            self.reg[tag].invalidate_cache()
+
+        changed_tags, ratings, reasons = [], [], []
+        for tag in sorted(self.subsidiaries(tags)):
+            rating, reason, _ = self.rating_of(tag)
+            previous = self.previous_ratings.pop(tag, None)
+            if previous is None or previous[:2] != (rating, reason):
+                changed_tags.append(tag)
+                ratings.append(rating)
+                reasons.append(reason)
+
+        return self.registry_columns(changed_tags, ratings, reasons)
+
     def return_registry_as_df(self, allowed_ratings=['great', 'ok', 'bad', 'worst']):
-        rows = []
+        self.rate_banks()
 
+        # filter on ratings first, so the other columns are only computed for exported banks
+        tags, ratings, reasons = [], [], []
         for tag, bank in self.reg.items():
-
             rating, reason = bank.rating_reason
             if rating in allowed_ratings:
+                tags.append(tag)
+                ratings.append(rating)
+                reasons.append(reason)
+
+        return self.registry_columns(tags, ratings, reasons)
+
+    def registry_columns(self, tags, ratings, reasons):
+        '''
+        the exported registry for the given banks and their ratings, built a column at a time.
+        Columns with few distinct values are categoricals.
+        '''
+        banks = [self.reg[tag] for tag in tags]
+
+        # rank and totals in USD, EUR, GBP, AUD and CAD. Only BOCC banks report financing.
+        financing = np.full((len(banks), 2 + len(EXPORT_CURRENCIES)), np.nan)
+        for i, bank in enumerate(banks):
+            if bank.bocc:
+                financing[i, 0] = bank.bocc.rank
+                financing[i, 1] = bank.bocc.reported_total_financing()
+                for j, currency in enumerate(EXPORT_CURRENCIES):
+                    financing[i, 2 + j] = bank.bocc.total_financing(currency=currency)
+
+        columns = {'tag': tags,
+                   'name': [bank.name for bank in banks],
+                   'aliases': [','.join(bank.names) for bank in banks],
+                   'country': [','.join(bank.countries) for bank in banks],
+                   'data_sources': [','.join(bank.data_sources) for bank in banks],
+                   'website': [bank.website for bank in banks],
+                   'rating': [rating.lower() for rating in ratings],
+                   'reason': reasons,
+                   'subsidiary_of': [bank.subsidiary_tag for bank in banks],
+                   'Rank - Total': financing[:, 0],
+                   'total-USD': financing[:, 1]}
+        for j, currency in enumerate(EXPORT_CURRENCIES):
+            columns['total-' + currency.upper()] = financing[:, 2 + j]
+        for id_type in EXPORT_IDENTIFIERS:
+            columns[id_type] = [getattr(bank, id_type) for bank in banks]
+
+        for column in CATEGORICAL_COLUMNS:
+            columns[column] = pd.Categorical(columns[column])
+
+        return pd.DataFrame(columns)
 
-                financing_of_fossil_fuels = bank.financing_of_fossil_fuels
-                row = {'tag': tag,
-                       'name': bank.name,
-                       'aliases': ','.join(bank.names),
-                       'country': ','.join(bank.countries),
-                       'data_sources': ','.join(bank.data_sources),
-                       'website': bank.website,
-                       'rating': rating.lower(),
-                       'reason': reason,
-                       'subsidiary_of': bank.subsidiary_tag,
-                       'Rank - Total': financing_of_fossil_fuels['rank_total'],
-                       'total-USD': financing_of_fossil_fuels['total_usd'],
-                       'total-EUR': financing_of_fossil_fuels['total_eur'],
-                       'total-GBP': financing_of_fossil_fuels['total_gbp'],
-                       'total-AUD': financing_of_fossil_fuels['total_aud'],
-                       'total-CAD': financing_of_fossil_fuels['total_cad'],
-                       'permid': bank.permid,
-                       'isin': bank.isin,
-                       'viafid': bank.viafid,
-                       'lei': bank.lei,
-                       'rssd': bank.rssd,
-                       'googleid': bank.googleid,
-                       'wikiid': bank.wikiid}
-
-                rows.append(row)
-
-        return pd.DataFrame.from_dict(rows)
+    def export_table(self, allowed_ratings=['great', 'ok', 'bad', 'worst']):
+        ''' the exported registry as an arrow table sorted by rating and tag, with dictionary-encoded string columns '''
+        df = self.return_registry_as_df(allowed_ratings=allowed_ratings)
+        df = df.sort_values(['rating', 'tag'], key=lambda column: column.astype(str), ignore_index=True)
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        for column in DICTIONARY_COLUMNS:
+            i = table.schema.get_field_index(column)
+            if not pa.types.is_dictionary(table.schema.field(i).type):
+                table = table.set_column(i, column, pc.dictionary_encode(table.column(column)))
+        return table
+
+    def write_export(self, path, allowed_ratings=['great', 'ok', 'bad', 'worst'], row_group_size=EXPORT_ROW_GROUP_SIZE):
+        '''
+        write the exported registry to a parquet file, or to an arrow (feather) file when path ends in
+        .arrow or .feather.
+        Returns the number of banks written.
+        '''
+        table = self.export_table(allowed_ratings=allowed_ratings)
+
+        # write next to the target and rename, so readers never see a partial file
+        if path.endswith('.arrow') or path.endswith('.feather'):
+            feather.write_feather(table, path + '.tmp', chunksize=row_group_size)
+        else:
+            pq.write_table(table, path + '.tmp', row_group_size=row_group_size, use_dictionary=True,
+                           write_statistics=True)
+        os.replace(path + '.tmp', path)
+
+        return table.num_rows
+
+    def save_snapshot(self, path):
+        ''' save the registry, with its indexes and ratings, to a snapshot directory (see snapshot.py) '''
+        snapshot.save(self, path)
+
+    @classmethod
+    def load_snapshot(cls, path):
+        ''' a registry restored from a snapshot directory. It replaces the current BankReg instance. '''
+        return snapshot.load(cls, path)
+
+    def diff(self, since):
+        '''
+        changes to the registry's export since another registry: a snapshot path or a BankReg.
+        See snapshot.diff for what is returned.
+        '''
+        return snapshot.diff(since, self)
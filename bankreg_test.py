@@ -1,7 +1,15 @@
+import os
+import tempfile
 import unittest
 
+import pandas as pd
+
 from bankreg import BankReg
-from testutils import banktrack1, banktrack2, banktrack3, ran1, ran2, ran3, ran4, gabv1
+import snapshot
+from testutils import banktrack1, banktrack2, banktrack3, ran1, ran2, ran3, ran4, gabv1, switchit1
+from sources.switchit.switchit import Switchit
+from sources.custombank.custombank import Custombank
+from sources import source_cache
 from bank import Bank
 from maps.name_tag_map import name_tag_map
 
@@ -106,6 +114,132 @@ class TestDuplicateSantanderWithMismatchedNames(unittest.TestCase):
         self.assertEqual(len(bank_tags), 1)
         self.assertEqual(bank.names, expected_name_list)
         self.assertEqual(bank.gabv.website, 'http://gabvSantander.com')
+
+
+class TestTagCache(unittest.TestCase):
+
+    def setUp(self):
+        BankReg.__instance__ = None
+        self.bankreg = BankReg()
+        self.source = Switchit(bankreg=self.bankreg, name='Cached Bank', rating='Good')
+
+    def test_tag_is_cached(self):
+        self.assertEqual(self.source.tag, 'cached_bank')
+        self.assertEqual(self.source.tag, 'cached_bank')
+        self.assertEqual(self.bankreg.tag_cache_stats['misses'], 1)
+        self.assertEqual(self.bankreg.tag_cache_stats['hits'], 1)
+
+    def test_unrelated_index_changes_keep_cache(self):
+        self.source.tag
+        self.bankreg.name_tag_dict['Another Cached Bank'] = 'another'
+        self.bankreg.id_tag_dict['lei']['SOMELEI'] = 'another'
+        self.assertEqual(self.source.tag, 'cached_bank')
+        self.assertEqual(self.bankreg.tag_cache_stats['invalidations'], 0)
+
+    def test_related_index_change_invalidates_cache(self):
+        self.source.tag
+        self.bankreg.name_tag_dict['Cached Bank'] = 'renamed_bank'
+        self.assertEqual(self.source.tag, 'renamed_bank')
+        self.assertEqual(self.bankreg.tag_cache_stats['invalidations'], 1)
+
+    def test_registration_keeps_cache(self):
+        self.bankreg.create_or_update_bank(source=self.source)
+        self.assertEqual(self.source.tag, 'cached_bank')
+        self.assertEqual(self.bankreg.tag_cache_stats['misses'], 1)
+
+    def test_identifier_change_invalidates_cache(self):
+        self.bankreg.id_tag_dict['lei']['KNOWNLEI'] = 'known_bank'
+        self.assertEqual(self.source.tag, 'cached_bank')
+        self.source.lei = 'KNOWNLEI'
+        self.assertEqual(self.source.tag, 'known_bank')
+
+
+class TestBulkRegistration(unittest.TestCase):
+
+    def setUp(self):
+        BankReg.__instance__ = None
+        self.bankreg = BankReg()
+
+    def switchit_sources(self):
+        # the second source is found under the first one's name, the third by the name the second adds
+        return [Switchit(bankreg=None, name='Bulk Bank', rating='Good'),
+                Switchit(bankreg=None, name='Bulk Bank', rating='Bad'),
+                Switchit(bankreg=None, name='Another Bulk Bank', rating='Good')]
+
+    def test_same_as_one_at_a_time(self):
+        for source in self.switchit_sources():
+            self.bankreg.create_or_update_bank(source=source)
+        one_at_a_time = {tag: bank.switchit.rating for tag, bank in self.bankreg.reg.items()}
+
+        BankReg.__instance__ = None
+        bulk = BankReg()
+        bulk.create_or_update_banks(self.switchit_sources())
+
+        self.assertEqual({tag: bank.switchit.rating for tag, bank in bulk.reg.items()}, one_at_a_time)
+        self.assertEqual(bulk.name_tag_dict['Bulk Bank'], 'bulk_bank')
+
+    def test_staged_updates_are_seen(self):
+        first = Switchit(bankreg=None, name='Bulk Bank', rating='Good')
+        second = Switchit(bankreg=None, name='Renamed Bulk Bank', rating='Bad')
+        first.lei = second.lei = 'BULKLEI'
+
+        self.bankreg.create_or_update_banks([first, second])
+        self.assertEqual(list(self.bankreg.reg), ['bulk_bank'])
+        self.assertEqual(self.bankreg.name_tag_dict['Renamed Bulk Bank'], 'bulk_bank')
+
+    def test_cached_tags_as_one_at_a_time(self):
+        # the second source moves the name the first one was resolved by to the tag of its lei
+        def sources():
+            first = Switchit(bankreg=None, name='Zed Unique Bank', rating='Good')
+            second = Switchit(bankreg=None, name='Zed Unique Bank', rating='Bad')
+            second.lei = 'LEIX'
+            return first, second
+
+        self.bankreg.id_tag_dict['lei']['LEIX'] = 'other_tag'
+        first, second = sources()
+        for source in [first, second]:
+            self.bankreg.create_or_update_bank(source=source)
+        one_at_a_time = [first.tag, second.tag]
+
+        BankReg.__instance__ = None
+        bulk = BankReg()
+        bulk.id_tag_dict['lei']['LEIX'] = 'other_tag'
+        first, second = sources()
+        bulk.create_or_update_banks([first, second])
+
+        self.assertEqual(one_at_a_time, ['other_tag', 'other_tag'])
+        self.assertIsNone(first.tag_cache)
+        self.assertEqual([first.tag, second.tag], one_at_a_time)
+        self.assertEqual(list(bulk.reg), list(self.bankreg.reg))
+
+    def test_preset_tags(self):
+        # a custom bank with a tag keeps it, one without is looked up like other sources
+        tagged = Custombank(bankreg=None, name='Bulk Bank', bank_tag='Custom_Tag', subsidiary_tag='')
+        untagged = Custombank(bankreg=None, name='Bulk Bank', subsidiary_tag='')
+        self.bankreg.create_or_update_banks(self.switchit_sources()[:1] + [untagged, tagged])
+
+        self.assertEqual(sorted(self.bankreg.reg), ['bulk_bank', 'custom_tag'])
+        self.assertEqual(self.bankreg.reg['bulk_bank'].custombank, untagged)
+        self.assertIsNone(tagged.tag_cache)
+
+    def test_summary(self):
+        self.bankreg.create_or_update_bank(source=Switchit(bankreg=None, name='Preexisting Bank', rating='Good'))
+        summary = self.bankreg.create_or_update_banks(
+            self.switchit_sources() + [Switchit(bankreg=None, name='Preexisting Bank', rating='Bad')])
+
+        self.assertEqual(summary, {'created': ['bulk_bank', 'another_bulk_bank'], 'updated': ['preexisting_bank']})
+
+    def test_dataframe_of_sources(self):
+        record = dict.fromkeys(source_cache.record_fields(switchit1))
+        record.update({'name': 'Frame Bank', 'rating': 'good', 'countries': {'United Kingdom'}})
+        df = pd.DataFrame([record])
+
+        summary = self.bankreg.create_or_update_banks(df, source_class=Switchit)
+        self.assertEqual(summary['created'], ['frame_bank'])
+        self.assertEqual(self.bankreg.reg['frame_bank'].switchit.rating, 'good')
+        self.assertEqual(self.bankreg.reg['frame_bank'].countries, ['United Kingdom'])
+
+
 # if bank already exists, then the gabv information should be added.
 # if bank doesn't exist then create the new gabv bank
 
@@ -114,5 +248,137 @@ class TestDuplicateSantanderWithMismatchedNames(unittest.TestCase):
 # Gabv_website is a unique field for GABV.
 
 
+class TestRatingPass(unittest.TestCase):
+
+    def setUp(self):
+        BankReg.__instance__ = None
+        self.bankreg = BankReg()
+        # a -> b -> c is a chain ending in a rated bank, x <-> y own each other and z belongs to x
+        self.add_bank('c', '', rating='great', reason='C is great.')
+        self.add_bank('b', 'c')
+        self.add_bank('a', 'b')
+        self.add_bank('x', 'y')
+        self.add_bank('y', 'x')
+        self.add_bank('z', 'x')
+
+    def add_bank(self, tag, parent_tag, rating='', reason=''):
+        custombank = Custombank(bankreg=None, name=tag.upper(), bank_tag=tag, subsidiary_tag=parent_tag,
+                                rating=rating, reason=reason)
+        self.bankreg.reg[tag] = Bank(bankreg=self.bankreg, data=custombank, tag=tag)
+
+    def test_chain(self):
+        self.assertEqual(self.bankreg.reg['a'].rating_reason,
+                         ('great', 'Ais owned and/or operated by b. Bis owned and/or operated by c. C is great.'))
+
+    def test_cycle_is_broken(self):
+        stats = self.bankreg.rate_banks()
+        self.assertEqual(stats['cycles_broken'], 1)
+        self.assertEqual(stats['max_depth'], 2)
+        self.assertEqual(stats['evaluated'], 6)
+        self.assertEqual(self.bankreg.reg['x'].rating_reason[0], 'unk')
+        self.assertEqual(self.bankreg.reg['z'].rating_reason[0], 'unk')
+
+    def test_change_invalidates_ratings(self):
+        self.bankreg.rate_banks()
+        custombank = Custombank(bankreg=None, name='C', bank_tag='c', subsidiary_tag='', rating='bad',
+                                reason='C is bad.')
+        self.bankreg.reg['c'].set_data_by_source(custombank)
+        self.assertEqual(self.bankreg.reg['a'].rating_reason[0], 'bad')
+
+    def test_update_ratings(self):
+        self.bankreg.rate_banks()
+        self.assertEqual(self.bankreg.subsidiaries(['b']), {'a', 'b'})
+
+        self.bankreg.reg['c'].custombank.rating = 'bad'
+        changed = self.bankreg.update_ratings({'c'})
+        self.assertEqual(list(changed['tag']), ['a', 'b', 'c'])
+        self.assertEqual(set(changed['rating']), {'bad'})
+
+        # edits that end where the last update left off change nothing
+        self.bankreg.reg['c'].custombank.rating = 'great'
+        self.bankreg.reg['c'].set_data_by_source(self.bankreg.reg['c'].custombank)
+        self.bankreg.reg['c'].custombank.rating = 'bad'
+        self.assertEqual(len(self.bankreg.update_ratings({'c'})), 0)
+
+    def test_export(self):
+        df = self.bankreg.return_registry_as_df(allowed_ratings=['great'])
+        self.assertEqual(list(df['tag']), ['c', 'b', 'a'])
+        for column in ['country', 'data_sources', 'rating']:
+            self.assertEqual(df[column].dtype, 'category')
+        self.assertTrue(df['total-USD'].isna().all())
+
+    def test_write_export(self):
+        with tempfile.TemporaryDirectory() as export_dir:
+            for name in ['registry.parquet', 'registry.arrow']:
+                path = os.path.join(export_dir, name)
+                self.assertEqual(self.bankreg.write_export(path, allowed_ratings=['great', 'unk']), 6)
+                df = pd.read_feather(path) if name.endswith('.arrow') else pd.read_parquet(path)
+                self.assertEqual(list(df['tag']), ['a', 'b', 'c', 'x', 'y', 'z'])
+                self.assertEqual(df['reason'].dtype, 'category')
+
+            filtered = pd.read_parquet(os.path.join(export_dir, 'registry.parquet'), filters=[('rating', '==', 'unk')])
+            self.assertEqual(list(filtered['tag']), ['x', 'y', 'z'])
+
+    def test_update_ratings_moves_subsidiary(self):
+        self.bankreg.rate_banks()
+        self.bankreg.reg['z'].custombank.subsidiary_tag = 'c'
+        changed = self.bankreg.update_ratings({'z'})
+        self.assertEqual(list(changed['rating']), ['great'])
+        self.assertEqual(self.bankreg.subsidiaries(['x']), {'x', 'y'})
+        self.assertEqual(self.bankreg.subsidiaries(['c']), {'a', 'b', 'c', 'z'})
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        BankReg.__instance__ = None
+        self.bankreg = BankReg()
+        self.bankreg.create_or_update_banks([banktrack1, banktrack2, ran1, gabv1, switchit1])
+        self.bankreg.rate_banks()
+
+    def test_round_trip(self):
+        expected = self.bankreg.return_registry_as_df(allowed_ratings=['great', 'ok', 'bad', 'worst', 'unk'])
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            path = os.path.join(snapshot_dir, 'registry')
+            self.bankreg.save_snapshot(path)
+            bankreg = BankReg.load_snapshot(path)
+            self.assertIs(BankReg.__instance__, bankreg)
+            self.assertEqual(bankreg.ratings, self.bankreg.ratings)
+            self.assertEqual(dict(bankreg.name_tag_dict), dict(self.bankreg.name_tag_dict))
+            self.assertTrue(bankreg.return_registry_as_df(allowed_ratings=['great', 'ok', 'bad', 'worst', 'unk'])
+                            .equals(expected))
+
+            # cached source tags survive, so registering into the loaded registry doesn't look them up again
+            bankreg.create_or_update_bank(bankreg.reg[banktrack1.tag].banktrack)
+            self.assertEqual(bankreg.tag_cache_stats['misses'], 0)
+
+    def test_diff(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            path = os.path.join(snapshot_dir, 'registry')
+            self.bankreg.save_snapshot(path)
+            self.assertEqual(self.bankreg.diff(path), {'added': [], 'removed': [], 'modified': {}})
+
+            self.bankreg.create_or_update_bank(Switchit(bankreg=None, name='Diff Bank', rating='great'))
+            self.bankreg.create_or_update_bank(Custombank(bankreg=None, name=banktrack1.name, bank_tag=banktrack1.tag,
+                                                          subsidiary_tag='', rating='great', reason='Custom.'))
+            changes = self.bankreg.diff(path)
+            self.assertEqual(changes['added'], ['diff_bank'])
+            self.assertEqual(list(changes['modified']), [banktrack1.tag])
+            self.assertEqual(changes['modified'][banktrack1.tag]['reason'][1], 'Custom.')
+            self.assertEqual(set(changes['modified'][banktrack1.tag]), {'data_sources', 'rating', 'reason'})
+
+            changes = snapshot.diff(self.bankreg, path)
+            self.assertEqual(changes['removed'], ['diff_bank'])
+            self.assertEqual(changes['modified'][banktrack1.tag]['reason'][0], 'Custom.')
+
+    def test_format_is_checked(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            path = os.path.join(snapshot_dir, 'registry')
+            self.bankreg.save_snapshot(path)
+            with open(os.path.join(path, 'manifest.json'), 'w') as f:
+                f.write('{"format": 0}')
+            self.assertRaises(Exception, BankReg.load_snapshot, path)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,92 @@
+"""
+Benchmark airtable backups: a pickle of the whole table per run against AirtableBackup's delta files.
+
+Run from the repository root:
+    python -m benchmarks.airtable_backup --records 50000 --runs 10
+
+The table has --records records with --fields fields, a tenth of them lists like airtable's linked records.
+Between runs --changed percent of the records are edited, and as many are deleted and added. Each run backs
+up the table both ways. Reports the space used by all runs, the time to save one, and the time to load the
+latest pickle and to restore the latest and the first state from the delta files.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from airtableutils import AirtableBackup
+
+
+def synthetic_records(n_records, n_fields):
+    """airtable records, as returned by get_all"""
+    records = []
+    for i in range(n_records):
+        fields = {'tag': 'bank_' + str(i), 'name': 'Bank ' + str(i)}
+        for j in range(n_fields - 2):
+            fields['field ' + str(j)] = ['rec' + str(i + j)] if j % 10 == 0 else 'value ' + str((i * j) % 997)
+        records.append({'id': 'rec' + str(i).zfill(14), 'fields': fields})
+    return records
+
+
+def next_run(records, n_changed, next_id):
+    """the records after editing, deleting and adding n_changed of them"""
+    random.shuffle(records)
+    kept = records[n_changed:]
+    for record in kept[:n_changed]:
+        record['fields'] = dict(record['fields'], name=record['fields']['name'] + ' Edited')
+    added = [{'id': 'new' + str(next_id + i).zfill(14), 'fields': {'tag': 'new_bank_' + str(next_id + i), 'name': 'New Bank'}}
+             for i in range(n_changed)]
+    return kept + added
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run(n_records, n_fields, n_runs, changed_percent):
+    random.seed(0)
+    records = synthetic_records(n_records, n_fields)
+    n_changed = int(n_records * changed_percent / 100)
+
+    with tempfile.TemporaryDirectory() as pickle_dir, tempfile.TemporaryDirectory() as delta_dir:
+        backup = AirtableBackup('benchmark', delta_dir)
+        pickle_seconds, delta_seconds = 0, 0
+        for i in range(n_runs):
+            if i:
+                records = next_run(records, n_changed, i * n_changed)
+            df = pd.DataFrame([record['fields'] for record in records], index=[record['id'] for record in records])
+            pickle_path = os.path.join(pickle_dir, str(i) + '.pkl')
+            pickle_seconds += timed(df.to_pickle, pickle_path)[1]
+            delta_seconds += timed(backup.save, records)[1]
+
+        _, load_seconds = timed(pd.read_pickle, pickle_path)
+        restored, restore_seconds = timed(backup.restore)
+        _, first_seconds = timed(backup.restore, datetime.fromisoformat(backup.manifest()['backups'][0]['time']))
+        pickle_mb, delta_mb = directory_size(pickle_dir) / 1024 ** 2, directory_size(delta_dir) / 1024 ** 2
+
+    pd.testing.assert_frame_equal(restored, df.sort_index())
+    print('records: {:>7,} | runs: {:>3} | pickles: {:7.1f} MB, {:5.2f} s per save, load {:5.2f} s | '
+          'deltas: {:7.1f} MB, {:5.2f} s per save, restore latest {:5.2f} s, first {:5.2f} s'.format(
+              n_records, n_runs, pickle_mb, pickle_seconds / n_runs, load_seconds, delta_mb, delta_seconds / n_runs,
+              restore_seconds, first_seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, nargs='+', default=[50000])
+    parser.add_argument('--fields', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--changed', type=float, default=1, help='percent of the records edited, deleted and added')
+    args = parser.parse_args()
+    for n_records in args.records:
+        run(n_records, args.fields, args.runs, args.changed)
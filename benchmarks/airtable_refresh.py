@@ -0,0 +1,80 @@
+"""
+Benchmark refreshing BankGreenAirtable in full against refreshing it from its local cache.
+
+Run from the repository root:
+    python -m benchmarks.airtable_refresh --records 5000 50000
+
+The fake table (testutils.FakeAirtable) holds --records rows, every 100th of them preserved, with the
+synced fields and --extra-fields fields the sync does not read, like the notes kept in airtable. Each
+page of 100 records takes --latency seconds. After the cache is made, --modified percent of the rows are
+changed, then the table is refreshed in full, and from the cache: the modified records, and a listing
+of every tag. Reports the seconds, requests and megabytes transferred of each.
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import timedelta
+
+import pandas as pd
+
+from airtableutils import BankGreenAirtable, BatchWriter
+from testutils import FakeAirtable
+
+
+def synthetic_table(n_records, n_extra_fields):
+    """the fake table and the local frame"""
+    local = [{'tag': 'bank_' + str(i), 'name': 'Bank ' + str(i), 'website': 'bank' + str(i) + '.example',
+              'rating': 'unk'} for i in range(n_records)]
+    extra = {'notes ' + str(j): 'Notes of the bank, kept by hand in airtable. ' * 4 for j in range(n_extra_fields)}
+    remote = [dict(row, **extra) for row in local]
+    # airtable leaves out unchecked checkboxes, so only preserved rows have the field
+    for row in remote[::100]:
+        row['preserve'] = True
+    table = FakeAirtable(remote)
+    # the cache is made after the rows were last modified
+    for record_id in table.modified:
+        table.modified[record_id] -= timedelta(hours=1)
+    return table, pd.DataFrame(local)
+
+
+def refresh(table, local_df, cache_path):
+    table.requests, table.transferred = 0, 0
+    start = time.perf_counter()
+    sync = BankGreenAirtable('benchmark', local_df, ['website'], table, BatchWriter(table, rate=10 ** 9), cache_path)
+    return sync, time.perf_counter() - start, table.requests, table.transferred / 1024 ** 2
+
+
+def run(n_records, n_extra_fields, modified_percent, latency):
+    table, local_df = synthetic_table(n_records, n_extra_fields)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_path = os.path.join(cache_dir, 'benchmark.json.gz')
+        refresh(table, local_df, cache_path)
+
+        record_ids = list(table.records)
+        step = max(1, round(100 / modified_percent))
+        table.batch_update([{'id': record_id, 'fields': {'rating': 'ok'}} for record_id in record_ids[::step]])
+
+        table.latency = latency
+        full, full_seconds, full_requests, full_mb = refresh(table, local_df, None)
+        cached, cached_seconds, cached_requests, cached_mb = refresh(table, local_df, cache_path)
+
+    if cached.refresh_report['mode'] != 'incremental' or list(cached.df.rating) != list(full.df.rating):
+        raise Exception('refreshes differ')
+
+    print('records: {:>7,} | modified: {:>6,} | full: {:6.2f} s, {:>5,} requests, {:7.2f} MB | '
+          'cached: {:6.2f} s, {:>5,} requests, {:7.2f} MB'.format(
+              n_records, cached.refresh_report['fetched'], full_seconds, full_requests, full_mb,
+              cached_seconds, cached_requests, cached_mb))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, nargs='+', default=[5000, 50000])
+    parser.add_argument('--extra-fields', type=int, default=20)
+    parser.add_argument('--modified', type=float, default=1, help='percent of the records modified')
+    parser.add_argument('--latency', type=float, default=0, help='seconds per page of records')
+    args = parser.parse_args()
+    for n_records in args.records:
+        run(n_records, args.extra_fields, args.modified, args.latency)
@@ -0,0 +1,98 @@
+"""
+Benchmark rerunning an airtable sync that failed part way, with and without a SyncJournal.
+
+Run from the repository root:
+    python -m benchmarks.airtable_resume --records 500
+
+The fake table (testutils.FakeAirtable) holds --records rows. The local frame renames all of them and
+adds half as many new rows, one of which airtable rejects, like its typecast errors. The first sync gives up
+on requests throttled with a 429 part way, after the other chunks went through. It is then run again, paced at
+--rate requests per second, four ways: calling airtable_sync again on the same object, which plans from the same
+refresh, without and with the journal, and as a new process, which refreshes the table (a request per 100 records)
+and plans again, without and with the journal. Without the journal, a rerun on the same object
+inserts the new rows that went through twice, and every rerun sends the rejected record again.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+import requests
+
+from airtableutils import BankGreenAirtable, BatchWriter, SyncJournal
+from testutils import FakeAirtable
+
+
+def failed_sync(n_records, rate, journal_path):
+    """a table and a BankGreenAirtable whose sync failed part way"""
+    remote = [{'tag': 'bank_' + str(i), 'name': 'Bank ' + str(i)} for i in range(n_records)]
+    # airtable leaves out unchecked checkboxes, so only preserved rows have the field
+    remote[0]['preserve'] = True
+    tags = [row['tag'] for row in remote] + ['new_bank_' + str(i) for i in range(n_records // 2)]
+    local_df = pd.DataFrame({'tag': tags, 'name': ['Renamed Bank'] * len(tags)})
+    local_df.loc[len(tags) - 1, 'name'] = 'Rejected Bank'
+
+    table = FakeAirtable(remote)
+    table.rejected_names = {'Rejected Bank'}
+    journal = SyncJournal(journal_path) if journal_path else None
+    sync = BankGreenAirtable('benchmark', local_df, connection=table,
+                             writer=BatchWriter(table, rate=rate, max_retries=0, journal=journal))
+    table.throttle_every = 7
+    try:
+        sync.airtable_sync()
+    except requests.exceptions.HTTPError:
+        pass
+    table.throttle_every = 0
+    return table, sync
+
+
+def rerun(table, sync, rate, journal_path, new_process):
+    """(requests, seconds, records skipped as acknowledged) of running the sync again"""
+    requests_before = table.requests
+    start = time.perf_counter()
+    if new_process:
+        journal = SyncJournal(journal_path) if journal_path else None
+        sync = BankGreenAirtable(sync.table_name, sync.local_df, connection=table,
+                                 writer=BatchWriter(table, rate=rate, journal=journal))
+    else:
+        sync.writer.max_retries = 5
+    sync.airtable_sync()
+    return table.requests - requests_before, time.perf_counter() - start, sync.writer.stats['resumed']
+
+
+def duplicates(table):
+    return len(table.records) - len(set(fields['tag'] for fields in table.records.values()))
+
+
+def run(n_records, rate):
+    results = []
+    with tempfile.TemporaryDirectory() as journal_dir:
+        for new_process in [False, True]:
+            for journaled in [False, True]:
+                journal_path = os.path.join(journal_dir, 'benchmark.journal') if journaled else None
+                table, sync = failed_sync(n_records, rate, journal_path)
+                first_requests = table.requests
+                n_requests, seconds, skipped = rerun(table, sync, rate, journal_path, new_process)
+                # a later run, once everything else is synced, only has the rejected record to send
+                later_requests = rerun(table, sync, rate, journal_path, True)[0]
+                results.append(('new process' if new_process else 'same object',
+                                'journal' if journaled else 'no journal', first_requests, n_requests, seconds,
+                                skipped, duplicates(table), later_requests))
+                if journal_path and os.path.exists(journal_path):
+                    os.remove(journal_path)
+
+    for where, journal, first_requests, n_requests, seconds, skipped, n_duplicates, later_requests in results:
+        print('records: {:>6,} | {:<11} | {:<10} | failed sync: {:>5,} requests | rerun: {:>5,} requests, {:6.2f} s, '
+              '{:>5,} records skipped | {:>5,} duplicates | later run: {:>3,} requests'.format(
+                  n_records, where, journal, first_requests, n_requests, seconds, skipped, n_duplicates,
+                  later_requests))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, nargs='+', default=[500])
+    parser.add_argument('--rate', type=float, default=5, help='requests per second allowed to the writer')
+    args = parser.parse_args()
+    for n_records in args.records:
+        run(n_records, args.rate)
@@ -0,0 +1,82 @@
+"""
+Benchmark the airtable sync of BankGreenAirtable against an in-memory fake airtable.
+
+Run from the repository root:
+    python -m benchmarks.airtable_sync --records 5000 50000
+
+The fake table (testutils.FakeAirtable) holds --records rows, every 100th of them preserved.
+The local frame keeps 90% of them, changes the name of a tenth of those and adds 10% new rows.
+Times refresh (computing the rows to delete, insert and update) and the three sync steps. Tables up to --legacy-max records are also
+timed with the previous scans: an iterrows pass per id lookup and a frame filter per updated row.
+"""
+import argparse
+import time
+
+import pandas as pd
+
+from airtableutils import BankGreenAirtable, BatchWriter
+from testutils import FakeAirtable
+
+
+def synthetic_tables(n_records):
+    """the remote rows and the local frame"""
+    remote = [{'tag': 'bank_' + str(i), 'name': 'Bank ' + str(i), 'website': 'bank' + str(i) + '.example',
+               'rating': 'unk'} for i in range(n_records)]
+    # airtable leaves out unchecked checkboxes, so only preserved rows have the field
+    for row in remote[::100]:
+        row['preserve'] = True
+
+    kept = [{field: value for field, value in row.items() if field != 'preserve'} for row in remote[:n_records * 9 // 10]]
+    local = [dict(row, name=row['name'] + ' Renamed') if i % 10 == 0 else row for i, row in enumerate(kept)]
+    local += [{'tag': 'new_bank_' + str(i), 'name': 'New Bank ' + str(i), 'website': None, 'rating': 'ok'}
+              for i in range(n_records // 10)]
+    return remote, pd.DataFrame(local)
+
+
+def legacy_ids(sync, tag_list):
+    return [index for index, row in sync.df.iterrows() if row['tag'] in tag_list]
+
+
+def legacy_local_rows(sync):
+    return [sync.local_df[sync.local_df.tag == tag].to_dict(orient='records')[0] for tag in sync.update_tags]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run(n_records, legacy_max):
+    remote, local_df = synthetic_tables(n_records)
+    table = FakeAirtable(remote)
+
+    # no rate limit: this measures the work done locally, see benchmarks/airtable_writer.py for the writes
+    writer = BatchWriter(table, rate=10 ** 9)
+    sync, init_seconds = timed(BankGreenAirtable, 'benchmark', local_df, ['website'], table, writer)
+    _, refresh_seconds = timed(sync.refresh)
+
+    legacy = 'skipped'
+    if n_records <= legacy_max:
+        _, ids_seconds = timed(lambda: (legacy_ids(sync, sync.delete_tags), legacy_ids(sync, sync.update_tags)))
+        _, rows_seconds = timed(legacy_local_rows, sync)
+        legacy = '{:7.2f} s'.format(ids_seconds + rows_seconds)
+
+    _, flush_seconds = timed(sync.airtable_flush)
+    _, insert_seconds = timed(sync.airtable_insert)
+    _, update_seconds = timed(sync.airtable_update)
+
+    print('records: {:>7,} | init: {:6.2f} s | refresh: {:6.2f} s | flush: {:6.2f} s | insert: {:6.2f} s | '
+          'update: {:6.2f} s | unchanged rows skipped: {:>6,} | requests: {:>6,} | '
+          'previous id and row lookups: {}'.format(
+              n_records, init_seconds, refresh_seconds, flush_seconds, insert_seconds, update_seconds,
+              sync.update_report['skipped'], table.requests, legacy))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, nargs='+', default=[5000, 50000])
+    parser.add_argument('--legacy-max', type=int, default=5000)
+    args = parser.parse_args()
+    for n_records in args.records:
+        run(n_records, args.legacy_max)
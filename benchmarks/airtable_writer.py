@@ -0,0 +1,87 @@
+"""
+Benchmark writing a resync to airtable: the airtable client's blocking batch calls against BatchWriter.
+
+Run from the repository root:
+    python -m benchmarks.airtable_writer --rows 1000
+
+Both write to an in-memory fake table (testutils.FakeAirtable) where each request takes --latency
+seconds and every --throttle-every-th request is rejected with a 429. The resync deletes a tenth
+of --rows records, inserts as many as --rows and updates --rows.
+
+The previous writes called batch_delete, batch_insert and batch_update one after another.
+The client sends a request per 10 records and sleeps API_LIMIT (0.2 s) after each delete and
+insert request. That sequence is replayed here, retrying throttled requests after a second.
+BatchWriter sends the same requests from a pool of threads at up to --rate requests per second.
+"""
+import argparse
+import time
+
+import requests
+
+from airtableutils import BatchWriter
+from testutils import FakeAirtable
+
+
+API_LIMIT = 0.2
+
+
+def resync(n_rows):
+    """a table with the rows to delete and update, and the batches of the resync"""
+    table = FakeAirtable([{'tag': 'bank_' + str(i), 'name': 'Bank ' + str(i)} for i in range(n_rows + n_rows // 10)])
+    record_ids = list(table.records)
+    batches = [('delete', record_ids[n_rows:]),
+               ('insert', [{'tag': 'new_bank_' + str(i), 'name': 'New Bank ' + str(i)} for i in range(n_rows)]),
+               ('update', [{'id': record_id, 'fields': {'name': 'Renamed Bank'}} for record_id in record_ids[:n_rows]])]
+    return table, batches
+
+
+def blocking_write(table, batches):
+    """the previous writes: one batch after another, a request per chunk, sleeping API_LIMIT after deletes and inserts"""
+    for kind, records in batches:
+        for i in range(0, len(records), 10):
+            chunk = records[i:i + 10]
+            while True:
+                try:
+                    if kind == 'delete':
+                        table.batch_delete(chunk)
+                    elif kind == 'insert':
+                        table.batch_insert(chunk, typecast=True)
+                    else:
+                        table.batch_update(chunk, typecast=True)
+                    break
+                except requests.exceptions.HTTPError:
+                    time.sleep(1)
+            if kind != 'update':
+                time.sleep(API_LIMIT)
+
+
+def run(n_rows, latency, throttle_every, rate, workers):
+    table, batches = resync(n_rows)
+    table.latency, table.throttle_every = latency, throttle_every
+    start = time.perf_counter()
+    blocking_write(table, batches)
+    blocking_seconds = time.perf_counter() - start
+    n_requests = table.requests
+
+    table, batches = resync(n_rows)
+    table.latency, table.throttle_every = latency, throttle_every
+    writer = BatchWriter(table, rate=rate, workers=workers)
+    writer.write(batches)
+    requests_per_second, records_per_second = writer.throughput
+
+    print('rows: {:>6,} | requests: {:>5,} | blocking: {:7.2f} s ({:4.1f} requests/s) | writer: {:7.2f} s '
+          '({:4.1f} requests/s, {:5.0f} records/s, {} retries)'.format(
+              n_rows, n_requests, blocking_seconds, n_requests / blocking_seconds, writer.stats['seconds'],
+              requests_per_second, records_per_second, writer.stats['retries']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000])
+    parser.add_argument('--latency', type=float, default=0.15, help='seconds per request')
+    parser.add_argument('--throttle-every', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=5, help='requests per second allowed to the writer')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    for n_rows in args.rows:
+        run(n_rows, args.latency, args.throttle_every, args.rate, args.workers)
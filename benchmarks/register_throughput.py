@@ -0,0 +1,61 @@
+"""
+Benchmark registering parsed sources one at a time against create_or_update_banks, per source.
+
+Run from the repository root:
+    python -m benchmarks.register_throughput
+
+Sources are parsed once from the local copies, then registered in pipeline order into two
+registries: one with create_or_update_bank per source, one with a single create_or_update_banks
+call per loader. Both registries must end up with the same banks. This is repeated --repeat times,
+alternating which of the two registers each loader first, and the fastest time of each is reported.
+"""
+import argparse
+import time
+
+from bankreg import BankReg
+from pipeline import SOURCES, parse_source
+
+
+def new_registry():
+    BankReg.__instance__ = None
+    return BankReg()
+
+
+def run(names, repeat):
+    parsed = {name: parse_source(name)[0] for name in names}
+
+    seconds = {name: {'single': [], 'bulk': []} for name in names}
+    for i in range(repeat):
+        one_at_a_time, bulk = new_registry(), new_registry()
+        for name in names:
+            def single():
+                for source in parsed[name]:
+                    one_at_a_time.create_or_update_bank(source)
+
+            def batch():
+                return bulk.create_or_update_banks(parsed[name])
+
+            for label, register in [('single', single), ('bulk', batch)][::1 if i % 2 == 0 else -1]:
+                start = time.perf_counter()
+                result = register()
+                seconds[name][label].append(time.perf_counter() - start)
+                if label == 'bulk':
+                    summary = result
+
+            if i == repeat - 1:
+                n = max(len(parsed[name]), 1)
+                print('{:<12} | records: {:>7,} | created: {:>6,} | updated: {:>6,} | '
+                      'one at a time: {:7.2f} us/record | bulk: {:7.2f} us/record'.format(
+                          name, len(parsed[name]), len(summary['created']), len(summary['updated']),
+                          min(seconds[name]['single']) / n * 1e6, min(seconds[name]['bulk']) / n * 1e6))
+
+        if list(one_at_a_time.reg) != list(bulk.reg):
+            raise Exception('bulk registration created different banks')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sources', nargs='+', default=[name for name in SOURCES if name != 'usnic'])
+    parser.add_argument('--repeat', type=int, default=6)
+    args = parser.parse_args()
+    run(args.sources, args.repeat)
@@ -0,0 +1,84 @@
+"""
+Benchmark diffing two registries of synthetic banks.
+
+Run from the repository root:
+    python -m benchmarks.registry_diff --banks 100000
+
+A registry of the synthetic banks of benchmarks/registry_memory.py is saved to a snapshot, then
+--changed of its Switchit banks are re-rated and as many new banks are added, and the registry is
+saved again. Times snapshot.diff between the two snapshots and between the first snapshot and the
+live registry, against comparing the two exports field by field in Python.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+import snapshot
+from bankreg import BankReg
+from benchmarks.registry_memory import synthetic_sources
+from sources.switchit.switchit import Switchit
+
+
+def field_by_field(old_path, new_path):
+    """the diff of two snapshots, comparing every field of every bank"""
+    old_rows = {row['tag']: row for row in snapshot.export_rows(old_path).drop(columns='row_hash')
+                .to_dict(orient='records')}
+    new_rows = {row['tag']: row for row in snapshot.export_rows(new_path).drop(columns='row_hash')
+                .to_dict(orient='records')}
+
+    modified = {}
+    for tag in old_rows.keys() & new_rows.keys():
+        for field, new_value in new_rows[tag].items():
+            old_value = old_rows[tag][field]
+            if not (old_value == new_value or (pd.isna(old_value) and pd.isna(new_value))):
+                modified.setdefault(tag, {})[field] = (old_value, new_value)
+
+    return {'added': sorted(new_rows.keys() - old_rows.keys()), 'removed': sorted(old_rows.keys() - new_rows.keys()),
+            'modified': modified}
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run(n_banks, n_changed):
+    BankReg.__instance__ = None
+    bankreg = BankReg()
+    bankreg.create_or_update_banks(synthetic_sources(n_banks))
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        old_path, new_path = os.path.join(snapshot_dir, 'old'), os.path.join(snapshot_dir, 'new')
+        bankreg.save_snapshot(old_path)
+
+        switchit_tags = [tag for tag, bank in bankreg.reg.items() if bank.switchit][:n_changed]
+        for tag in switchit_tags:
+            bankreg.reg[tag].set_data_by_source(Switchit(bankreg=None, name=bankreg.reg[tag].switchit.name,
+                                                         rating='great'))
+        bankreg.create_or_update_banks(Switchit(bankreg=None, name='Added Bank ' + str(i), rating='ok')
+                                       for i in range(n_changed))
+        bankreg.save_snapshot(new_path)
+
+        changes, snapshots_seconds = timed(snapshot.diff, old_path, new_path)
+        _, live_seconds = timed(snapshot.diff, old_path, bankreg)
+        expected, field_seconds = timed(field_by_field, old_path, new_path)
+
+    if changes != expected:
+        raise Exception('diffs differ')
+
+    print('banks: {:>9,} | added: {:>6,} | modified: {:>6,} | snapshots: {:6.3f} s | snapshot to live: {:6.3f} s | '
+          'field by field: {:6.3f} s'.format(len(bankreg.reg), len(changes['added']), len(changes['modified']),
+                                             snapshots_seconds, live_seconds, field_seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--banks', type=int, nargs='+', default=[100000])
+    parser.add_argument('--changed', type=int, default=1000, help='banks re-rated, and banks added')
+    args = parser.parse_args()
+    for n_banks in args.banks:
+        run(n_banks, args.changed)
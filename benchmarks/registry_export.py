@@ -0,0 +1,91 @@
+"""
+Benchmark exporting a registry of synthetic banks to a DataFrame.
+
+Run from the repository root:
+    python -m benchmarks.registry_export --banks 100000
+
+Compares return_registry_as_df, which fills the DataFrame a column at a time, with the
+previous export, which built a dict per bank and passed the rows to DataFrame.from_dict.
+Both exports run on a warm registry (ratings and cached properties already computed),
+once with the default allowed ratings and once including unrated banks. The banks are
+those of benchmarks/registry_memory.py, so only the Switchit banks have a rating.
+"""
+import argparse
+import time
+
+import pandas as pd
+
+from bankreg import BankReg
+from benchmarks.registry_memory import synthetic_sources
+
+
+def rows_export(bankreg, allowed_ratings):
+    """the export as it was before, with a dict per bank"""
+    rows = []
+    for tag, bank in bankreg.reg.items():
+        rating, reason = bank.rating_reason
+        if rating in allowed_ratings:
+            financing_of_fossil_fuels = bank.financing_of_fossil_fuels
+            rows.append({'tag': tag,
+                         'name': bank.name,
+                         'aliases': ','.join(bank.names),
+                         'country': ','.join(bank.countries),
+                         'data_sources': ','.join(bank.data_sources),
+                         'website': bank.website,
+                         'rating': rating.lower(),
+                         'reason': reason,
+                         'subsidiary_of': bank.subsidiary_tag,
+                         'Rank - Total': financing_of_fossil_fuels['rank_total'],
+                         'total-USD': financing_of_fossil_fuels['total_usd'],
+                         'total-EUR': financing_of_fossil_fuels['total_eur'],
+                         'total-GBP': financing_of_fossil_fuels['total_gbp'],
+                         'total-AUD': financing_of_fossil_fuels['total_aud'],
+                         'total-CAD': financing_of_fossil_fuels['total_cad'],
+                         'permid': bank.permid,
+                         'isin': bank.isin,
+                         'viafid': bank.viafid,
+                         'lei': bank.lei,
+                         'rssd': bank.rssd,
+                         'googleid': bank.googleid,
+                         'wikiid': bank.wikiid})
+    return pd.DataFrame.from_dict(rows)
+
+
+def timed(export):
+    start = time.perf_counter()
+    df = export()
+    return df, time.perf_counter() - start
+
+
+def run(n_banks, repeat):
+    BankReg.__instance__ = None
+    bankreg = BankReg()
+    bankreg.create_or_update_banks(synthetic_sources(n_banks))
+    # warm up ratings and cached properties, so both exports start from the same state
+    bankreg.return_registry_as_df(allowed_ratings=['great', 'ok', 'bad', 'worst', 'unk'])
+
+    for label, allowed_ratings in [('rated', ['great', 'ok', 'bad', 'worst']),
+                                   ('all', ['great', 'ok', 'bad', 'worst', 'unk'])]:
+        row_seconds, column_seconds = [], []
+        for _ in range(repeat):
+            rows, seconds = timed(lambda: rows_export(bankreg, allowed_ratings))
+            row_seconds.append(seconds)
+            columns, seconds = timed(lambda: bankreg.return_registry_as_df(allowed_ratings=allowed_ratings))
+            column_seconds.append(seconds)
+
+        if not rows.astype(object).equals(columns.astype(object)):
+            raise Exception('exports differ')
+
+        print('banks: {:>9,} | {:<5} | rows: {:>7,} | dict per row: {:6.3f} s | columnar: {:6.3f} s | '
+              'memory: {:6.1f} MB -> {:6.1f} MB'.format(
+                  n_banks, label, len(columns), min(row_seconds), min(column_seconds),
+                  rows.memory_usage(deep=True).sum() / 1024 ** 2, columns.memory_usage(deep=True).sum() / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--banks', type=int, nargs='+', default=[100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    for n_banks in args.banks:
+        run(n_banks, args.repeat)
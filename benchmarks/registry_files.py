@@ -0,0 +1,74 @@
+"""
+Benchmark exported registry files: CSV against parquet and arrow, as written by BankReg.write_export.
+
+Run from the repository root:
+    python -m benchmarks.registry_files --banks 100000
+
+For each format, measures the time to write the file, its size, the time to read it back
+into pandas and the time to read only the banks with a given rating. The registry holds the
+synthetic banks of benchmarks/registry_memory.py.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from bankreg import BankReg
+from benchmarks.registry_memory import synthetic_sources
+
+
+ALL_RATINGS = ['great', 'ok', 'bad', 'worst', 'unk']
+
+
+def write_csv(bankreg, path):
+    bankreg.return_registry_as_df(allowed_ratings=ALL_RATINGS).to_csv(path, index=False)
+
+
+def read_filtered_csv(path, rating):
+    df = pd.read_csv(path)
+    return df[df['rating'] == rating]
+
+
+FORMATS = {
+    'csv': (write_csv, pd.read_csv, read_filtered_csv),
+    'parquet': (lambda bankreg, path: bankreg.write_export(path, allowed_ratings=ALL_RATINGS), pd.read_parquet,
+                lambda path, rating: pd.read_parquet(path, filters=[('rating', '==', rating)])),
+    'arrow': (lambda bankreg, path: bankreg.write_export(path, allowed_ratings=ALL_RATINGS), pd.read_feather,
+              lambda path, rating: pd.read_feather(path).loc[lambda df: df['rating'] == rating]),
+}
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run(n_banks, rating):
+    BankReg.__instance__ = None
+    bankreg = BankReg()
+    bankreg.create_or_update_banks(synthetic_sources(n_banks))
+    # rate and cache properties once, so all formats start from the same state
+    bankreg.return_registry_as_df(allowed_ratings=ALL_RATINGS)
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        for name, (write, read, read_filtered) in FORMATS.items():
+            path = os.path.join(export_dir, 'registry.' + name)
+            _, write_seconds = timed(write, bankreg, path)
+            df, read_seconds = timed(read, path)
+            filtered, filtered_seconds = timed(read_filtered, path, rating)
+            print('banks: {:>9,} | {:<7} | write: {:6.3f} s | size: {:7.2f} MB | read: {:6.3f} s | '
+                  'read {}: {:6.3f} s ({:,} banks)'.format(
+                      len(df), name, write_seconds, os.path.getsize(path) / 1024 ** 2, read_seconds,
+                      rating, filtered_seconds, len(filtered)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--banks', type=int, nargs='+', default=[100000])
+    parser.add_argument('--rating', default='ok', help='rating to filter on')
+    args = parser.parse_args()
+    for n_banks in args.banks:
+        run(n_banks, args.rating)
@@ -0,0 +1,64 @@
+"""
+Benchmark the memory held by a registry of synthetic banks.
+
+Run from the repository root:
+    python -m benchmarks.registry_memory --banks 100000
+
+Banks are a mix of USNIC banks (most identifiers set), Wikidata banks (a few identifiers)
+and Switchit banks (no identifiers). Memory is measured with tracemalloc, from before the
+sources are created until they are all registered, so it includes the registry's indexes.
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from bankreg import BankReg
+from sources.switchit.switchit import Switchit
+from sources.usnic.usnic import USNIC
+from sources.wikidata.wikidata import Wikidata
+
+
+def synthetic_sources(n_banks):
+    """yields n_banks sources with distinct names: half USNIC, a third Wikidata, the rest Switchit"""
+    for i in range(n_banks):
+        name = 'Synthetic Bank ' + str(i)
+        if i % 6 < 3:
+            yield USNIC(bankreg=None, name=name, aliases=[name, name + ', National Association'],
+                        country='United States', rssd=str(i), rssd_hd='0', lei=None, cusip=str(i * 7),
+                        thrift='0', thrift_hc='0', aba_prim=str(i * 3), fdic_cert=str(i), ncua='0', occ='0',
+                        ein=None, website=None)
+        elif i % 6 < 5:
+            yield Wikidata(bankreg=None, name=name, language='en', websites={'https://bank' + str(i) + '.example'},
+                           countries={'Germany'}, bank_types={'bank'}, twitters=set(), description='a bank',
+                           aliases={name}, permid=None, isin=None, viafid=None, lei='LEI' + str(i),
+                           googleid=None, wikiid='Q' + str(i))
+        else:
+            yield Switchit(bankreg=None, name=name, rating='ok')
+
+
+def run(n_banks):
+    BankReg.__instance__ = None
+    bankreg = BankReg()
+
+    gc.collect()
+    tracemalloc.start()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+
+    bankreg.create_or_update_banks(synthetic_sources(n_banks))
+
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    used_bytes = tracemalloc.get_traced_memory()[0] - start_bytes
+    tracemalloc.stop()
+
+    print('banks: {:>9,} | registry: {:8.1f} MB | {:7.0f} bytes/bank | registered in {:6.2f} s (traced)'.format(
+        len(bankreg.reg), used_bytes / 1024 ** 2, used_bytes / len(bankreg.reg), elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--banks', type=int, nargs='+', default=[100000])
+    for n_banks in parser.parse_args().banks:
+        run(n_banks)
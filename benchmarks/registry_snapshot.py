@@ -0,0 +1,53 @@
+"""
+Benchmark saving and loading registry snapshots against building the registry from its sources.
+
+Run from the repository root:
+    python -m benchmarks.registry_snapshot --banks 100000
+
+The registry holds the synthetic banks of benchmarks/registry_memory.py, rated before it is saved.
+Building only counts registering the already created sources, not parsing them, so the real
+saving is larger.
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from bankreg import BankReg
+from benchmarks.registry_memory import synthetic_sources
+
+
+def run(n_banks):
+    sources = list(synthetic_sources(n_banks))
+
+    BankReg.__instance__ = None
+    bankreg = BankReg()
+    start = time.perf_counter()
+    bankreg.create_or_update_banks(sources)
+    bankreg.rate_banks()
+    build_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        path = os.path.join(snapshot_dir, 'registry')
+        start = time.perf_counter()
+        bankreg.save_snapshot(path)
+        save_seconds = time.perf_counter() - start
+        size = int(subprocess.run(['du', '-sk', path], capture_output=True, text=True).stdout.split()[0]) * 1024
+
+        start = time.perf_counter()
+        loaded = BankReg.load_snapshot(path)
+        load_seconds = time.perf_counter() - start
+
+    if len(loaded.reg) != len(bankreg.reg) or loaded.ratings != bankreg.ratings:
+        raise Exception('loaded registry differs')
+
+    print('banks: {:>9,} | build: {:6.2f} s | save: {:6.2f} s | snapshot: {:6.1f} MB | load: {:6.2f} s'.format(
+        len(loaded.reg), build_seconds, save_seconds, size / 1024 ** 2, load_seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--banks', type=int, nargs='+', default=[100000])
+    for n_banks in parser.parse_args().banks:
+        run(n_banks)
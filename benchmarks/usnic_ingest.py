@@ -0,0 +1,111 @@
+"""
+Benchmark streaming USNIC ingestion on a synthetic NIC attributes file of increasing size.
+
+Run from the repository root:
+    python -m benchmarks.usnic_ingest --rows 1000000 3000000
+
+Each size is measured three times, each time in a fresh worker process so its peak memory can be measured on its own:
+- read: USNIC.iter_parse, counting and discarding sources as they are produced. Only one chunk of the file is held
+  at a time, so the reader's peak memory should stay roughly flat as the file grows.
+- parse + register: USNIC.parse, then registering the list of sources in an empty registry with a single
+  create_or_update_banks call, as the pipeline did before streaming USNIC.
+- stream + register: USNIC.register_chunks from USNIC.iter_parse, a create_or_update_banks call per chunk, as
+  load_and_create and the pipeline do.
+Registering leaves out the successor and parent links, which need the other NIC files. The registry's banks keep
+their sources in every case, so what streaming saves is the list of parsed sources and the state a single
+create_or_update_banks call holds for all of them.
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from bankreg import BankReg
+from sources.usnic.usnic import USNIC, ATTRIBUTE_COLUMNS, CHUNK_SIZE
+
+
+# other columns of the NIC attributes file, which the reader should skip
+OTHER_COLUMNS = ['D_DT_START', 'D_DT_END', 'CITY', 'STATE_ABBR_NM', 'ZIP_CD', 'ENTITY_TYPE', 'CNTRY_NM']
+
+
+def write_synthetic_attributes(path, n_rows, seed=0, chunksize=500000):
+    """writes a csv shaped like CSV_ATTRIBUTES_ACTIVE, with unique rssds and mostly blank optional identifiers"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_rows, chunksize):
+        n = min(chunksize, n_rows - start)
+        rssd = np.arange(start, start + n) + 1
+
+        def sometimes(values, probability):
+            return pd.Series(values).where(rng.random(n) < probability)
+
+        columns = {
+            'NM_SHORT': pd.Series(rssd).map(lambda x: 'BANK ' + str(x)),
+            'NM_LGL': pd.Series(rssd).map(lambda x: 'THE SYNTHETIC BANK ' + str(x) + ', NATIONAL ASSOCIATION'),
+            'URL': sometimes(pd.Series(rssd).map(lambda x: 'https://bank' + str(x) + '.example'), 0.3),
+            '#ID_RSSD': rssd,
+            'ID_RSSD_HD_OFF': rng.integers(0, n_rows, n),
+        }
+        for column in ATTRIBUTE_COLUMNS:
+            columns.setdefault(column, sometimes(rng.integers(1, 10 ** 9, n), 0.2))
+        for column in OTHER_COLUMNS:
+            columns[column] = 'x' * 12
+
+        pd.DataFrame(columns).to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_file(path, chunksize):
+    """runs in a worker process: returns (sources, seconds, peak rss in MB)"""
+    start = time.perf_counter()
+    count = sum(1 for _ in USNIC.iter_parse(path, chunksize))
+    return count, time.perf_counter() - start, peak_rss_mb()
+
+
+def parse_and_register(path, chunksize):
+    """runs in a worker process: returns (banks, seconds, peak rss in MB)"""
+    start = time.perf_counter()
+    BankReg.__instance__ = None
+    bankreg = BankReg()
+    bankreg.create_or_update_banks(USNIC.parse(path, chunksize))
+    return len(bankreg.reg), time.perf_counter() - start, peak_rss_mb()
+
+
+def stream_and_register(path, chunksize):
+    """runs in a worker process: returns (banks, seconds, peak rss in MB)"""
+    start = time.perf_counter()
+    BankReg.__instance__ = None
+    bankreg = BankReg()
+    USNIC.register_chunks(bankreg, USNIC.iter_parse(path, chunksize), chunksize)
+    return len(bankreg.reg), time.perf_counter() - start, peak_rss_mb()
+
+
+def run(rows, chunksize):
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows in rows:
+            path = os.path.join(tmp, 'CSV_ATTRIBUTES_ACTIVE.CSV')
+            write_synthetic_attributes(path, n_rows)
+            size_mb = os.path.getsize(path) / 1024 ** 2
+
+            for label, measure in [('read', read_file), ('parse + register', parse_and_register),
+                                   ('stream + register', stream_and_register)]:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    count, elapsed, peak_mb = executor.submit(measure, path, chunksize).result()
+
+                print('{:<17} | rows: {:>10,} | file: {:7.1f} MB | {:7.2f} s | {:6.2f} us/row | '
+                      'peak rss: {:7.1f} MB'.format(label, count, size_mb, elapsed, elapsed / n_rows * 1e6, peak_mb))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 3000000])
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    run(args.rows, args.chunksize)
@@ -0,0 +1,73 @@
+"""
+Benchmark building the USNIC successor index and resolving RSSDs through it.
+
+Run from the repository root:
+    python -m benchmarks.usnic_successors --rows 100000 1000000
+
+The first line uses the CSV_TRANSFORMATIONS.CSV shipped with the repo, the others synthetic
+transformations made of merger chains of random length. Lookups should cost the same however
+long the chains are.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from sources.usnic.usnic import SuccessorIndex
+
+
+def synthetic_transformations(n_rows, max_chain=20, seed=0):
+    """returns a dataframe shaped like CSV_TRANSFORMATIONS, made of chains of mergers of up to max_chain banks"""
+    rng = np.random.default_rng(seed)
+
+    chain_lengths = rng.integers(2, max_chain + 1, n_rows)
+    chain_lengths = chain_lengths[:np.searchsorted(np.cumsum(chain_lengths - 1), n_rows) + 1]
+    rssds = np.arange(int(chain_lengths.sum()))
+
+    # every bank in a chain merges into the next one, except the last of each chain
+    chain_ends = np.cumsum(chain_lengths) - 1
+    predecessors = np.setdiff1d(rssds, chain_ends)[:n_rows]
+
+    return pd.DataFrame({
+        '#ID_RSSD_PREDECESSOR': predecessors.astype(str),
+        'ID_RSSD_SUCCESSOR': (predecessors + 1).astype(str),
+        'TRNSFM_CD': np.where(rng.random(len(predecessors)) < 0.9, '1', '50'),
+        'DT_TRANS': (19800101 + predecessors % 40 * 10000).astype(str),
+    })
+
+
+def measure(label, build):
+    start = time.perf_counter()
+    index = build()
+    build_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(1)
+    predecessors = list(index.successors)
+    queries = [predecessors[i] for i in rng.integers(0, len(predecessors), 1000000)]
+
+    start = time.perf_counter()
+    for rssd in queries:
+        index.resolve(rssd)
+    lookup_seconds = time.perf_counter() - start
+
+    series = pd.Series(queries)
+    start = time.perf_counter()
+    index.resolve_series(series)
+    series_seconds = time.perf_counter() - start
+
+    print('{:<26} | resolved: {:>9,} | build: {:6.2f} s | resolve: {:6.2f} M/s | resolve_series: {:6.2f} M/s'.format(
+        label, len(index), build_seconds, len(queries) / lookup_seconds / 1e6, len(queries) / series_seconds / 1e6))
+
+
+def run(rows):
+    measure('CSV_TRANSFORMATIONS.CSV', SuccessorIndex.from_csv)
+    for n_rows in rows:
+        df = synthetic_transformations(n_rows)
+        measure('synthetic {:,} rows'.format(n_rows), lambda: SuccessorIndex.from_df(df))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    run(parser.parse_args().rows)
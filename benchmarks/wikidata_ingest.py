@@ -0,0 +1,72 @@
+"""
+Benchmark Wikidata ingestion on synthetic sparql results of increasing size.
+
+Run from the repository root:
+    python -m benchmarks.wikidata_ingest --rows 5000 50000 500000
+
+The time per row should stay roughly constant as the result grows.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from bankreg import BankReg
+from maps.country_map import country_map
+from sources.wikidata.wikidata import Wikidata
+
+
+def synthetic_sparql_result(n_rows, seed=0):
+    """returns a dataframe shaped like the wikidata sparql result, with roughly two rows per bank"""
+    rng = np.random.default_rng(seed)
+    n_banks = max(n_rows // 2, 1)
+
+    bank_ids = np.sort(rng.integers(0, n_banks, n_rows))
+    bank_values = pd.Series(bank_ids).map(lambda x: 'http://www.wikidata.org/entity/Q' + str(x))
+
+    def sometimes(values, probability):
+        return pd.Series(values).where(rng.random(n_rows) < probability)
+
+    countries = np.array(sorted(country_map))
+    parents = rng.integers(0, n_banks, n_rows)
+
+    return pd.DataFrame({
+        'bank.value': bank_values,
+        'bankLabel.xml:lang': 'en',
+        'bankLabel.value': pd.Series(bank_ids).map(lambda x: 'Synthetic Bank ' + str(x)),
+        'countryLabel.value': countries[rng.integers(0, len(countries), n_rows)],
+        'instanceLabel.value': np.array(['bank', 'business', 'savings bank'])[rng.integers(0, 3, n_rows)],
+        'viafid.value': sometimes(bank_ids.astype(str), 0.2),
+        'deathyear.value': sometimes(np.full(n_rows, 1999.0), 0.05),
+        'website.value': sometimes(pd.Series(bank_ids).map(lambda x: 'https://bank' + str(x) + '.example'), 0.5),
+        'bankDescription.value': 'a synthetic bank',
+        'bankAltLabel.value': sometimes(pd.Series(bank_ids).map(lambda x: 'SB' + str(x)), 0.5),
+        'twitter.value': np.nan,
+        'isin.value': np.nan,
+        'gid.value': np.nan,
+        'permid.value': sometimes(bank_ids.astype(str), 0.1),
+        'parent.value': sometimes(pd.Series(parents).map(lambda x: 'http://www.wikidata.org/entity/Q' + str(x)), 0.1),
+        'lei.value': np.nan,
+    })
+
+
+def run(rows):
+    for n_rows in rows:
+        df = synthetic_sparql_result(n_rows)
+
+        BankReg.__instance__ = None
+        bankreg = BankReg()
+
+        start = time.perf_counter()
+        Wikidata.create_from_df(bankreg, df)
+        elapsed = time.perf_counter() - start
+
+        print('rows: {:>9,} | banks: {:>8,} | {:8.2f} s | {:6.2f} us/row'.format(
+            n_rows, len(bankreg.reg), elapsed, elapsed / n_rows * 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[5000, 50000, 500000])
+    run(parser.parse_args().rows)
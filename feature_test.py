@@ -1,7 +1,25 @@
+import gzip
+import itertools
+import json
+import os
+import tempfile
 import unittest
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import requests
 
 from bankreg import BankReg
-from testutils import banktrack3, ran4, switchit1, subsidiary_bank
+from pipeline import build_registry, run, sync_to_airtable
+from sources.bocc.bocc import BOCC
+from sources.gabv.gabv import Gabv
+from sources.usnic.usnic import USNIC, SuccessorIndex
+from sources.wikidata.wikidata import Wikidata
+from sources import source_cache
+from sources.pycountry_util import find_country, find_countries
+from testutils import banktrack3, ran4, switchit1, subsidiary_bank, FakeAirtable
+from airtableutils import AirtableBackup, BankGreenAirtable, BatchWriter, SyncJournal
 
 
 class TestPreferredName(unittest.TestCase):
@@ -35,3 +53,503 @@ class TestRatingSubsidiaries(unittest.TestCase):
 #        # child should have the same rating as its parent
 #        self.assertEqual(self.parent.rating_reason, self.subsidiary.rating_reason)
 
+
+class TestCountryNormalization(unittest.TestCase):
+
+    def test_country_map_and_index(self):
+        self.assertEqual(find_country('Bolivia'), ('success', 'Bolivia, Plurinational State of'))
+        self.assertEqual(find_country('  mexico '), ('success', 'Mexico'))
+        self.assertEqual(find_country('CAN'), ('success', 'Canada'))
+        self.assertEqual(find_country('Côte d\'Ivoire'), ('success', "Côte d'Ivoire"))
+
+    def test_failure(self):
+        self.assertEqual(find_country('Kingdom of Prussia')[0], 'failure')
+
+    def test_series(self):
+        res = find_countries(pd.Series(['Canada', np.nan, 'Kingdom of Prussia', 'Canada'], index=[3, 4, 5, 6]))
+        self.assertEqual(list(res.index), [3, 4, 5, 6])
+        self.assertEqual(res.loc[3, 'country'], 'Canada')
+        self.assertEqual(res.loc[6, 'status'], 'success')
+        self.assertEqual(res.loc[5, 'status'], 'failure')
+        self.assertTrue(pd.isna(res.loc[4, 'status']))
+
+
+class TestWikidataGroupedIngest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        BankReg.__instance__ = None
+        cls.bankreg = BankReg()
+
+        uri = 'http://www.wikidata.org/entity/'
+        df = pd.DataFrame({
+            'bank.value': [uri + 'Q2', uri + 'Q1', uri + 'Q2', uri + 'Q3'],
+            'bankLabel.xml:lang': ['en', 'en', 'en', 'en'],
+            'bankLabel.value': ['Child Bank', 'Parent Bank', 'Child Bank', 'Closed Bank'],
+            'countryLabel.value': ['Canada', 'Mexico', 'Mexico', 'Canada'],
+            'instanceLabel.value': ['bank', 'bank', 'business', 'bank'],
+            'viafid.value': np.nan,
+            'deathyear.value': [np.nan, np.nan, np.nan, 1999],
+            'website.value': ['https://child.example', np.nan, np.nan, np.nan],
+            'bankDescription.value': np.nan,
+            'bankAltLabel.value': ['Child', np.nan, 'The Child Bank', np.nan],
+            'twitter.value': np.nan,
+            'isin.value': np.nan,
+            'gid.value': np.nan,
+            'permid.value': np.nan,
+            'parent.value': [uri + 'Q1', np.nan, np.nan, np.nan],
+            'lei.value': np.nan})
+        Wikidata.create_from_df(cls.bankreg, df)
+
+    def test_one_bank_per_uri_and_closed_banks_skipped(self):
+        self.assertEqual(sorted(self.bankreg.reg.keys()), ['child_bank', 'parent_bank'])
+
+    def test_rows_are_aggregated(self):
+        child = self.bankreg.reg['child_bank'].wikidata
+        self.assertEqual(child.aliases, {'Child', 'The Child Bank', 'Child Bank'})
+        self.assertEqual(child.countries, {'Canada', 'Mexico'})
+        self.assertEqual(child.website, 'https://child.example')
+
+    def test_parent_linked(self):
+        self.assertEqual(self.bankreg.reg['child_bank'].subsidiary_tag, 'parent_bank')
+
+
+class TestParallelBuild(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        sources = ['banktrack', 'bocc', 'switchit', 'custombank']
+        cls.serial, cls.serial_stats = build_registry(sources, jobs=1)
+        cls.parallel, cls.parallel_stats = build_registry(sources, jobs=2)
+
+    def test_same_registry(self):
+        self.assertEqual(list(self.serial.reg), list(self.parallel.reg))
+        allowed = ['great', 'ok', 'bad', 'worst', 'unk']
+        self.assertTrue(self.serial.return_registry_as_df(allowed_ratings=allowed).equals(
+            self.parallel.return_registry_as_df(allowed_ratings=allowed)))
+
+    def test_stats_in_precedence_order(self):
+        self.assertEqual([x['source'] for x in self.parallel_stats], ['banktrack', 'bocc', 'switchit', 'custombank'])
+        self.assertEqual(self.parallel_stats[-1]['registry_size'], len(self.parallel.reg))
+
+    def test_unknown_source(self):
+        self.assertRaises(Exception, lambda: build_registry(['not_a_source']))
+
+
+class TestPipelineRun(unittest.TestCase):
+
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as run_dir:
+            export_path = os.path.join(run_dir, 'registry.parquet')
+            bankreg, stages = run(['banktrack', 'bocc', 'switchit', 'custombank'], jobs=1, offline=True,
+                                  export_path=export_path)
+            exported = pd.read_parquet(export_path)
+
+            self.assertEqual([stage['stage'] for stage in stages][-3:], ['build', 'rate', 'export ' + export_path])
+            self.assertEqual(stages[-3]['rows'], len(bankreg.reg))
+            self.assertEqual(stages[-1]['rows'], len(exported))
+
+            table = FakeAirtable([{'tag': 'preserved', 'preserve': True}])
+            table.records[next(iter(table.records))]['notes'] = 'not synced'
+            stages = sync_to_airtable(bankreg, 'test', backup_dir=run_dir, cache_dir=run_dir, connection=table)
+            self.assertEqual([stage['stage'] for stage in stages],
+                             ['airtable refresh (full, no cache)', 'airtable backup',
+                              'airtable sync: 0 deleted, {} inserted, 0 updated, 0 abandoned'.format(len(exported))])
+            self.assertEqual(list(AirtableBackup('test', run_dir).restore()['notes']), ['not synced'])
+            self.assertEqual(sorted(fields['tag'] for fields in table.records.values()),
+                             sorted(['preserved'] + list(exported['tag'])))
+
+            # the ratings exported are the ratings synced
+            table = FakeAirtable([{'tag': 'preserved', 'preserve': True}])
+            sync_to_airtable(bankreg, 'great', allowed_ratings=['great'], backup_dir=run_dir, cache_dir=run_dir,
+                             connection=table)
+            self.assertEqual(sorted(fields['tag'] for fields in table.records.values()),
+                             sorted(['preserved'] + list(exported[exported['rating'] == 'great']['tag'])))
+
+
+class TestSourceCache(unittest.TestCase):
+
+    def assertSameRecords(self, parsed, cached):
+        self.assertEqual(len(parsed), len(cached))
+        for a, b in zip(parsed, cached):
+            self.assertIs(type(a), type(b))
+            a, b = source_cache.record_fields(a), source_cache.record_fields(b)
+            self.assertEqual(list(a), list(b))
+            for field in a:
+                if isinstance(a[field], np.ndarray):
+                    np.testing.assert_array_equal(a[field], b[field])
+                elif isinstance(a[field], dict):
+                    self.assertTrue(pd.Series(a[field]).equals(pd.Series(b[field])))
+                elif not (pd.isna(a[field]) is True and pd.isna(b[field]) is True):
+                    self.assertEqual(a[field], b[field])
+                    self.assertIs(type(a[field]), type(b[field]))
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for cls, kwargs in [(BOCC, {}), (Gabv, {}), (Wikidata, {'load_from_api': False})]:
+                parsed = source_cache.cached_parse(cls, cache_dir=cache_dir, **kwargs)
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+                cached = source_cache.cached_parse(cls, cache_dir=cache_dir, **kwargs)
+                self.assertSameRecords(parsed, cached)
+                self.assertIsNone(cached[0].bankreg)
+
+                for path in os.listdir(cache_dir):
+                    os.remove(os.path.join(cache_dir, path))
+
+    def test_cache_dir_read_when_called(self):
+        default = source_cache.CACHE_DIR
+        with tempfile.TemporaryDirectory() as cache_dir:
+            source_cache.CACHE_DIR = cache_dir
+            try:
+                Gabv.parse_cached()
+            finally:
+                source_cache.CACHE_DIR = default
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_key_follows_content_and_version(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('a,b\n1,2\n')
+        try:
+            key = source_cache.cache_key(BOCC, [f.name])
+            self.assertEqual(key, source_cache.cache_key(BOCC, [f.name]))
+            self.assertNotEqual(key, source_cache.cache_key(Gabv, [f.name]))
+
+            with open(f.name, 'a') as changed:
+                changed.write('3,4\n')
+            self.assertNotEqual(key, source_cache.cache_key(BOCC, [f.name]))
+        finally:
+            os.remove(f.name)
+
+    def test_api_loads_are_not_cached(self):
+        self.assertIsNone(Wikidata.input_files(load_from_api=True))
+        self.assertEqual(Wikidata.input_files(load_from_api=False), ['./sources/wikidata/wikidata.csv'])
+
+
+class TestUSNICStreaming(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.NamedTemporaryFile('w', suffix='.CSV', delete=False) as f:
+            f.write('#ID_RSSD,NM_SHORT,NM_LGL,URL,D_DT_END,ID_RSSD_HD_OFF,ID_LEI,ID_CUSIP,ID_THRIFT,ID_THRIFT_HC,'
+                    'ID_ABA_PRIM,ID_FDIC_CERT,ID_NCUA,ID_OCC,ID_TAX\n'
+                    '101,FIRST BK ,First Bank N.A.,https://first.example,12/31/9999,0,0,0123,,,021000021,,,,\n'
+                    '102,SECOND BK,Second Bank,,12/31/9999,101,0,,,,,3511,,,\n'
+                    '103,THIRD BK,Third Bank,,12/31/9999,0,0,,,,,,,,\n')
+        cls.path = f.name
+        cls.banks = USNIC.parse(path=cls.path, chunksize=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def test_all_chunks_read(self):
+        self.assertEqual([bank.rssd for bank in self.banks], ['101', '102', '103'])
+
+    def test_identifiers_kept_as_strings(self):
+        first = self.banks[0]
+        self.assertEqual(first.name, 'FIRST BK')
+        self.assertEqual(first.aliases, {'FIRST BK', 'First Bank N.A.'})
+        self.assertEqual(first.cusip, '0123')
+        self.assertEqual(first.aba_prim, '021000021')
+        self.assertEqual(first.website, 'https://first.example')
+
+    def test_parents_linked(self):
+        BankReg.__instance__ = None
+        bankreg = BankReg()
+        for bank in USNIC.parse(path=self.path):
+            bankreg.create_or_update_bank(bank)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.CSV', delete=False) as f:
+            f.write('#ID_RSSD_PARENT,ID_RSSD_OFFSPRING,D_DT_START,D_DT_END,PCT_EQUITY\n'
+                    '101,102,1/1/2000 0:00:00,12/31/9999 0:00:00,100\n'
+                    '102,103,1/1/2000 0:00:00,12/31/9999 0:00:00,10\n'
+                    '999,103,1/1/2000 0:00:00,12/31/9999 0:00:00,100\n'
+                    '102,101,1/1/2000 0:00:00,1/1/2010 0:00:00,100\n')
+        try:
+            assignments = USNIC.link_parents(bankreg, path=f.name)
+        finally:
+            os.remove(f.name)
+
+        self.assertEqual(assignments, {'second_bk': 'first_bk'})
+        self.assertEqual(bankreg.reg['second_bk'].subsidiary_tag, 'first_bk')
+        self.assertIsNone(bankreg.reg['third_bk'].subsidiary_tag)
+
+    def test_registered_in_chunks(self):
+        BankReg.__instance__ = None
+        bankreg = BankReg()
+        whole = bankreg.create_or_update_banks(USNIC.parse(path=self.path) + USNIC.parse(path=self.path))
+
+        BankReg.__instance__ = None
+        chunked = BankReg()
+        sources = itertools.chain(USNIC.iter_parse(path=self.path), USNIC.iter_parse(path=self.path))
+        summary = USNIC.register_chunks(chunked, sources, chunksize=2)
+
+        self.assertEqual(summary, whole)
+        self.assertEqual(summary, {'created': ['first_bk', 'second_bk', 'third_bk'], 'updated': []})
+        self.assertEqual(list(chunked.reg), list(bankreg.reg))
+
+    def test_missing_values_are_none(self):
+        second = self.banks[1]
+        self.assertEqual(second.rssd_hd, '101')
+        self.assertEqual(second.fdic_cert, '3511')
+        self.assertIsNone(second.cusip)
+        self.assertIsNone(second.website)
+
+
+class TestSuccessorIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rows = [
+            # 1 merged into 2, which merged into 3
+            ('1', '2', '1', '19900101'),
+            ('2', '3', '1', '20000101'),
+            # 4 sold assets to 5 but survived, then failed into 6
+            ('4', '5', '7', '19900101'),
+            ('4', '6', '50', '20000101'),
+            # 7 failed and was split between 8 and 9
+            ('7', '8', '50', '20000101'),
+            ('7', '9', '50', '20000101'),
+            # 10 and 11 merged into each other
+            ('10', '11', '1', '19900101'),
+            ('11', '10', '1', '20000101'),
+        ]
+        cls.index = SuccessorIndex.from_df(pd.DataFrame(
+            rows, columns=['#ID_RSSD_PREDECESSOR', 'ID_RSSD_SUCCESSOR', 'TRNSFM_CD', 'DT_TRANS']))
+
+    def test_chains_resolved_to_survivor(self):
+        self.assertEqual(self.index.current, {'1': '3', '2': '3', '4': '6'})
+        self.assertEqual(self.index.resolve('1'), '3')
+        self.assertEqual(self.index.resolve('3'), '3')
+        self.assertEqual(self.index.resolve('7'), '7')
+        self.assertEqual(self.index.resolve('10'), '10')
+        self.assertEqual(list(self.index.resolve_series(pd.Series(['1', '7']))), ['3', '7'])
+
+    def test_predecessor_registered_into_survivor(self):
+        def usnic(name, rssd):
+            return USNIC(bankreg=None, name=name, aliases=[name], country='United States', rssd=rssd, rssd_hd=None,
+                         lei=None, cusip=None, thrift=None, thrift_hc=None, aba_prim=None, fdic_cert=None, ncua=None,
+                         occ=None, ein=None, website=None)
+
+        BankReg.__instance__ = None
+        bankreg = BankReg()
+        bankreg.create_or_update_bank(usnic('Merged Bank', '1'))
+        bankreg.set_rssd_successors(self.index)
+        bankreg.create_or_update_bank(usnic('Survivor Bank', '3'))
+
+        self.assertEqual(list(bankreg.reg), ['merged_bank'])
+        self.assertEqual(bankreg.reg['merged_bank'].usnic.name, 'Survivor Bank')
+
+
+class TestAirtableSync(unittest.TestCase):
+
+    def setUp(self):
+        self.local_df = pd.DataFrame({'tag': ['kept', 'changed', 'new'],
+                                      'name': ['Kept', 'Changed', 'New'],
+                                      'website': ['kept.example', None, 'new.example']})
+        self.table = FakeAirtable([{'tag': 'kept', 'name': 'Kept', 'website': 'kept.example'},
+                                   {'tag': 'changed', 'name': 'Old Name', 'website': 'custom.example'},
+                                   {'tag': 'gone', 'name': 'Gone'},
+                                   {'tag': 'preserved', 'name': 'Preserved', 'preserve': True}])
+        self.airtable = BankGreenAirtable('test', self.local_df, preservation_columns=['website'],
+                                          connection=self.table, writer=BatchWriter(self.table, rate=1000))
+
+    def test_refresh(self):
+        self.assertEqual(self.airtable.delete_tags, {'gone'})
+        self.assertEqual(self.airtable.update_tags, {'kept', 'changed'})
+        self.assertEqual(self.airtable.insert_tags, {'new'})
+        self.assertEqual([self.table.records[record_id]['tag'] for record_id in self.airtable.delete_ids], ['gone'])
+
+    def test_sync(self):
+        self.airtable.airtable_flush()
+        self.airtable.airtable_insert()
+        self.airtable.airtable_update()
+
+        rows = {fields['tag']: fields for fields in self.table.records.values()}
+        self.assertEqual(set(rows), {'kept', 'changed', 'new', 'preserved'})
+        self.assertEqual(rows['changed'], {'tag': 'changed', 'name': 'Changed', 'website': 'custom.example'})
+        self.assertEqual(rows['new'], {'tag': 'new', 'name': 'New', 'website': 'new.example'})
+
+    def test_sync_at_once(self):
+        deleted, inserted, updated = self.airtable.airtable_sync()
+        self.assertEqual(list(deleted['tag']), ['gone'])
+        self.assertEqual([record['fields']['tag'] for record in inserted], ['new'])
+        self.assertEqual([record['fields']['tag'] for record in updated], ['changed'])
+        self.assertEqual(len(self.table.records), 4)
+
+    def test_throttled_requests_are_retried(self):
+        table = FakeAirtable(throttle_every=2)
+        writer = BatchWriter(table, rate=1000, backoff=0)
+        inserted = writer.write([('insert', [{'tag': 'bank_' + str(i)} for i in range(45)])])[0]
+
+        self.assertEqual([record['fields']['tag'] for record in inserted], ['bank_' + str(i) for i in range(45)])
+        self.assertEqual(len(table.records), 45)
+        self.assertEqual(writer.stats['requests'], 5)
+        self.assertEqual(writer.stats['retries'], table.throttled)
+
+    def test_throttled_reads_are_retried(self):
+        table = FakeAirtable([{'tag': 'preserved', 'preserve': True}] + [{'tag': 'bank_' + str(i)} for i in range(249)],
+                             throttle_every=2)
+        writer = BatchWriter(table, rate=1000, backoff=0)
+        airtable = BankGreenAirtable('test', self.local_df, connection=table, writer=writer)
+
+        self.assertEqual(len(airtable.records), 250)
+        self.assertEqual(writer.stats['pages'], 3)
+        self.assertEqual(writer.stats['retries'], table.throttled)
+        self.assertEqual(table.requests, 3 + table.throttled)
+
+    def test_retries_are_limited(self):
+        writer = BatchWriter(FakeAirtable(throttle_every=1), rate=1000, max_retries=2, backoff=0)
+        self.assertRaises(requests.exceptions.HTTPError, writer.write, [('insert', [{'tag': 'bank'}])])
+        self.assertEqual(writer.stats['retries'], 2)
+
+    def test_unchanged_rows_are_skipped(self):
+        report = self.airtable.airtable_update(dry_run=True)
+        self.assertEqual(report, {'records': 2, 'updated': 1, 'skipped': 1, 'requests_saved': 0})
+        self.assertEqual(self.table.records[self.airtable.tag_ids['changed'][0]]['name'], 'Old Name')
+
+        # whole numbers come back from airtable as ints
+        self.assertEqual(self.airtable.fields_hash({'rank': 3.0, 'name': ['Kept']}),
+                         self.airtable.fields_hash({'name': 'Kept', 'rank': 3}))
+        # but lists of several values don't match their first one
+        self.assertNotEqual(self.airtable.fields_hash({'name': ['Kept', 'Other']}),
+                            self.airtable.fields_hash({'name': 'Kept'}))
+
+    def test_incremental_refresh(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = os.path.join(cache_dir, 'test.json.gz')
+            self.table.records[self.airtable.tag_ids['kept'][0]]['notes'] = 'not synced'
+            for record_id in self.table.modified:
+                self.table.modified[record_id] -= timedelta(hours=1)
+
+            cached = BankGreenAirtable('test', self.local_df, ['website'], self.table, cache_path=cache_path)
+            self.assertEqual(cached.refresh_report, {'mode': 'full, no cache', 'fetched': 4, 'records': 4})
+
+            self.table.batch_update([{'id': cached.tag_ids['changed'][0], 'fields': {'name': 'Newer Name'}}])
+            self.table.batch_delete(cached.tag_ids['gone'])
+            self.table.batch_insert([{'tag': 'added', 'name': 'Added'}])
+
+            incremental = BankGreenAirtable('test', self.local_df, ['website'], self.table, cache_path=cache_path)
+            full = BankGreenAirtable('test', self.local_df, ['website'], self.table)
+            self.assertEqual(incremental.refresh_report, {'mode': 'incremental', 'fetched': 2, 'records': 4})
+            self.assertEqual(incremental.records, full.records)
+            self.assertEqual(incremental.delete_tags, {'added'})
+
+            # backups are taken from the refreshed records, which hold the fields the sync does not read too
+            requests_before = self.table.requests
+            incremental.airtable_backup(cache_dir)
+            self.assertEqual(self.table.requests, requests_before)
+            self.assertEqual(AirtableBackup('test', cache_dir).restore().loc[incremental.tag_ids['kept'][0], 'notes'],
+                             'not synced')
+            self.assertEqual(incremental.update_tags, {'kept', 'changed'})
+            self.assertEqual(incremental.insert_tags, {'new'})
+
+    def test_inconsistent_cache_is_refreshed(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = os.path.join(cache_dir, 'test.json.gz')
+            for record_id in self.table.modified:
+                self.table.modified[record_id] -= timedelta(hours=1)
+            cached = BankGreenAirtable('test', self.local_df, ['website'], self.table, cache_path=cache_path)
+
+            # a change the modified time does not show
+            self.table.records[cached.tag_ids['gone'][0]]['tag'] = 'renamed'
+            refreshed = BankGreenAirtable('test', self.local_df, ['website'], self.table, cache_path=cache_path)
+            self.assertEqual(refreshed.refresh_report, {'mode': 'full, cache inconsistent', 'fetched': 4, 'records': 4})
+            self.assertEqual(refreshed.delete_tags, {'renamed'})
+
+            # caches in an older format are not used
+            with gzip.open(cache_path, 'rt') as f:
+                cache = json.load(f)
+            with gzip.open(cache_path, 'wt') as f:
+                json.dump(dict(cache, format=1), f)
+            older = BankGreenAirtable('test', self.local_df, ['website'], self.table, cache_path=cache_path)
+            self.assertEqual(older.refresh_report['mode'], 'full, no cache')
+
+    def test_backups_restore_each_state(self):
+        with tempfile.TemporaryDirectory() as backup_dir:
+            backups = AirtableBackup('test', backup_dir)
+            first = self.airtable.airtable_backup(backup_dir)
+            first_df = self.airtable.df.sort_index()
+
+            self.airtable.airtable_sync()
+            self.table.batch_update([{'id': self.airtable.tag_ids['kept'][0], 'fields': {'links': ['a', 'b']}}])
+            self.airtable.refresh()
+            second = self.airtable.airtable_backup(backup_dir)
+
+            history = backups.manifest()['backups']
+            self.assertEqual([os.path.join(backup_dir, backup['file']) for backup in history], [first, second])
+            # new, changed (name) and kept (links) are stored again, gone as deleted, preserved not at all
+            self.assertEqual([(backup['records'], backup['changed'], backup['deleted']) for backup in history],
+                             [(4, 4, 0), (4, 3, 1)])
+
+            pd.testing.assert_frame_equal(backups.restore(datetime.fromisoformat(history[0]['time'])), first_df)
+            pd.testing.assert_frame_equal(backups.restore(), self.airtable.df.sort_index())
+            self.assertEqual(backups.restore().loc[self.airtable.tag_ids['kept'][0], 'links'], ['a', 'b'])
+            self.assertRaises(Exception, backups.restore, datetime(2000, 1, 1, tzinfo=timezone.utc))
+
+    def journal_sync_tables(self):
+        table = FakeAirtable([{'tag': 'preserved', 'preserve': True}]
+                             + [{'tag': 'bank_' + str(i), 'name': 'Bank ' + str(i)} for i in range(30)])
+        tags = ['bank_' + str(i) for i in range(30)] + ['new_' + str(i) for i in range(25)]
+        return table, pd.DataFrame({'tag': tags, 'name': ['Renamed'] * 30 + ['New'] * 25})
+
+    def test_failed_sync_skips_acknowledged_records(self):
+        with tempfile.TemporaryDirectory() as journal_dir:
+            journal_path = os.path.join(journal_dir, 'test.journal')
+            table, local_df = self.journal_sync_tables()
+            table.throttle_every = 3
+            # a single worker sends the chunks in order, so the same ones are throttled every time
+            writer = BatchWriter(table, rate=1000, workers=1, max_retries=0, journal=SyncJournal(journal_path))
+            airtable = BankGreenAirtable('test', local_df, connection=table, writer=writer)
+
+            # the refresh is the first request, and every third request is throttled
+            self.assertRaises(requests.exceptions.HTTPError, airtable.airtable_sync)
+            self.assertEqual(table.requests, 1 + 6)
+            self.assertEqual([entry['error'] for entry in SyncJournal(journal_path).failed()],
+                             ['429 Client Error: Too Many Requests'] * 2)
+
+            # run again as planned from the same refresh: the acknowledged inserts are not sent twice
+            table.throttle_every = 0
+            _, inserted, updated = airtable.airtable_sync()
+            self.assertEqual(table.requests, 1 + 6 + 2)
+            self.assertEqual(writer.stats['resumed'], 35)
+            self.assertEqual((len(inserted), len(updated)), (25, 30))
+            self.assertEqual(sorted(fields['tag'] for fields in table.records.values()),
+                             sorted(['preserved'] + list(local_df['tag'])))
+            self.assertFalse(os.path.exists(journal_path))
+
+    def test_rejected_records_are_abandoned(self):
+        with tempfile.TemporaryDirectory() as journal_dir:
+            journal_path = os.path.join(journal_dir, 'test.journal')
+            table, local_df = self.journal_sync_tables()
+            table.rejected_names = {'BAD'}
+            local_df.loc[15, 'name'] = 'BAD'
+
+            def sync():
+                requests_before = table.requests
+                writer = BatchWriter(table, rate=1000, journal=SyncJournal(journal_path))
+                airtable = BankGreenAirtable('test', local_df, connection=table, writer=writer)
+                _, inserted, updated = airtable.airtable_sync()
+                return writer, len(inserted) + len(updated), table.requests - requests_before
+
+            # the rejected chunk is sent again a record at a time, and only the rejected record is abandoned
+            writer, written, sent = sync()
+            self.assertEqual((written, sent), (54, 1 + 6 + 10))
+            self.assertEqual([(kind, record['fields']['name'], error) for kind, record, error in writer.abandoned],
+                             [('update', 'BAD', '422 Client Error: Unprocessable Entity')])
+            self.assertEqual(sorted(fields['name'] for fields in table.records.values() if fields['tag'] == 'bank_15'),
+                             ['Bank 15'])
+
+            # while the record is unchanged, a new process doesn't send it again
+            writer, written, sent = sync()
+            self.assertEqual((written, sent), (0, 1))
+            self.assertEqual(len(writer.abandoned), 1)
+
+            # once it is fixed, it is synced, and nothing is left in the journal
+            local_df.loc[15, 'name'] = 'Fixed'
+            writer, written, sent = sync()
+            self.assertEqual((written, sent, writer.abandoned), (1, 2, []))
+            self.assertEqual([fields['name'] for fields in table.records.values() if fields['tag'] == 'bank_15'],
+                             ['Fixed'])
+            self.assertFalse(os.path.exists(journal_path))
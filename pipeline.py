@@ -0,0 +1,236 @@
+"""
+Builds the bank registry from its data sources.
+
+Reading and cleaning each source is independent of the others, so sources are parsed
+concurrently in a pool of worker processes. The parsed sources are then registered in
+SOURCES order, which is the order tags take precedence in, so the resulting registry is
+the same as when loading sources one after another.
+
+Sources in STREAMED_SOURCES are too large to parse into a list and send back from a worker. They are
+read in this process while they are registered, a chunk at a time, so their parse time is part of
+their register time.
+
+With use_cache, parsed sources are cached on disk (see sources/source_cache.py), so sources whose
+input files haven't changed since the last run are read back instead of parsed. Streamed sources
+are parsed in a worker as the others then, since the cache holds all of their sources.
+
+Run from the repository root to build the registry, write its export and optionally sync it to airtable,
+printing the time taken and the rows produced by each stage:
+    python pipeline.py --export registry.parquet --airtable staging
+See python pipeline.py --help for the options.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from airtableutils import AirtableBackup, BankGreenAirtable, BatchWriter, SyncJournal, connect
+from bankreg import BankReg
+from sources.banktrack.banktrack import Banktrack
+from sources.bocc.bocc import BOCC
+from sources.gabv.gabv import Gabv
+from sources.fairfinance.fairfinance import Fairfinance
+from sources.switchit.switchit import Switchit
+from sources.marketforces.marketforces import Marketforces
+from sources.custombank.custombank import Custombank
+from sources.wikidata.wikidata import Wikidata
+from sources.usnic.usnic import USNIC
+
+
+# sources in the order they are registered.
+# Banktrack must come first, since it supplies tags, and custom banks last, since they override.
+SOURCES = {
+    'banktrack': Banktrack,
+    'bocc': BOCC,
+    'gabv': Gabv,
+    'fairfinance': Fairfinance,
+    'switchit': Switchit,
+    'marketforces': Marketforces,
+    'wikidata': Wikidata,
+    'usnic': USNIC,
+    'custombank': Custombank,
+}
+
+# sources that are loaded from a remote api, or from a local copy when working offline
+API_SOURCES = {'banktrack', 'wikidata', 'custombank'}
+
+# sources registered from their iter_parse as they are read, rather than parsed in a worker
+STREAMED_SOURCES = {'usnic'}
+
+
+def parse_source(name, load_from_api=False, use_cache=False):
+    """parse a single source, returning its parsed sources and the time taken. Runs in worker processes."""
+    start = time.perf_counter()
+
+    kwargs = {'load_from_api': load_from_api} if name in API_SOURCES else {}
+    source_class = SOURCES[name]
+    parsed = source_class.parse_cached(**kwargs) if use_cache else source_class.parse(**kwargs)
+
+    return parsed, time.perf_counter() - start
+
+
+def parse_sources(names, jobs=None, load_from_api=False, use_cache=False):
+    """
+    yields (name, parsed sources, parse seconds) in the order of names.
+    With jobs=1 sources are parsed one after another in this process, otherwise in a pool of
+    worker processes (one per source by default). Results are yielded as soon as the source
+    and every source before it have been parsed, so registration overlaps with parsing.
+    Streamed sources are yielded as an iterator over their sources, with no parse time, unless use_cache.
+    """
+    streamed = set() if use_cache else STREAMED_SOURCES & set(names)
+    if jobs == 1:
+        for name in names:
+            if name in streamed:
+                yield name, SOURCES[name].iter_parse(), 0.0
+            else:
+                yield (name,) + parse_source(name, load_from_api, use_cache)
+        return
+
+    parsed_names = [name for name in names if name not in streamed]
+    with ProcessPoolExecutor(max_workers=jobs or max(len(parsed_names), 1)) as executor:
+        futures = {name: executor.submit(parse_source, name, load_from_api, use_cache) for name in parsed_names}
+        for name in names:
+            if name in streamed:
+                yield name, SOURCES[name].iter_parse(), 0.0
+            else:
+                yield (name,) + futures[name].result()
+
+
+def counted(sources, stats):
+    """yields sources, counting them in stats['records']"""
+    for source in sources:
+        stats['records'] += 1
+        yield source
+
+
+def build_registry(sources=None, jobs=None, load_from_api=False, use_cache=False, verbose=False):
+    """
+    Build a new registry from the named sources (all of them by default).
+    Returns the registry and a list of per-source stats.
+    """
+    unknown = set(sources or []) - set(SOURCES)
+    if unknown:
+        raise Exception("unknown sources: " + ', '.join(sorted(unknown)))
+    names = [name for name in SOURCES if sources is None or name in sources]
+
+    BankReg.__instance__ = None
+    bankreg = BankReg()
+
+    stats = []
+    for name, parsed, parse_seconds in parse_sources(names, jobs=jobs, load_from_api=load_from_api,
+                                                     use_cache=use_cache):
+        start = time.perf_counter()
+        source_stats = {'source': name, 'records': 0}
+        summary = SOURCES[name].register(bankreg, counted(parsed, source_stats))
+
+        source_stats.update({'created': len(summary['created']),
+                             'updated': len(summary['updated']),
+                             'parse_seconds': parse_seconds,
+                             'register_seconds': time.perf_counter() - start,
+                             'registry_size': len(bankreg.reg)})
+        stats.append(source_stats)
+        if verbose:
+            print(SOURCES[name].__name__ + ' Added. New Length: ' + str(len(bankreg.reg)))
+
+    return bankreg, stats
+
+
+# generic triodos needs to be removed because it is duplicated in country-specific instances
+REMOVED_TAGS = ['triodos', 'triodos_bank']
+
+# airtable columns edited by hand, which the sync only fills in when they are empty
+PRESERVATION_COLUMNS = ['name', 'website', 'subsidiary_of']
+
+# the local airtable cache, for incremental refreshes, and the sync journals
+AIRTABLE_CACHE = './.airtable_cache'
+
+
+def sync_to_airtable(bankreg, table_name, allowed_ratings=['great', 'ok', 'bad', 'worst'],
+                     preservation_columns=PRESERVATION_COLUMNS, backup_dir='./airtable_backups',
+                     cache_dir=AIRTABLE_CACHE, connection=None):
+    """
+    back up the airtable table, then delete, insert and update its rows to match the registry's banks with
+    allowed_ratings.
+    A sync that failed part way doesn't send the records it already wrote when run again, and records airtable
+    rejected are not sent again until they change (see SyncJournal).
+    connection defaults to the airtable table (see BankGreenAirtable). Returns the stages: refresh, backup and sync.
+    """
+    stages = []
+    start = time.perf_counter()
+    connection = connection or connect(table_name)
+    writer = BatchWriter(connection, journal=SyncJournal(os.path.join(cache_dir, table_name + '.journal')))
+    sync = BankGreenAirtable(table_name, bankreg.return_registry_as_df(allowed_ratings=allowed_ratings),
+                             preservation_columns, connection, writer,
+                             cache_path=os.path.join(cache_dir, table_name + '.json.gz'))
+    stages.append({'stage': 'airtable refresh (' + sync.refresh_report['mode'] + ')',
+                   'seconds': time.perf_counter() - start, 'rows': len(sync.records)})
+
+    # backed up from the refreshed records, without fetching the table again
+    start = time.perf_counter()
+    sync.airtable_backup(backup_dir)
+    backup = AirtableBackup(table_name, backup_dir).manifest()['backups'][-1]
+    stages.append({'stage': 'airtable backup', 'seconds': time.perf_counter() - start, 'rows': backup['records']})
+
+    start = time.perf_counter()
+    deleted, inserted, updated = sync.airtable_sync()
+    stages.append({'stage': 'airtable sync: {} deleted, {} inserted, {} updated, {} abandoned'.format(
+        len(deleted), len(inserted), len(updated), len(writer.abandoned)),
+        'seconds': time.perf_counter() - start, 'rows': len(deleted) + len(inserted) + len(updated)})
+    return stages
+
+
+def run(sources=None, jobs=None, offline=False, use_cache=False, export_path='registry.parquet',
+        allowed_ratings=['great', 'ok', 'bad', 'worst'], airtable_table=None):
+    """
+    build the registry, write the export of its banks with allowed_ratings, and sync those banks to the
+    airtable table airtable_table if given.
+    Returns the registry and the stages, dicts of stage, seconds and rows, in the order they ran.
+    """
+    start = time.perf_counter()
+    bankreg, build_stats = build_registry(sources, jobs=jobs, load_from_api=not offline, use_cache=use_cache)
+    stages = [{'stage': 'parse ' + stats['source'], 'seconds': stats['parse_seconds'], 'rows': stats['records']}
+              for stats in build_stats]
+    stages += [{'stage': 'register ' + stats['source'], 'seconds': stats['register_seconds'],
+                'rows': stats['created'] + stats['updated']} for stats in build_stats]
+    for tag in REMOVED_TAGS:
+        bankreg.reg.pop(tag, None)
+    stages.append({'stage': 'build', 'seconds': time.perf_counter() - start, 'rows': len(bankreg.reg)})
+
+    rating_stats = bankreg.rate_banks()
+    stages.append({'stage': 'rate', 'seconds': rating_stats['seconds'], 'rows': rating_stats['evaluated']})
+
+    start = time.perf_counter()
+    rows = bankreg.write_export(export_path, allowed_ratings=allowed_ratings)
+    stages.append({'stage': 'export ' + export_path, 'seconds': time.perf_counter() - start, 'rows': rows})
+
+    if airtable_table is not None:
+        stages += sync_to_airtable(bankreg, airtable_table, allowed_ratings=allowed_ratings)
+    return bankreg, stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sources', nargs='+', choices=list(SOURCES), help='sources to build from (default: all)')
+    parser.add_argument('--offline', action='store_true',
+                        help='read ' + ', '.join(sorted(API_SOURCES)) + ' from local copies rather than their apis')
+    parser.add_argument('--jobs', type=int, help='worker processes parsing sources (default: one per source)')
+    parser.add_argument('--cache', action='store_true', help='reuse sources parsed by earlier runs, if unchanged')
+    parser.add_argument('--export', default='registry.parquet',
+                        help='parquet, or arrow if it ends in .arrow or .feather (default: %(default)s)')
+    parser.add_argument('--ratings', nargs='+', default=['great', 'ok', 'bad', 'worst'],
+                        help='ratings exported and synced')
+    parser.add_argument('--airtable', metavar='TABLE', help='sync the registry to this airtable table')
+    args = parser.parse_args(argv)
+    if args.offline and args.airtable:
+        parser.error('--airtable needs the network, and cannot be used with --offline')
+
+    start = time.perf_counter()
+    _, stages = run(args.sources, jobs=args.jobs, offline=args.offline, use_cache=args.cache,
+                    export_path=args.export, allowed_ratings=args.ratings, airtable_table=args.airtable)
+    for stage in stages:
+        print('{:<60} {:8.2f} s {:>9,} rows'.format(stage['stage'], stage['seconds'], stage['rows']))
+    print('{:<60} {:8.2f} s'.format('total', time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
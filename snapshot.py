@@ -0,0 +1,252 @@
+"""
+Snapshots of a built registry.
+
+A snapshot is a directory of uncompressed arrow files:
+- the bank tags, in registration order
+- a file per source class with the sources attached to banks, stored like the source cache
+  (see sources/source_cache.py), plus the tag of the bank each is attached to
+- the name and id indexes
+- the rssd successors, when the registry resolves rssds through them
+- the memoized ratings and the parents they were taken from
+- the registry's export, with all ratings, and a content hash per row, used by diff
+and a manifest.json with the snapshot format and the loader versions of the source classes.
+Loading a snapshot restores the registry without re-running any loader.
+"""
+import gc
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from bank import Bank, SOURCE_CLASSES
+from sources import source_cache
+from sources.usnic.usnic import SuccessorIndex
+
+
+# bump when the way registries are stored changes
+SNAPSHOT_FORMAT = 2
+
+# ratings of the banks in a snapshot's export: all of them
+RATINGS = ['great', 'ok', 'bad', 'worst', 'unk']
+
+MANIFEST = 'manifest.json'
+KEY_METADATA_KEY = b'key'
+
+
+def write_table(path, table):
+    feather.write_feather(table, path, compression='uncompressed')
+
+
+def read_table(path):
+    return feather.read_table(path)
+
+
+def column_values(table, name):
+    """a column of a table as a list of python values"""
+    column = table.column(name)
+    if pa.types.is_dictionary(column.type):
+        # converting dictionary arrays to python is slow, while casting them back is not
+        column = column.cast(column.type.value_type)
+    return column.to_pylist()
+
+
+def index_table(bankreg):
+    """a row per index entry: the index name ('name' or an id type), the key and the tag"""
+    names, keys, tags = [], [], []
+    for index_name, index in [('name', bankreg.name_tag_dict)] + list(bankreg.id_tag_dict.items()):
+        names.extend([index_name] * len(index))
+        keys.extend(index.keys())
+        tags.extend(index.values())
+
+    # keys are mostly strings, but some identifiers are numbers
+    description, key_column = source_cache.encode_column(keys)
+    table = pa.table({'index': pa.array(names, type=pa.string()).dictionary_encode(), 'key': key_column,
+                      'tag': pa.array(tags, type=pa.string())})
+    return table.replace_schema_metadata({KEY_METADATA_KEY: json.dumps(description)})
+
+
+def save(bankreg, path):
+    """write a snapshot of bankreg to the directory at path, replacing any snapshot there"""
+    # write next to the target and rename, so an interrupted save never leaves a partial snapshot behind
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    manifest = {'format': SNAPSHOT_FORMAT, 'banks': len(bankreg.reg), 'sources': {}}
+    write_table(os.path.join(tmp_path, 'banks.arrow'),
+                pa.table({'tag': pa.array(list(bankreg.reg), type=pa.string())}))
+
+    for slot, cls in SOURCE_CLASSES.items():
+        banks = [bank for bank in bankreg.reg.values() if getattr(bank, slot) is not None]
+        sources = [getattr(bank, slot) for bank in banks]
+
+        # the tags cached on the sources stay valid, since the indexes are restored as they are
+        cached_tags = [source.tag_cache[0] if source.tag_cache else None for source in sources]
+        cached_probes = [source.tag_cache[2] if source.tag_cache else None for source in sources]
+
+        table = source_cache.records_table(sources)
+        metadata = table.schema.metadata
+        table = table.append_column('snapshot_bank', pa.array([bank.tag for bank in banks], type=pa.string()))
+        table = table.append_column('snapshot_cached_tag', pa.array(cached_tags, type=pa.string()))
+        table = table.append_column('snapshot_cached_probes', pa.array(cached_probes, type=pa.int64()))
+        write_table(os.path.join(tmp_path, slot + '.arrow'), table.replace_schema_metadata(metadata))
+
+        manifest['sources'][slot] = {'class': cls.__name__, 'loader_version': cls.LOADER_VERSION,
+                                     'count': len(sources)}
+
+    write_table(os.path.join(tmp_path, 'indexes.arrow'), index_table(bankreg))
+
+    if bankreg.rssd_successors is not None:
+        successors = bankreg.rssd_successors.successors
+        write_table(os.path.join(tmp_path, 'rssd_successors.arrow'),
+                    pa.table({'rssd': pa.array(list(successors.keys()), type=pa.string()),
+                              'successor': pa.array(list(successors.values()), type=pa.string())}))
+
+    # exporting rates every bank, so this comes before the ratings are saved
+    rows = export_rows(bankreg)
+    write_table(os.path.join(tmp_path, 'rows.arrow'), pa.Table.from_pandas(rows, preserve_index=False))
+
+    ratings = bankreg.ratings
+    write_table(os.path.join(tmp_path, 'ratings.arrow'), pa.table({
+        'tag': pa.array(list(ratings), type=pa.string()),
+        'rating': pa.array([rating for rating, _, _ in ratings.values()], type=pa.string()).dictionary_encode(),
+        'reason': pa.array([reason for _, reason, _ in ratings.values()], type=pa.string()).dictionary_encode(),
+        'depth': pa.array([depth for _, _, depth in ratings.values()], type=pa.int32()),
+        'parent': pa.array([bankreg.rating_parents.get(tag) for tag in ratings], type=pa.string())}))
+
+    with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def load(cls, path):
+    """a new registry of class cls (BankReg), restored from the snapshot at path"""
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest['format'] != SNAPSHOT_FORMAT:
+        raise Exception('snapshot format ' + str(manifest['format']) + ' is not supported, expected '
+                        + str(SNAPSHOT_FORMAT) + ': ' + path)
+    for slot, stored in manifest['sources'].items():
+        if stored['loader_version'] != SOURCE_CLASSES[slot].LOADER_VERSION:
+            raise Exception('snapshot ' + path + ' holds ' + stored['class'] + ' sources of loader version '
+                            + str(stored['loader_version']) + ', expected ' + str(SOURCE_CLASSES[slot].LOADER_VERSION))
+
+    # loading creates a lot of objects and no garbage, so collecting while loading only costs time
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return restore(cls, path)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def restore(cls, path):
+    """a new registry of class cls, restored from the files of the snapshot at path"""
+    cls.__instance__ = None
+    bankreg = cls()
+
+    # the indexes are restored as plain dicts, without marking their keys as changed,
+    # so the tags cached on the sources remain valid
+    table = read_table(os.path.join(path, 'indexes.arrow'))
+    keys = source_cache.decode_column(json.loads(table.schema.metadata[KEY_METADATA_KEY]),
+                                      column_values(table, 'key'))
+    entries = {index_name: {} for index_name in ['name'] + list(bankreg.id_tag_dict)}
+    for index_name, key, tag in zip(column_values(table, 'index'), keys, column_values(table, 'tag')):
+        entries[index_name][key] = tag
+    for index_name, index_entries in entries.items():
+        index = bankreg.index(index_name)
+        dict.clear(index)
+        dict.update(index, index_entries)
+        index.key_generations = {}
+    generation = type(bankreg.name_tag_dict).generation
+
+    table = read_table(os.path.join(path, 'banks.arrow'))
+    for tag in column_values(table, 'tag'):
+        bank = Bank.__new__(Bank)
+        bank.tag = tag
+        bank.bankreg = bankreg
+        for slot in SOURCE_CLASSES:
+            setattr(bank, slot, None)
+        bank.cache = {}
+        bankreg.reg[tag] = bank
+
+    for slot, source_class in SOURCE_CLASSES.items():
+        table = read_table(os.path.join(path, slot + '.arrow'))
+        sources = source_cache.sources_from_table(source_class, table)
+        bank_tags = column_values(table, 'snapshot_bank')
+        cached_tags = column_values(table, 'snapshot_cached_tag')
+        cached_probes = column_values(table, 'snapshot_cached_probes')
+        for source, bank_tag, cached_tag, n_probed in zip(sources, bank_tags, cached_tags, cached_probes):
+            source.bankreg = bankreg
+            if cached_tag is not None:
+                source.tag_cache = (cached_tag, generation, n_probed)
+            setattr(bankreg.reg[bank_tag], slot, source)
+
+    if os.path.exists(os.path.join(path, 'rssd_successors.arrow')):
+        table = read_table(os.path.join(path, 'rssd_successors.arrow'))
+        bankreg.rssd_successors = SuccessorIndex(dict(zip(column_values(table, 'rssd'),
+                                                          column_values(table, 'successor'))))
+
+    table = read_table(os.path.join(path, 'ratings.arrow'))
+    columns = {name: column_values(table, name) for name in table.column_names}
+    for tag, rating, reason, depth, parent in zip(columns['tag'], columns['rating'], columns['reason'],
+                                                  columns['depth'], columns['parent']):
+        bankreg.ratings[tag] = (rating, reason, depth)
+        if parent is not None:
+            bankreg.rating_parents[tag] = parent
+            bankreg.rating_children.setdefault(parent, set()).add(tag)
+
+    return bankreg
+
+
+def row_hashes(rows):
+    """a 64 bit hash of the contents of each row of an exported registry"""
+    return pd.util.hash_pandas_object(rows, index=False).to_numpy()
+
+
+def export_rows(registry):
+    """the export of a registry (a BankReg or the path of a snapshot), with all ratings and a row_hash column"""
+    if isinstance(registry, str):
+        return read_table(os.path.join(registry, 'rows.arrow')).to_pandas()
+
+    rows = registry.return_registry_as_df(allowed_ratings=RATINGS)
+    rows['row_hash'] = row_hashes(rows)
+    return rows
+
+
+def diff(old, new):
+    """
+    changes between the exports of two registries, each a BankReg or the path of a snapshot.
+    Returns {'added': [tags], 'removed': [tags], 'modified': {tag: {field: (old value, new value)}}}.
+    Banks are matched by tag and compared by their row hashes, so fields are only compared for banks
+    whose hashes differ.
+    """
+    old_rows, new_rows = export_rows(old), export_rows(new)
+
+    joined = pd.merge(old_rows[['tag', 'row_hash']], new_rows[['tag', 'row_hash']], on='tag', how='outer',
+                      suffixes=('_old', '_new'), indicator=True)
+    added = joined['tag'][joined['_merge'] == 'right_only']
+    removed = joined['tag'][joined['_merge'] == 'left_only']
+    changed = joined['tag'][(joined['_merge'] == 'both') & (joined['row_hash_old'] != joined['row_hash_new'])]
+
+    modified = {}
+    if len(changed):
+        fields = [field for field in new_rows.columns.union(old_rows.columns, sort=False)
+                  if field not in ['tag', 'row_hash']]
+        old_changed = old_rows.set_index('tag').loc[changed].reindex(columns=fields)
+        new_changed = new_rows.set_index('tag').loc[changed].reindex(columns=fields)
+        for field in fields:
+            old_values, new_values = old_changed[field].astype(object), new_changed[field].astype(object)
+            differs = ~((old_values == new_values) | (old_values.isna() & new_values.isna()))
+            for tag, old_value, new_value in zip(old_values.index[differs], old_values[differs], new_values[differs]):
+                modified.setdefault(tag, {})[field] = (old_value, new_value)
+
+    return {'added': sorted(added), 'removed': sorted(removed), 'modified': modified}
@@ -15,6 +15,8 @@ class Banktrack(Source):
     in its dataset, which this project uses.
     Because of this, BankTrack data must be imported before other data sources.
     """
+    __slots__ = ['source_id', 'description', 'update_date', 'banktrack_link', 'website']
+
     def __init__(self, bankreg, name, tag, update_date,
                  banktrack_link, country, website, description=''):
 
@@ -26,20 +28,23 @@ class Banktrack(Source):
         self.description = description
         self.update_date = update_date
         self.banktrack_link = banktrack_link
-        self.countries = set([find_country(country)[1]])
         self.website = website
 
         super(Banktrack, self).__init__(bankreg=bankreg,
                                         name=name,
                                         countries=set([find_country(country)[1]]))
 
-    @property
-    def tag(self):
-        '''overwrites parent property. Must be lowercased and stripped to match pipeline expectations'''
+    def preset_tag(self):
+        '''overwrites parent method. Must be lowercased and stripped to match pipeline expectations'''
         return self.source_id.lower().rstrip().lstrip()
 
     @classmethod
-    def load_and_create(cls, bankreg, load_from_api=False):
+    def input_files(cls, load_from_api=False):
+        # the api's response is only known after fetching it
+        return None if load_from_api else ['./sources/banktrack/bankprofiles.csv']
+
+    @classmethod
+    def parse(cls, load_from_api=False):
 
         # load from api or from local disk.
         # this is here because we don't have permission to publish one column of the data in this table
@@ -54,8 +59,9 @@ class Banktrack(Source):
             df = df.drop(columns=['general_comment'])
             df.to_csv('bankprofiles.csv')
 
+        banks = []
         for i, row in df.iterrows():
-            bank = Banktrack(bankreg=bankreg,
+            bank = Banktrack(bankreg=None,
                              name=row.title,
                              tag=row.tag,
                              description=row.general_comment if 'general_comment' in row.values else '',
@@ -63,5 +69,10 @@ class Banktrack(Source):
                              banktrack_link=row.link,
                              country=row.country,
                              website=row.website)
-            bankreg.create_or_update_bank(source=bank)
+            banks.append(bank)
+        return banks
+
+    @classmethod
+    def load_and_create(cls, bankreg, load_from_api=False, use_cache=False):
+        super(Banktrack, cls).load_and_create(bankreg, use_cache=use_cache, load_from_api=load_from_api)
         return bankreg
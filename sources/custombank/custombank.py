@@ -10,6 +10,8 @@ class Custombank(Source):
     requested via the contact box on the Bank.Green website. Noteworthy: Ratings that
     Bank.Green staff give a bank currently override other ratings.
     """
+    __slots__ = ['bank_tag', 'website', 'rating', 'reason']
+
     def __init__(self, bankreg, name="", bank_tag=None, countries="", subsidiary_tag=None,
                  rating=None, reason=None, website=None):
 
@@ -42,16 +44,17 @@ class Custombank(Source):
             countries=countries,
             subsidiary_tag=subsidiary_tag.lower().lstrip().rstrip())
 
-    @property
-    def tag(self):
-        if self.bank_tag:
-            return self.bank_tag
-
+    def preset_tag(self):
         # search for a tag if one is not provided
-        return super(Custombank, self).tag
+        return self.bank_tag or None
 
     @classmethod
-    def load_and_create(cls, bankreg, load_from_api=True):
+    def input_files(cls, load_from_api=True):
+        # the api's response is only known after fetching it
+        return None if load_from_api else ['./sources/custombank/custombank.csv']
+
+    @classmethod
+    def parse(cls, load_from_api=True):
 
         df = None
         if not load_from_api:
@@ -60,9 +63,10 @@ class Custombank(Source):
             df = pd.read_csv(URIs.CUSTOM_BANK.value).fillna('')
             df.to_csv('./sources/custombank/custombank.csv')
 
+        banks = []
         for (i, row) in df.iterrows():
             bank = Custombank(
-                bankreg=bankreg,
+                bankreg=None,
                 name=row['Preferred Bank Name'],
                 bank_tag=row['Bank Tag'],
                 countries=row['Country'],
@@ -70,5 +74,9 @@ class Custombank(Source):
                 rating=row['Rating'],
                 reason=row['Rating Reason'],
                 website=row['Website'])
+            banks.append(bank)
+        return banks
 
-            bankreg.create_or_update_bank(source=bank)
+    @classmethod
+    def load_and_create(cls, bankreg, load_from_api=True, use_cache=False):
+        super(Custombank, cls).load_and_create(bankreg, use_cache=use_cache, load_from_api=load_from_api)
@@ -11,6 +11,9 @@ class Fairfinance(Source):
     their policies. The data here was manually collected from various international fair finance guides
     sometime around April 2021.
     """
+    __slots__ = ['sweden', 'netherlands', 'japan', 'norway', 'brazil', 'belgium', 'indonesia',
+                 'germany', 'thailand', 'india']
+
     def __init__(self, bankreg, name, countries, sweden, netherlands,
                  japan, norway, brazil,
                  belgium, indonesia, germany, thailand, india):
@@ -44,11 +47,16 @@ class Fairfinance(Source):
         return numerator / divisor
 
     @classmethod
-    def load_and_create(cls, bankreg):
+    def input_files(cls):
+        return [URIs.FAIR_FINANCE.value]
+
+    @classmethod
+    def parse(cls):
 
         df = pd.read_csv(URIs.FAIR_FINANCE.value)
+        banks = []
         for (i, row) in df.iterrows():
-            bank = Fairfinance(bankreg=bankreg,
+            bank = Fairfinance(bankreg=None,
                                name=row['Bank'],
                                countries=row['Countries'],
                                sweden=row['Sweden - fairfinanceguide.se'],
@@ -62,4 +70,5 @@ class Fairfinance(Source):
                                thailand=row['Thailand - https://fairfinancethailand.org/'],
                                india=row['India - https://fairfinanceindia.org/media/495381/fair-finance-india-report_1311_final.pdf'] # noqa
                                )
-            bankreg.create_or_update_bank(source=bank)
+            banks.append(bank)
+        return banks
@@ -13,6 +13,11 @@ class Gabv(Source):
     B-Impact source and merge automatically.
     """
 
+    __slots__ = ['is_retail_1no_0yes_blankunk', 'b_impact', 'gabv', 'website', 'twitter',
+                 'description', 'mission', 'history', 'structure', 'market_focus', 'overall_score',
+                 'impact_area_environment', 'state', 'city', 'sector_2', 'size', 'industry',
+                 'industry_category', 'products_and_services', 'sector']
+
     def __init__(self, bankreg, name, is_retail_1no_0yes_blankunk, b_impact,
                  gabv, country, website, twitter, description, mission,
                  history, structure, market_focus, overall_score,
@@ -62,11 +67,16 @@ class Gabv(Source):
         self.countries.update(set(new_countries))
 
     @classmethod
-    def load_and_create(cls, bankreg):
+    def input_files(cls):
+        return [URIs.GABV.value]
+
+    @classmethod
+    def parse(cls):
         df = pd.read_csv(URIs.GABV.value)
 
+        banks = []
         for (i, row) in df.iterrows():
-            bank = Gabv(bankreg=bankreg,
+            bank = Gabv(bankreg=None,
                         name=row['company_name'],
                         is_retail_1no_0yes_blankunk=row['No Retail Banking? 1 = No, 0 = Yes, Blank = Unknown'],
                         b_impact=row['b-impact'],
@@ -89,6 +99,5 @@ class Gabv(Source):
                         industry_category=row['industry_category'],
                         products_and_services=row['products_and_services'],
                         sector=row['sector'])
-
-            bankreg.create_or_update_bank(source=bank)
-        len(bankreg.reg)
+            banks.append(bank)
+        return banks
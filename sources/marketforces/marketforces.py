@@ -10,6 +10,8 @@ class Marketforces(Source):
     Data is manually collected from the Marketforces Australian website, where
     the group is most active.
     """
+    __slots__ = ['ff_financing', 'statement']
+
     def __init__(self, bankreg, name, ff_financing, statement):
         self.name = name.rstrip().lstrip()
         self.ff_financing = ff_financing
@@ -22,12 +24,18 @@ class Marketforces(Source):
                                            countries=set([country]))
 
     @classmethod
-    def load_and_create(cls, bankreg):
+    def input_files(cls):
+        return [URIs.MARKETFORCES.value]
+
+    @classmethod
+    def parse(cls):
         df = pd.read_csv(URIs.MARKETFORCES.value)
+        banks = []
         for (i, row) in df.iterrows():
             bank = Marketforces(
-                bankreg=bankreg,
+                bankreg=None,
                 name=str(row.Name),
                 ff_financing=row['Amount Invested'],
                 statement=row['Position'])
-            bankreg.create_or_update_bank(source=bank)
+            banks.append(bank)
+        return banks
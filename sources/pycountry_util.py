@@ -1,5 +1,50 @@
+from functools import lru_cache
+
 from maps.country_map import country_map
+import pandas as pd
 import pycountry
+import unidecode
+
+
+# number of distinct strings whose fuzzy search result is remembered
+FUZZY_CACHE_SIZE = 4096
+
+
+def normalize_country_string(mystr):
+    return unidecode.unidecode(mystr).lower().rstrip().lstrip()
+
+
+def build_country_index():
+    '''
+    returns a dict mapping normalized (lowercased, unidecoded) country strings to country names.
+    Includes pycountry names, official names, common names, alpha-2 and alpha-3 codes.
+    country_map entries take precedence.
+    '''
+    index = {}
+    for country in pycountry.countries:
+        for attr in ('name', 'official_name', 'common_name', 'alpha_2', 'alpha_3'):
+            value = getattr(country, attr, None)
+            if value:
+                index.setdefault(normalize_country_string(value), country.name)
+
+    for key, value in country_map.items():
+        index[normalize_country_string(key)] = value
+
+    return index
+
+
+country_index = build_country_index()
+
+
+def fuzzy_find_country(mystr):
+    try:
+        name = pycountry.countries.search_fuzzy(mystr)[0].name
+        return ('success', name)
+    except Exception: # noqa handling noisy data here.
+        return ('failure', mystr)
+
+
+cached_fuzzy_find_country = lru_cache(maxsize=FUZZY_CACHE_SIZE)(fuzzy_find_country)
 
 
 def find_country(mystr=None, country_code=None):
@@ -7,16 +52,19 @@ def find_country(mystr=None, country_code=None):
     returns a tuple ("status", "normalized country")
     If a country is found, status is "success", if not, it's "failure"
 
+    Strings are checked against country_map, then against the precompiled country_index,
+    and only then fuzzy searched. Fuzzy search results are cached.
     '''
 
     if mystr is not None and country_map.get(mystr):
         return ('success', country_map.get(mystr))
-    if mystr:
-        try:
-            name = pycountry.countries.search_fuzzy(mystr)[0].name
+    if mystr and isinstance(mystr, str):
+        name = country_index.get(normalize_country_string(mystr))
+        if name:
             return ('success', name)
-        except Exception: # noqa handling noisy data here.
-            return ('failure', mystr)
+        return cached_fuzzy_find_country(mystr)
+    if mystr:
+        return fuzzy_find_country(mystr)
     if country_code:
         try:
             name = pycountry.countries.get(alpha_2=country_code).name
@@ -28,3 +76,17 @@ def find_country(mystr=None, country_code=None):
         raise Exception("mystr or country_code must be provided")
 
     return ('failure', 'unknown')
+
+
+def find_countries(series):
+    '''
+    normalizes a pandas Series of country strings in one call, looking up each distinct value once.
+    returns a DataFrame with the series' index and "status" and "country" columns, as in find_country.
+    missing values stay missing in both columns.
+    '''
+    results = {value: find_country(value) for value in series.dropna().unique()}
+
+    return pd.DataFrame({
+        'status': series.map({value: result[0] for value, result in results.items()}),
+        'country': series.map({value: result[1] for value, result in results.items()})},
+        index=series.index)
@@ -1,7 +1,10 @@
+import abc
 from enum import Enum
 import re
 import unidecode
 
+from . import source_cache
+
 
 class URIs(Enum):
     BANK_TRACK = 'https://www.banktrack.org/service/sections/Bankprofile/financedata'
@@ -12,12 +15,27 @@ class URIs(Enum):
     MARKETFORCES = './sources/marketforces/marketforces.csv'
     CUSTOM_BANK = 'https://docs.google.com/spreadsheets/d/e/2PACX-1vS83tz2TOX3T50O4QR7SEaG2-8o-uLGbic9PAhqqWQ8JcWs_V2v_-XTqtzUG_PxzBk1fLU5YEGyqYJ1/pub?output=csv' # noqa
     WIKIDATA = './sources/wikidata/query.sparql'
-    USNIC_ACTIVE = './sources/USNIC/CSV_ATTRIBUTES_ACTIVE.CSV'
-    USNIC_RELATIONSHIPS = './sources/USNIC/CSV_RELATIONSHIPS.CSV'
-    USNIC_TRANSFORMATIONS = './sources/USNIC/CSV_TRANSFORMATIONS.CSV'
+    USNIC_ACTIVE = './sources/usnic/CSV_ATTRIBUTES_ACTIVE.CSV'
+    USNIC_RELATIONSHIPS = './sources/usnic/CSV_RELATIONSHIPS.CSV'
+    USNIC_TRANSFORMATIONS = './sources/usnic/CSV_TRANSFORMATIONS.CSV'
+
+
+# unique identifiers a source can have. Only the ones a source has are stored, in Source.identifiers
+IDENTIFIERS = ['permid', 'isin', 'viafid', 'lei', 'googleid', 'wikiid', 'rssd', 'rssd_hd', 'cusip',
+               'thrift', 'thrift_hc', 'aba_prim', 'ncua', 'fdic_cert', 'occ', 'ein']
+
+
+class Source(abc.ABC):
+    """
+    Sources are slotted, and subclasses must declare __slots__ for their own attributes.
+    Identifiers are read and set as attributes (source.lei), but only those that are not None are
+    stored, in the identifiers dict, since most sources have few of them.
+    """
+    __slots__ = ['bankreg', 'name', 'countries', 'identifiers', 'subsidiary_tag', 'tag_cache']
 
+    # bump when a change to the loader changes its parsed records, so cached records are reparsed
+    LOADER_VERSION = 1
 
-class Source:
     def __init__(self, bankreg, name, countries,
                  permid=None, isin=None, viafid=None, lei=None, googleid=None, wikiid=None, rssd=None,
                  rssd_hd=None, cusip=None, thrift=None, thrift_hc=None, aba_prim=None, fdic_cert=None, ncua=None,
@@ -25,22 +43,13 @@ class Source:
         self.bankreg = bankreg
         self.name = name.rstrip().lstrip()
         self.countries = countries
-        self.permid = permid
-        self.isin = isin
-        self.viafid = viafid
-        self.lei = lei
-        self.googleid = googleid
-        self.wikiid = wikiid
-        self.rssd = rssd
-        self.rssd_hd = rssd_hd
-        self.cusip = cusip
-        self.thrift = thrift
-        self.thrift_hc = thrift_hc
-        self.aba_prim = aba_prim
-        self.ncua = ncua
-        self.fdic_cert = fdic_cert
-        self.occ = occ
-        self.ein = ein
+
+        identifiers = {'permid': permid, 'isin': isin, 'viafid': viafid, 'lei': lei, 'googleid': googleid,
+                       'wikiid': wikiid, 'rssd': rssd, 'rssd_hd': rssd_hd, 'cusip': cusip, 'thrift': thrift,
+                       'thrift_hc': thrift_hc, 'aba_prim': aba_prim, 'ncua': ncua, 'fdic_cert': fdic_cert,
+                       'occ': occ, 'ein': ein}
+        # None rather than an empty dict when a source has no identifiers
+        self.identifiers = {id_type: value for id_type, value in identifiers.items() if value is not None} or None
 
         # subsidiary tags must be lowercased to prevent bad lookups
         if subsidiary_tag:
@@ -48,6 +57,40 @@ class Source:
 
         self.subsidiary_tag = subsidiary_tag
 
+        # (tag, index generation, number of index keys probed), maintained by BankReg.resolve_tag
+        self.tag_cache = None
+
+    @classmethod
+    @abc.abstractmethod
+    def parse(cls, **kwargs):
+        """
+        Read the source's data and return a list of source instances that are not yet attached to a registry.
+        Parsing does not touch a registry, so sources can be parsed concurrently.
+        """
+
+    @classmethod
+    def input_files(cls, **kwargs):
+        """
+        Local files parse(**kwargs) reads, which key the cache of parsed records.
+        None when they aren't known, e.g. when loading from an api, in which case parsing isn't cached.
+        """
+        return None
+
+    @classmethod
+    def parse_cached(cls, **kwargs):
+        """parse(**kwargs), reusing records cached on disk while the input files are unchanged"""
+        return source_cache.cached_parse(cls, **kwargs)
+
+    @classmethod
+    def register(cls, bankreg, sources):
+        """ attach parsed sources to a registry, in order. Returns the created and updated tags."""
+        return bankreg.create_or_update_banks(sources)
+
+    @classmethod
+    def load_and_create(cls, bankreg, use_cache=False, **kwargs):
+        sources = cls.parse_cached(**kwargs) if use_cache else cls.parse(**kwargs)
+        cls.register(bankreg, sources)
+
     def autogenerate_tag(self):
         """ using the bank name replace spaces with underscores.
             convert accented characters to non accented. Remove special characters."""
@@ -56,24 +99,38 @@ class Source:
         mystr = re.sub('[\W]', '', mystr) # noqa
         return mystr
 
+    def preset_tag(self):
+        """ the tag the source's own data gives its bank, or None to look it up in the registry"""
+        return None
+
     @property
     def tag(self):
-        # Check the id_tag_dict for entries. If there are entries there, return them.
-        lookup_tag = self.bankreg.return_tag_from_id_tag_dict(
-            permid=self.permid, isin=self.isin, viafid=self.viafid, lei=self.lei,
-            googleid=self.googleid, wikiid=self.wikiid, rssd=self.rssd)
-        if lookup_tag:
-            return lookup_tag.lower()
-
-        # check the name_tag_dict. If there is an entry there, return it.
-        name_tag_dict = self.bankreg.name_tag_dict
-        if name_tag_dict.get(self.name):
-            return name_tag_dict.get(self.name).lower()
-
-        # check the name_tag_dict for unidecoded names. If there is an entry there, return it.
-        unidecoded_name = unidecode.unidecode(self.name)
-        if name_tag_dict.get(unidecoded_name):
-            return name_tag_dict.get(unidecoded_name).lower()
-
-        # if all else fails, autogenerate a tag
-        return self.autogenerate_tag().lower()
+        # Check the id_tag_dict, then the name_tag_dict for entries. If there are entries there, return them.
+        # If all else fails, autogenerate a tag. The registry caches the result in tag_cache.
+        tag = self.preset_tag()
+        return tag if tag is not None else self.bankreg.resolve_tag(self)
+
+    def invalidate_tag(self):
+        """ forget the cached tag, e.g. after changing the source's name or identifiers"""
+        self.tag_cache = None
+
+
+def identifier_property(id_type):
+    def get(source):
+        return source.identifiers.get(id_type) if source.identifiers else None
+
+    def set(source, value):
+        identifiers = dict(source.identifiers or {})
+        if value is None:
+            identifiers.pop(id_type, None)
+        else:
+            identifiers[id_type] = value
+        source.identifiers = identifiers or None
+        # the cached tag may have been resolved from the old identifier
+        source.tag_cache = None
+
+    return property(get, set)
+
+
+for id_type in IDENTIFIERS:
+    setattr(Source, id_type, identifier_property(id_type))
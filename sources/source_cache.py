@@ -0,0 +1,205 @@
+"""
+On-disk cache of parsed source records.
+
+A source's parsed records are stored in a parquet file named after the source class and a
+hash of its loader version and the contents of its input files. As long as none of these change,
+a warm run reads the records back instead of parsing CSVs, normalizing countries and cleaning names.
+
+Record attributes are stored one column each. Sets, numpy arrays and dicts are encoded as
+lists, flat float lists and json respectively; anything else that arrow can't hold as is,
+like columns mixing types, is pickled.
+"""
+import glob
+import hashlib
+import json
+import math
+import os
+import pickle
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+CACHE_DIR = './.source_cache'
+
+# bump when the way records are stored changes
+CACHE_FORMAT = 2
+
+# files that affect the parsed records of every source
+SHARED_INPUTS = ['./maps/country_map.py']
+
+# attributes that belong to the registry a source is attached to, not to the parsed record
+REGISTRY_ATTRIBUTES = ['bankreg', 'tag_cache']
+
+FIELDS_METADATA_KEY = b'source_fields'
+READ_CHUNK_SIZE = 1 << 20
+
+
+def is_nan(value):
+    return isinstance(value, float) and math.isnan(value)
+
+
+def cache_key(cls, paths):
+    """sha256 of the cache format, the loader's name and version and the contents of its input files"""
+    hasher = hashlib.sha256((cls.__name__ + ':' + str(cls.LOADER_VERSION) + ':' + str(CACHE_FORMAT)).encode())
+    for path in list(paths) + SHARED_INPUTS:
+        hasher.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def cache_path(cls, key, cache_dir=None):
+    return os.path.join(cache_dir or CACHE_DIR, cls.__name__.lower() + '-' + key[:16] + '.parquet')
+
+
+def record_fields(source):
+    """the source's slots, from Source's down to its own class', except those belonging to the registry"""
+    fields = {}
+    for cls in reversed(type(source).__mro__):
+        for field in cls.__dict__.get('__slots__', []):
+            if field not in REGISTRY_ATTRIBUTES:
+                fields[field] = getattr(source, field, None)
+    return fields
+
+
+def encode_column(values):
+    """returns (field description, arrow array) for the values of one attribute across records"""
+    present = [value for value in values if value is not None and not is_nan(value)]
+    types = set(type(value) for value in present)
+
+    if types == {set}:
+        if all(isinstance(item, str) for value in present for item in value):
+            return {'kind': 'set'}, pa.array([sorted(value) if value is not None else None for value in values],
+                                             type=pa.list_(pa.string()))
+
+    elif types == {np.ndarray}:
+        shapes = set(value.shape for value in present)
+        if len(shapes) == 1 and len(present) == len(values):
+            return ({'kind': 'ndarray', 'shape': list(shapes.pop())},
+                    pa.array([value.astype(float).ravel() for value in values], type=pa.list_(pa.float64())))
+
+    elif types == {dict}:
+        try:
+            return {'kind': 'dict'}, pa.array([json.dumps(value) if value is not None else None for value in values],
+                                              type=pa.string())
+        except TypeError:
+            pass
+
+    elif len(types) <= 1 and types <= {bool, int, float, str}:
+        has_none = any(value is None for value in values)
+        has_nan = any(is_nan(value) for value in values)
+        if types == {str} and has_nan:
+            # arrow strings have no nan, so store nulls and put the nans back when reading
+            if not has_none:
+                return {'kind': 'value', 'missing': 'nan'}, pa.array(
+                    [None if is_nan(value) else value for value in values], type=pa.string())
+        else:
+            try:
+                return {'kind': 'value'}, pa.array(values, from_pandas=False)
+            except (pa.ArrowException, OverflowError):
+                # e.g. ints beyond 64 bits
+                pass
+
+    return {'kind': 'pickle'}, pa.array([pickle.dumps(value) for value in values], type=pa.binary())
+
+
+def decode_column(description, values):
+    kind = description['kind']
+    if kind == 'set':
+        return [set(value) if value is not None else None for value in values]
+    if kind == 'ndarray':
+        shape = tuple(description['shape'])
+        return [np.array(value, dtype=float).reshape(shape) for value in values]
+    if kind == 'dict':
+        # parsing a single json array is much faster than parsing each value
+        return json.loads('[' + ','.join(value if value is not None else 'null' for value in values) + ']')
+    if kind == 'pickle':
+        return [pickle.loads(value) for value in values]
+    if description.get('missing') == 'nan':
+        return [np.nan if value is None else value for value in values]
+    return values
+
+
+def records_table(sources):
+    """arrow table with a column per attribute of sources of a single class, described in the schema metadata"""
+    records = [record_fields(source) for source in sources]
+    fields = list(records[0]) if records else []
+    if any(list(record) != fields for record in records):
+        raise Exception("can't store sources with differing attributes")
+
+    descriptions, columns = {}, {}
+    for field in fields:
+        descriptions[field], columns[field] = encode_column([record[field] for record in records])
+
+    table = pa.table(columns) if fields else pa.table({})
+    return table.replace_schema_metadata({FIELDS_METADATA_KEY: json.dumps(descriptions)})
+
+
+def sources_from_table(cls, table):
+    """sources stored by records_table, without calling the source's constructor. Other columns are ignored."""
+    descriptions = json.loads(table.schema.metadata[FIELDS_METADATA_KEY])
+
+    columns = {field: decode_column(description, table.column(field).to_pylist())
+               for field, description in descriptions.items()}
+
+    return sources_from_columns(cls, columns, table.num_rows)
+
+
+def write_records(path, sources):
+    """write parsed sources of a single class to a parquet file"""
+    table = records_table(sources)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write next to the target and rename, so an interrupted run never leaves a partial cache file behind
+    pq.write_table(table, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def read_records(cls, path):
+    """read sources written by write_records, without calling the source's constructor"""
+    return sources_from_table(cls, pq.read_table(path))
+
+
+def sources_from_columns(cls, columns, n_rows):
+    """build n_rows unregistered sources from a dict of attribute -> list of values, without calling the constructor"""
+    sources = [cls.__new__(cls) for _ in range(n_rows)]
+    for field, values in columns.items():
+        for source, value in zip(sources, values):
+            setattr(source, field, value)
+    for source in sources:
+        source.bankreg = None
+        source.tag_cache = None
+    return sources
+
+
+def sources_from_df(cls, df):
+    """build unregistered sources from a DataFrame with a row per source and a column per attribute"""
+    return sources_from_columns(cls, df.to_dict(orient='list'), len(df))
+
+
+def cached_parse(cls, cache_dir=None, **kwargs):
+    """
+    cls.parse(**kwargs), reusing cached records when the loader's inputs are unchanged.
+    Records are cached in cache_dir, by default the CACHE_DIR set when called.
+    Sources whose input_files are unknown, e.g. when loading from an api, are always parsed.
+    """
+    paths = cls.input_files(**kwargs)
+    if paths is None:
+        return cls.parse(**kwargs)
+
+    cache_dir = cache_dir or CACHE_DIR
+    path = cache_path(cls, cache_key(cls, paths), cache_dir)
+    if os.path.exists(path):
+        return read_records(cls, path)
+
+    sources = cls.parse(**kwargs)
+
+    # only the cache for the current inputs is kept
+    for stale_path in glob.glob(cache_path(cls, '*', cache_dir)):
+        os.remove(stale_path)
+    write_records(path, sources)
+
+    return sources
@@ -8,6 +8,8 @@ class Switchit(Source):
     Switchit is a UK-Based group rating banks, energy providers, and pension funds
     based on their fossil fuel policies.
     """
+    __slots__ = ['rating']
+
     def __init__(self, bankreg, name, rating):
         self.name = name.rstrip().lstrip()
         self.rating = rating
@@ -17,11 +19,17 @@ class Switchit(Source):
                                        countries=set(['United Kingdom']))
 
     @classmethod
-    def load_and_create(cls, bankreg):
+    def input_files(cls):
+        return [URIs.SWITCHIT.value]
+
+    @classmethod
+    def parse(cls):
         df = pd.read_csv(URIs.SWITCHIT.value)
+        banks = []
         for (i, row) in df.iterrows():
             bank = Switchit(
-                bankreg=bankreg,
+                bankreg=None,
                 name=row.company_name,
                 rating=row.rating)
-            bankreg.create_or_update_bank(source=bank)
+            banks.append(bank)
+        return banks
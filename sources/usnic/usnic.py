@@ -1,16 +1,114 @@
+import itertools
+
 import pandas as pd
 
 from sources.source import Source, URIs
 from sources.pycountry_util import find_country
 
 
+# NIC attribute columns holding the identifiers USNIC takes, by argument name
+ID_COLUMNS = {
+    'rssd': '#ID_RSSD',
+    'rssd_hd': 'ID_RSSD_HD_OFF',
+    'lei': 'ID_LEI',
+    'cusip': 'ID_CUSIP',
+    'thrift': 'ID_THRIFT',
+    'thrift_hc': 'ID_THRIFT_HC',
+    'aba_prim': 'ID_ABA_PRIM',
+    'fdic_cert': 'ID_FDIC_CERT',
+    'ncua': 'ID_NCUA',
+    'occ': 'ID_OCC',
+    'ein': 'ID_TAX'}
+ATTRIBUTE_COLUMNS = ['NM_SHORT', 'NM_LGL', 'URL'] + list(ID_COLUMNS.values())
+
+TRANSFORMATION_COLUMNS = ['#ID_RSSD_PREDECESSOR', 'ID_RSSD_SUCCESSOR', 'TRNSFM_CD', 'DT_TRANS']
+RELATIONSHIP_COLUMNS = ['#ID_RSSD_PARENT', 'ID_RSSD_OFFSPRING', 'D_DT_END', 'PCT_EQUITY']
+
+# minimum percentage of equity a parent holds for its offspring to be a subsidiary
+PARENT_EQUITY_THRESHOLD = 20
+
+# rows of the NIC files read at a time
+CHUNK_SIZE = 100000
+
+# transformation codes after which the predecessor no longer exists:
+# 1 = charter discontinued (merger, or purchase and assumption), 50 = failure
+DISCONTINUED_CODES = ['1', '50']
+
+
+class SuccessorIndex:
+    """
+    Resolves historical RSSDs to the RSSD of the institution that survives them today, following chains
+    of mergers in the NIC transformations file. Chains are compressed when the index is built, so resolving
+    an RSSD is a single dict lookup.
+
+    An institution is only followed to a successor if its last discontinuing transformation had a single successor.
+    Failures that were split between several acquirers, and cycles, are left unresolved.
+    """
+
+    def __init__(self, successors):
+        # predecessor rssd -> direct successor rssd
+        self.successors = successors
+        # predecessor rssd -> surviving rssd
+        self.current = self.compress(successors)
+
+    def __len__(self):
+        return len(self.current)
+
+    @classmethod
+    def compress(cls, successors):
+        """follow every chain to its end once, pointing each rssd on the way straight at the end"""
+        current = {}
+        for rssd in successors:
+            path, on_path = [], set()
+            while rssd in successors and rssd not in current and rssd not in on_path:
+                path.append(rssd)
+                on_path.add(rssd)
+                rssd = successors[rssd]
+
+            if rssd in on_path:
+                survivor = None
+            else:
+                survivor = current.get(rssd, rssd)
+
+            for predecessor in path:
+                current[predecessor] = survivor
+
+        return {rssd: survivor for rssd, survivor in current.items() if survivor is not None}
+
+    @classmethod
+    def from_df(cls, df):
+        df = df[df['TRNSFM_CD'].isin(DISCONTINUED_CODES)]
+
+        # keep each predecessor's last transformation, if it had a single successor. DT_TRANS is yyyymmdd
+        dates = pd.to_numeric(df['DT_TRANS'])
+        df = df[dates == dates.groupby(df['#ID_RSSD_PREDECESSOR']).transform('max')]
+        df = df[df.groupby('#ID_RSSD_PREDECESSOR')['ID_RSSD_SUCCESSOR'].transform('nunique') == 1]
+
+        return cls(dict(zip(df['#ID_RSSD_PREDECESSOR'].tolist(), df['ID_RSSD_SUCCESSOR'].tolist())))
+
+    @classmethod
+    def from_csv(cls, path=URIs.USNIC_TRANSFORMATIONS.value):
+        return cls.from_df(pd.read_csv(path, usecols=TRANSFORMATION_COLUMNS, dtype=str))
+
+    def resolve(self, rssd):
+        return self.current.get(rssd, rssd)
+
+    def resolve_series(self, rssds):
+        return rssds.map(self.current).fillna(rssds)
+
+
 class USNIC(Source):
     """
     Data from the US National Information Center. This must be manually downloaded, and contains data on
     Banks operating in the US and their owners. The data is quite accurate, but can contain banks that are shut down
     or no longer accept deposits. It also only tracks legal entities, but not brands, creating many entities for what
     most people think of as a single entity. For example, "Bank of America Maryland, vs Bank of America"
+
+    Identifiers are read as strings exactly as they appear in the NIC files; missing identifiers are None.
     """
+    __slots__ = ['aliases', 'website']
+
+    LOADER_VERSION = 2
 
     def __init__(self, bankreg, name, aliases, country, rssd, rssd_hd, lei,
                  cusip, thrift, thrift_hc, aba_prim, fdic_cert, ncua, occ, ein,
@@ -44,54 +142,115 @@ class USNIC(Source):
         return super(USNIC, self).tag
 
     @classmethod
-    def instantiate_banks(cls, bankreg):
+    def input_files(cls, path=URIs.USNIC_ACTIVE.value, chunksize=CHUNK_SIZE):
+        return [path]
+
+    @classmethod
+    def read_attributes(cls, path=URIs.USNIC_ACTIVE.value, chunksize=CHUNK_SIZE):
         """
-        Populate the initial us_nic banks
+        Stream the NIC attributes file in chunks of rows, reading only the columns USNIC uses.
+        Yields one dict of column -> list of strings per chunk, with None for missing values.
         """
-        df = pd.read_csv(URIs.USNIC_ACTIVE.value)
-        bank = None
-
-        for (i, row) in df.iterrows():
-            bank = USNIC(
-                bankreg=bankreg,
-                name=row['NM_SHORT'],
-                aliases=[row['NM_SHORT'], row['NM_LGL']],  # TODO: include long names.
-                country=find_country('United States')[1],
-                rssd=str(row['#ID_RSSD']),
-                rssd_hd=str(row['ID_RSSD_HD_OFF']),
-                lei=str(row['ID_LEI']),
-                cusip=str(row['ID_CUSIP']),
-                thrift=str(row['ID_THRIFT']),
-                thrift_hc=str(row['ID_THRIFT_HC']),
-                aba_prim=str(row['ID_ABA_PRIM']),
-                fdic_cert=str(row['ID_FDIC_CERT']),
-                ncua=str(row['ID_NCUA']),
-                occ=str(row['ID_OCC']),
-                ein=str(row['ID_TAX']),
-                website=row['URL'],
-                subsidiary_tag=None)
-            bankreg.create_or_update_bank(source=bank)
-
-        return bank
+        for chunk in pd.read_csv(path, usecols=ATTRIBUTE_COLUMNS, dtype=str, chunksize=chunksize):
+            yield {column: chunk[column].astype(object).where(chunk[column].notna(), None).tolist()
+                   for column in ATTRIBUTE_COLUMNS}
 
     @classmethod
-    def link_parents(cls, bankreg):
-        # cycle through banks again, this time adding parent relationships
+    def iter_parse(cls, path=URIs.USNIC_ACTIVE.value, chunksize=CHUNK_SIZE):
+        """yields USNIC sources chunk by chunk, so only one chunk of the file is held in memory at a time"""
+        country = find_country('United States')[1]
+        id_names = list(ID_COLUMNS)
 
-        df = pd.read_csv(URIs.USNIC_RELATIONSHIPS.value)
-        for (i, row) in df.iterrows():
-            parent_tag = bankreg.id_tag_dict['rssd'].get(str(row['#ID_RSSD_PARENT']))
-            offspring_tag = bankreg.id_tag_dict['rssd'].get(str(row['ID_RSSD_OFFSPRING']))
-            offspring = bankreg.reg.get(offspring_tag)
+        for columns in cls.read_attributes(path, chunksize):
+            ids = zip(*(columns[column] for column in ID_COLUMNS.values()))
+            for name, legal_name, website, row_ids in zip(columns['NM_SHORT'], columns['NM_LGL'], columns['URL'], ids):
+                yield USNIC(
+                    bankreg=None,
+                    name=name,
+                    aliases=[name, legal_name],  # TODO: include long names.
+                    country=country,
+                    website=website,
+                    subsidiary_tag=None,
+                    **dict(zip(id_names, row_ids)))
 
-            ongoing = '12/31/9999' in row['D_DT_END']
-            pct_equity = int(row['PCT_EQUITY'])
+    @classmethod
+    def parse(cls, path=URIs.USNIC_ACTIVE.value, chunksize=CHUNK_SIZE):
+        """
+        Populate the initial us_nic banks.
+        The file is read a chunk at a time, but every source is returned in one list, so memory grows with the
+        number of rows. load_and_create and the pipeline register from iter_parse instead, see register.
+        """
+        return list(cls.iter_parse(path, chunksize))
+
+    @classmethod
+    def parent_assignments(cls, bankreg, path=URIs.USNIC_RELATIONSHIPS.value, chunksize=CHUNK_SIZE):
+        """
+        Join the NIC relationships file against the registry's rssd index.
+        Returns a dict of offspring tag -> parent tag for ongoing relationships where the parent holds at least
+        PARENT_EQUITY_THRESHOLD percent. When an offspring has several such parents, the last one in the file wins.
+        """
+        rssd_tags = pd.Series(bankreg.id_tag_dict['rssd'], dtype=object)
+        successors = bankreg.rssd_successors
 
-            if parent_tag and offspring_tag and offspring and ongoing and pct_equity >= 20:
-                offspring.usnic.subsidiary_tag = parent_tag
+        def rssd_keys(rssds):
+            return successors.resolve_series(rssds) if successors is not None else rssds
+
+        links = []
+        for chunk in pd.read_csv(path, usecols=RELATIONSHIP_COLUMNS, dtype=str, chunksize=chunksize):
+            ongoing = chunk['D_DT_END'].str.contains('12/31/9999', regex=False, na=False)
+            equity = pd.to_numeric(chunk['PCT_EQUITY'], errors='coerce')
+            chunk = chunk[ongoing & (equity >= PARENT_EQUITY_THRESHOLD)]
+
+            links.append(pd.DataFrame({'parent': rssd_keys(chunk['#ID_RSSD_PARENT']).map(rssd_tags),
+                                       'offspring': rssd_keys(chunk['ID_RSSD_OFFSPRING']).map(rssd_tags)}))
+
+        if not links:
+            return {}
+
+        links = pd.concat(links).dropna()
+        links = links[links['offspring'].isin(bankreg.reg.keys())]
+        links = links.drop_duplicates('offspring', keep='last')
+
+        return dict(zip(links['offspring'], links['parent']))
+
+    @classmethod
+    def link_parents(cls, bankreg, path=URIs.USNIC_RELATIONSHIPS.value):
+        """sets the subsidiary tag of USNIC banks owned by another registered bank, returns the assignments"""
+        assignments = cls.parent_assignments(bankreg, path)
+        for offspring_tag, parent_tag in assignments.items():
+            offspring = bankreg.reg[offspring_tag]
+            offspring.usnic.subsidiary_tag = parent_tag
+            offspring.invalidate_cache()
+        return assignments
 
     @classmethod
-    def load_and_create(cls, bankreg):
+    def register_chunks(cls, bankreg, sources, chunksize=CHUNK_SIZE):
+        """
+        attach sources to a registry with a create_or_update_banks call per chunksize sources, so that an iterator
+        of sources is registered without holding all of them. Returns the created and updated tags, as a single call
+        would: banks created in an earlier chunk are not reported as updated.
+        """
+        sources = iter(sources)
+        created, updated = {}, {}
+        while True:
+            chunk = list(itertools.islice(sources, chunksize))
+            if not chunk:
+                break
+            summary = bankreg.create_or_update_banks(chunk)
+            created.update(dict.fromkeys(summary['created']))
+            updated.update(dict.fromkeys(tag for tag in summary['updated'] if tag not in created))
+        return {'created': list(created), 'updated': list(updated)}
 
-        cls.instantiate_banks(bankreg)
+    @classmethod
+    def register(cls, bankreg, sources):
+        # banks merged into others share the tag of the bank that survives them
+        bankreg.set_rssd_successors(SuccessorIndex.from_csv())
+        summary = cls.register_chunks(bankreg, sources)
         cls.link_parents(bankreg)
+        return summary
+
+    @classmethod
+    def load_and_create(cls, bankreg, use_cache=False, **kwargs):
+        # the cache holds every source, otherwise they are registered as they are read
+        sources = cls.parse_cached(**kwargs) if use_cache else cls.iter_parse(**kwargs)
+        cls.register(bankreg, sources)
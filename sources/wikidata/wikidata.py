@@ -1,10 +1,14 @@
+from collections import defaultdict
+
 from qwikidata.sparql import return_sparql_query_results
 
 import pandas as pd
-import np
 
 from sources.source import Source, URIs
-from sources.pycountry_util import find_country
+from sources.pycountry_util import find_countries
+
+
+WIKIDATA_URI_PATTERN = r'https*\:\/\/w+\.wikidata\.org\/[a-zA-Z]+\/'
 
 
 class Wikidata(Source):
@@ -20,8 +24,17 @@ class Wikidata(Source):
     These ID's are used for de-duplication of banks.
     """
 
+    # sparql result columns where only the first value found for a bank is used
+    FIRST_VALUE_COLUMNS = ['bankLabel.value', 'bankLabel.xml:lang', 'bankDescription.value', 'permid.value',
+                           'isin.value', 'viafid.value', 'lei.value', 'gid.value', 'parent.value']
+    # sparql result columns where all values found for a bank are collected
+    SET_VALUE_COLUMNS = ['bankLabel.value', 'bankAltLabel.value', 'website.value', 'countryLabel.value',
+                         'countryLabel.status', 'instanceLabel.value', 'twitter.value', 'deathyear.value']
+
+    __slots__ = ['language', 'websites', 'bank_types', 'twitters', 'description', 'aliases', 'parent_wikiid']
+
     def __init__(self, bankreg, name, language, websites, countries, bank_types, twitters, description, aliases,
-                 permid, isin, viafid, lei, googleid, wikiid, subsidiary_tag=None):
+                 permid, isin, viafid, lei, googleid, wikiid, subsidiary_tag=None, parent_wikiid=None):
         self.name = name.rstrip().lstrip()
         self.language = language
         self.websites = websites
@@ -30,6 +43,9 @@ class Wikidata(Source):
         self.description = description
         self.aliases = aliases
 
+        # wikiid of the parent bank, linked to a subsidiary_tag once all banks are registered
+        self.parent_wikiid = parent_wikiid
+
         super(Wikidata, self).__init__(bankreg=bankreg,
                                        name=name,
                                        countries=set(countries),
@@ -63,95 +79,136 @@ class Wikidata(Source):
         return res
 
     @classmethod
-    def instantiate_bank(cls, bankreg, df):
+    def collect_values(cls, df, column):
+        """returns a dict mapping each bank.value to the set of non-nan values of column for that bank"""
+        pairs = df[['bank.value', column]].dropna().drop_duplicates()
+
+        values = defaultdict(set)
+        for bank_value, value in zip(pairs['bank.value'], pairs[column]):
+            values[bank_value].add(value)
+        return values
+
+    @classmethod
+    def instantiate_bank(cls, wikiid, firsts, sets):
         """
-        Parse a dataframe looking for the bank uri. Extract values from it and instantiate a bank
-        if the bank is probably a modern one.
+        Given the values collected for a single bank uri, instantiate a bank if the bank is probably a modern one.
+        firsts maps columns to the first non-nan value found for the bank (or None),
+        sets maps columns to the set of all non-nan values found for the bank.
+        Country labels are expected to be normalized already, with their find_country status in countryLabel.status.
         """
         # get a single name for the bank
-        labels = set(df['bankLabel.value'])
-        labels = {x for x in labels if x == x}
-        name = cls.discard_nan_and_return_first_value(labels)
+        labels = sets['bankLabel.value']
+        name = firsts['bankLabel.value']
 
         # get the languages of the name
-        language = cls.discard_nan_and_return_first_value(
-            set(df['bankLabel.xml:lang']))
+        language = firsts['bankLabel.xml:lang']
 
         # get aliases and combine with labels
-        aliases = set(df['bankAltLabel.value'])
-        aliases = {x for x in aliases if x == x}
-        aliases = aliases.union(labels)
-
-        websites = set(df['website.value'])
-        websites = {x for x in websites if x == x}
-
-        countries = set(df['countryLabel.value'])
-        countries = {x for x in countries if x == x}
-
-        bank_types = set(df['instanceLabel.value'])
-        bank_types = {x for x in bank_types if x == x}
-
-        twitters = set(df['twitter.value'])
-        twitters = {x for x in twitters if x == x}
+        aliases = sets['bankAltLabel.value'].union(labels)
 
-        # get the identifiers
-        permid = cls.discard_nan_and_return_first_value(set(df['permid.value']))
-        isin = cls.discard_nan_and_return_first_value(set(df['isin.value']))
-        viafid = cls.discard_nan_and_return_first_value(set(df['viafid.value']))
-        lei = cls.discard_nan_and_return_first_value(set(df['lei.value']))
-        # unclear why, but qwikidata falls over when using ?googleid as a parm. use gid instead.
-        googleid = cls.discard_nan_and_return_first_value(set(df['gid.value']))
-        wikiid = cls.discard_nan_and_return_first_value(set(df['bank.value']))
-
-        # get the first description
-        description = cls.discard_nan_and_return_first_value(
-            set(df['bankDescription.value']))
+        websites = sets['website.value']
+        countries = sets['countryLabel.value']
+        bank_types = sets['instanceLabel.value']
+        twitters = sets['twitter.value']
 
         # used only for excluding banks that have been closed
-        # discard nan, using fact that nan != nan
-        closing_year = set(df['deathyear.value'])
-        closing_year = {x for x in closing_year if x == x}
+        closing_year = sets['deathyear.value']
 
         # is the bank's country current or historical?
         # if its a historical country, don't add to the dataset
-        country_tuples = [find_country(x) for x in countries]
-
-        modern_country = True
-        for mytup in country_tuples:
-            if mytup[0] == 'failure':
-                modern_country = False
-
-        countries = [x[1] for x in country_tuples]
+        modern_country = 'failure' not in sets['countryLabel.status']
 
         # if the country is modern, its closing year does not exist, it has a language, and it has a name
         # add to the dataset
         bank = None
         if modern_country and len(closing_year) < 1 and language and name is not None:
             bank = Wikidata(
-                bankreg=bankreg,
+                bankreg=None,
                 name=name,
                 language=language,
                 websites=websites,
                 countries=countries,
                 bank_types=bank_types,
                 twitters=twitters,
-                description=description,
+                description=firsts['bankDescription.value'],
                 aliases=aliases,
-                permid=permid,
-                isin=isin,
-                viafid=viafid,
-                lei=lei,
-                googleid=googleid,
-                wikiid=wikiid)
-            bankreg.create_or_update_bank(source=bank)
+                permid=firsts['permid.value'],
+                isin=firsts['isin.value'],
+                viafid=firsts['viafid.value'],
+                lei=firsts['lei.value'],
+                # unclear why, but qwikidata falls over when using ?googleid as a parm. use gid instead.
+                googleid=firsts['gid.value'],
+                wikiid=wikiid,
+                parent_wikiid=firsts['parent.value'])
 
         return bank
 
     @classmethod
-    def load_and_create(cls, bankreg, load_from_api=True):
+    def parse_df(cls, df):
+        """
+        Instantiate banks from a sparql result, which has one row per combination of bound variables.
+        Rows are grouped by bank uri in a single pass, so parsing grows linearly with the size of the result
+        rather than filtering the whole result once per bank.
+        """
+        # do some string replacement for easier manipulation of parent/subsidiary relationships
+        bank_values = df['bank.value'].str.replace(WIKIDATA_URI_PATTERN, '', regex=True)
+        parent_values = df['parent.value'].str.replace(WIKIDATA_URI_PATTERN, '', regex=True)
+
+        # remove all parent/subsidiary_of relationships that are not banks.
+        parent_values = parent_values.where(parent_values.isin(bank_values.unique()))
+        df = df.assign(**{'bank.value': bank_values, 'parent.value': parent_values})
+
+        # normalize each distinct country label once rather than once per bank
+        countries = find_countries(df['countryLabel.value'])
+        df = df.assign(**{'countryLabel.value': countries['country'], 'countryLabel.status': countries['status']})
+
+        firsts = df.groupby('bank.value', sort=True)[cls.FIRST_VALUE_COLUMNS].first()
+        firsts = firsts.astype(object).where(firsts.notna(), None)
+        sets = {column: cls.collect_values(df, column) for column in cls.SET_VALUE_COLUMNS}
+
+        banks = []
+        for wikiid, bank_firsts in zip(firsts.index, firsts.to_dict(orient='records')):
+            bank_sets = {column: sets[column].get(wikiid, set()) for column in cls.SET_VALUE_COLUMNS}
+            bank = cls.instantiate_bank(wikiid, bank_firsts, bank_sets)
+            if bank:
+                banks.append(bank)
+        return banks
+
+    @classmethod
+    def register(cls, bankreg, sources):
+        # add banks, temporarily ignoring parent relationships
+        summary = super(Wikidata, cls).register(bankreg, sources)
+
+        # cycle through banks again, this time adding parent relationships
+        for source in sources:
+            if source.parent_wikiid is None:
+                continue
+
+            tag = bankreg.id_tag_dict['wikiid'].get(source.wikiid)
+            parent_tag = bankreg.id_tag_dict['wikiid'].get(source.parent_wikiid)
+            bank = bankreg.reg.get(tag)
+
+            # not all parents are entered in the db, so not all will be found
+            if parent_tag and bank and bank.wikidata:
+                bank.wikidata.subsidiary_tag = parent_tag.lower().rstrip().lstrip()
+                bank.invalidate_cache()
+
+        return summary
+
+    @classmethod
+    def create_from_df(cls, bankreg, df):
+        cls.register(bankreg, cls.parse_df(df))
+
+    @classmethod
+    def input_files(cls, load_from_api=True):
+        # the api's response is only known after fetching it
+        return None if load_from_api else ['./sources/wikidata/wikidata.csv']
+
+    @classmethod
+    def parse(cls, load_from_api=True):
 
         # query wikidata and convert into dataframe
-        # TODO: Use a wikidata endpoint directly and parse results instead of relying on 
+        # TODO: Use a wikidata endpoint directly and parse results instead of relying on
         # qwikidata
         df = None
         if not load_from_api:
@@ -163,38 +220,8 @@ class Wikidata(Source):
             df = pd.json_normalize(res['results']['bindings'])
             df.to_csv('./sources/wikidata/wikidata.csv')
 
-        # do some string replacement for easier manipulation of parent/subsidiary relationships
-        df['bank.value'] = df['bank.value'].str.replace('https*\:\/\/w+\.wikidata\.org\/[a-zA-Z]+\/', '', regex=True)  # noqa
-        df['parent.value'] = df['parent.value'].str.replace('https*\:\/\/w+\.wikidata\.org\/[a-zA-Z]+\/', '')  # noqa
-
-        # remove all parent/subsidiary_of relationships that are not banks.
-        bank_values = set(df['bank.value'])
-
-        def only_allowed(val):
-            if val in bank_values:
-                return val
-            return np.nan
-        df['parent.value'] = df['parent.value'].apply(only_allowed)
-
-        # cycle through banks and add them, temporarily ignoring parent relationships
-        bank_values = set(df['bank.value'])
-        for bank_value in bank_values:
-            bank_df = df[df['bank.value'] == bank_value]
-            bank = cls.instantiate_bank(bankreg, bank_df)
-
-        # cycle through banks again, this time adding parent relationships
-        for bank_value in bank_values:
-
-            # not all banks are entered in the db, so not all will be found
-            tag = bankreg.id_tag_dict['wikiid'].get(bank_value)
-            bank_df = df[df['bank.value'] == bank_value]
-
-            if tag:
+        return cls.parse_df(df)
 
-                bank = bankreg.reg[tag]
-
-                parent = cls.discard_nan_and_return_first_value(
-                    set(bank_df['parent.value']))
-
-                if parent and bank.wikidata:
-                    bank.wikidata.subsidiary_tag = bankreg.id_tag_dict['wikiid'].get(parent).lower().rstrip().lstrip()
+    @classmethod
+    def load_and_create(cls, bankreg, load_from_api=True, use_cache=False):
+        super(Wikidata, cls).load_and_create(bankreg, use_cache=use_cache, load_from_api=load_from_api)
@@ -1,4 +1,11 @@
-import pandas as pd
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
 
 from bankreg import BankReg
 from sources.banktrack.banktrack import Banktrack
@@ -54,15 +61,9 @@ ran1 = BOCC(bankreg=bankreg,
             assets_2020=100,
             coal_score=20,
             og_score=40,
-            total_financing=pd.Series(['a', 'b', 'c']),
-            arctic_og_financing=pd.Series(['a', 'b', 'c']),
-            coal_mining_financing=pd.Series(['a', 'b', 'c']),
-            coal_power_financing=pd.Series(['a', 'b', 'c']),
-            expansion_financing=pd.Series(['a', 'b', 'c']),
-            fracking_financing=pd.Series(['a', 'b', 'c']),
-            lng_financing=pd.Series(['a', 'b', 'c']),
-            offshore_financing=pd.Series(['a', 'b', 'c']),
-            tar_sands_financing=pd.Series(['a', 'b', 'c']))
+            financing_amounts=np.zeros((9, 5)),
+            financing_totals=np.zeros(9),
+            financing_ranks=np.full(9, 30))
 
 ran2 = BOCC(bankreg=bankreg,
             name='Bank name',
@@ -77,15 +78,9 @@ ran2 = BOCC(bankreg=bankreg,
             assets_2020=100,
             coal_score=20,
             og_score=40,
-            total_financing=pd.Series(['a', 'b', 'c']),
-            arctic_og_financing=pd.Series(['a', 'b', 'c']),
-            coal_mining_financing=pd.Series(['a', 'b', 'c']),
-            coal_power_financing=pd.Series(['a', 'b', 'c']),
-            expansion_financing=pd.Series(['a', 'b', 'c']),
-            fracking_financing=pd.Series(['a', 'b', 'c']),
-            lng_financing=pd.Series(['a', 'b', 'c']),
-            offshore_financing=pd.Series(['a', 'b', 'c']),
-            tar_sands_financing=pd.Series(['a', 'b', 'c']))
+            financing_amounts=np.zeros((9, 5)),
+            financing_totals=np.zeros(9),
+            financing_ranks=np.full(9, 30))
 
 # a BOCC bank with what should be a name similar banktrack 1
 ran3 = BOCC(bankreg=bankreg,
@@ -101,15 +96,9 @@ ran3 = BOCC(bankreg=bankreg,
             assets_2020=100,
             coal_score=20,
             og_score=40,
-            total_financing=pd.Series(['a', 'b', 'c']),
-            arctic_og_financing=pd.Series(['a', 'b', 'c']),
-            coal_mining_financing=pd.Series(['a', 'b', 'c']),
-            coal_power_financing=pd.Series(['a', 'b', 'c']),
-            expansion_financing=pd.Series(['a', 'b', 'c']),
-            fracking_financing=pd.Series(['a', 'b', 'c']),
-            lng_financing=pd.Series(['a', 'b', 'c']),
-            offshore_financing=pd.Series(['a', 'b', 'c']),
-            tar_sands_financing=pd.Series(['a', 'b', 'c']))
+            financing_amounts=np.zeros((9, 5)),
+            financing_totals=np.zeros(9),
+            financing_ranks=np.full(9, 30))
 
 # 'Banco Santander': 'santander',
 ran4 = BOCC(bankreg=bankreg,
@@ -125,15 +114,9 @@ ran4 = BOCC(bankreg=bankreg,
             assets_2020=100,
             coal_score=20,
             og_score=40,
-            total_financing=pd.Series(['a', 'b', 'c']),
-            arctic_og_financing=pd.Series(['a', 'b', 'c']),
-            coal_mining_financing=pd.Series(['a', 'b', 'c']),
-            coal_power_financing=pd.Series(['a', 'b', 'c']),
-            expansion_financing=pd.Series(['a', 'b', 'c']),
-            fracking_financing=pd.Series(['a', 'b', 'c']),
-            lng_financing=pd.Series(['a', 'b', 'c']),
-            offshore_financing=pd.Series(['a', 'b', 'c']),
-            tar_sands_financing=pd.Series(['a', 'b', 'c']))
+            financing_amounts=np.zeros((9, 5)),
+            financing_totals=np.zeros(9),
+            financing_ranks=np.full(9, 30))
 
 gabv1 = Gabv(bankreg=bankreg,
              name='Banco Santander',
@@ -191,3 +174,121 @@ subsidiary_bank = Custombank(bankreg=bankreg,
                              name='subsidiary_bank',
                              subsidiary_tag='hsbc',
                              bank_tag='')
+
+
+class FakeAirtable:
+    '''
+    an in-memory stand-in for an airtable.Airtable table, counting requests like the api would see them.
+    Each request takes latency seconds, and every throttle_every-th request is rejected with a 429.
+    Inserts and updates of records tagged with one of rejected_tags, or named one of rejected_names, fail with a 422,
+    like airtable's typecast errors.
+    Reads are a request per page of 100 records, and are throttled like writes. They only understand the formula of
+    BankGreenAirtable.modified_since_formula, and count the bytes they return.
+    '''
+
+    MAX_RECORDS_PER_REQUEST = 10
+    PAGE_SIZE = 100
+
+    def __init__(self, rows=(), latency=0, throttle_every=0):
+        self.records = {}
+        # record id -> when it was last modified, in utc
+        self.modified = {}
+        self.requests = 0
+        self.transferred = 0
+        self.throttled = 0
+        self.next_id = 0
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.rejected_tags = set()
+        self.rejected_names = set()
+        self.lock = threading.Lock()
+        for fields in rows:
+            self.add(fields)
+
+    def add(self, fields):
+        with self.lock:
+            record_id = 'rec' + str(self.next_id).zfill(14)
+            self.next_id += 1
+            self.records[record_id] = dict(fields)
+            self.modified[record_id] = datetime.now(timezone.utc)
+        return {'id': record_id, 'fields': dict(fields)}
+
+    def request(self, records, per_request=MAX_RECORDS_PER_REQUEST):
+        ''' count the requests needed for records, raising a 429 when a request is throttled '''
+        n_requests = -(-len(records) // per_request)
+        time.sleep(self.latency * n_requests)
+        with self.lock:
+            for _ in range(n_requests):
+                self.requests += 1
+                if self.throttle_every and self.requests % self.throttle_every == 0:
+                    self.throttled += 1
+                    response = requests.Response()
+                    response.status_code = 429
+                    raise requests.exceptions.HTTPError('429 Client Error: Too Many Requests', response=response)
+
+    def reject(self, records):
+        ''' raise a 422 if any of records is tagged with one of rejected_tags or named one of rejected_names '''
+        if any(record.get('tag') in self.rejected_tags or record.get('name') in self.rejected_names
+               for record in records):
+            response = requests.Response()
+            response.status_code = 422
+            raise requests.exceptions.HTTPError('422 Client Error: Unprocessable Entity', response=response)
+
+    @staticmethod
+    def empty(value):
+        ''' whether airtable leaves the value out of a record: blank text, unchecked boxes and empty lists '''
+        return value is None or value is False or (isinstance(value, (str, list)) and not value)
+
+    def get_page(self, offset=None, fields=None, formula=None):
+        ''' like airtableutils.PagedAirtable.get_page: a page of records, and the offset of the next page or None '''
+        since = None
+        if formula is not None:
+            match = re.fullmatch(r"IS_AFTER\(LAST_MODIFIED_TIME\(\), DATETIME_PARSE\('(.+)'\)\)", formula)
+            if match is None:
+                raise Exception('unsupported formula: ' + formula)
+            since = datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+
+        # a single request for the page, even if it is empty
+        self.request([offset])
+        start = int(offset or 0)
+        # like airtable, only the requested fields, leaving out empty ones
+        with self.lock:
+            record_ids = [record_id for record_id in self.records if since is None or self.modified[record_id] > since]
+            records = [{'id': record_id,
+                        'fields': {field: value for field, value in self.records[record_id].items()
+                                   if (fields is None or field in fields) and not self.empty(value)}}
+                       for record_id in record_ids[start:start + self.PAGE_SIZE]]
+            self.transferred += len(json.dumps(records))
+        end = start + self.PAGE_SIZE
+        return records, str(end) if end < len(record_ids) else None
+
+    def get_all(self, fields=None, formula=None):
+        ''' every matching record, a page at a time like airtable.Airtable.get_all, without retrying throttled pages '''
+        records, offset = [], None
+        while True:
+            page, offset = self.get_page(offset, fields=fields, formula=formula)
+            records += page
+            if offset is None:
+                return records
+
+    def batch_insert(self, records, typecast=False):
+        self.request(records)
+        self.reject(records)
+        return [self.add(fields) for fields in records]
+
+    def batch_update(self, records, typecast=False):
+        self.request(records)
+        self.reject([record['fields'] for record in records])
+        with self.lock:
+            for record in records:
+                self.records[record['id']].update(record['fields'])
+                self.modified[record['id']] = datetime.now(timezone.utc)
+            return [{'id': record['id'], 'fields': dict(self.records[record['id']])} for record in records]
+
+    def batch_delete(self, record_ids):
+        self.request(record_ids)
+        with self.lock:
+            for record_id in record_ids:
+                del self.records[record_id]
+                del self.modified[record_id]
+        return [{'id': record_id, 'deleted': True} for record_id in record_ids]